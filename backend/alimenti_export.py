@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+EXPORT_FORMATS = ("csv", "ndjson")
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Tipo non serializzabile: {type(value).__name__}")
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_export(columns, batches, fmt: str):
+    """
+    Encode batches of alimenti rows as CSV or NDJSON text
+
+    The output uses the database column names, so an exported file can be
+    uploaded again to POST /alimenti/bulk. Every batch becomes a single
+    chunk, which keeps the number of writes to the response low.
+
+    Args:
+        columns: Column names of the rows
+        batches: Iterable of lists of row tuples
+        fmt: 'csv' or 'ndjson'
+
+    Yields:
+        Text chunks of the export
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato non supportato: {fmt}. Usare uno tra: {', '.join(EXPORT_FORMATS)}")
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows([_csv_value(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # An empty table still yields the header
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+        for rows in batches:
+            yield "".join(encoder.encode(dict(zip(columns, row))) + "\n" for row in rows)
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError, create_model
+
+from database import ALIMENTI_REQUIRED_FIELDS
+from models import AlimentoCreate
+
+FORMATS = ("csv", "ndjson")
+
+# Rejected rows reported back in detail; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+_FIELDS = tuple(AlimentoCreate.model_fields)
+
+
+def detect_format(content_type: str):
+    """Guess the import format from a Content-Type header"""
+    content_type = (content_type or "").lower()
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type or "json-seq" in content_type:
+        return "ndjson"
+    return None
+
+
+class AlimentiImport:
+    """
+    Parse and validate a bulk alimenti upload
+
+    Rows are validated one at a time against the AlimentoCreate fields while
+    they are consumed by rows(), so a large upload is never held as a list
+    of parsed records. Invalid rows are skipped and recorded in errors.
+    """
+
+    def __init__(self, data: bytes, fmt: str):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato non supportato: {fmt}. Usare uno tra: {', '.join(FORMATS)}")
+
+        try:
+            self._text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise ValueError("Il file deve essere codificato in UTF-8")
+
+        self.format = fmt
+        self.rejected = 0
+        self.errors = []
+
+        if fmt == "csv":
+            fieldnames = self._csv_fieldnames()
+        else:
+            fieldnames = self._ndjson_fieldnames()
+
+        self.columns = [field for field in _FIELDS if field in fieldnames]
+        self.ignored_columns = sorted(set(fieldnames) - set(_FIELDS))
+        missing = [field for field in ("alimento", "sorgente") if field not in self.columns]
+        if missing:
+            raise ValueError(f"Colonne obbligatorie mancanti: {', '.join(missing)}")
+
+        # Validating only the uploaded columns is much cheaper than the full model
+        self._model = create_model(
+            "AlimentoImportRow",
+            **{field: (AlimentoCreate.model_fields[field].annotation, AlimentoCreate.model_fields[field])
+               for field in self.columns}
+        )
+
+    def rows(self):
+        """
+        Yield the valid rows
+
+        Yields:
+            Tuples of (row number, tuple of values in columns order)
+        """
+        records = self._csv_records() if self.format == "csv" else self._ndjson_records()
+        for row_number, record in records:
+            if isinstance(record, str):
+                self._reject(row_number, record)
+                continue
+            values = self._validate(row_number, record)
+            if values is not None:
+                yield row_number, values
+
+    def _csv_fieldnames(self):
+        first_line = self._text.split("\n", 1)[0]
+        try:
+            self._dialect = csv.Sniffer().sniff(first_line, delimiters=",;\t")
+        except csv.Error:
+            self._dialect = csv.excel
+        header = next(csv.reader(io.StringIO(first_line), self._dialect), [])
+        return [name.strip() for name in header]
+
+    def _csv_records(self):
+        reader = csv.reader(io.StringIO(self._text), self._dialect)
+        header = [name.strip() for name in next(reader, [])]
+        for row_number, values in enumerate(reader, start=2):
+            if not any(value.strip() for value in values):
+                continue
+            if len(values) != len(header):
+                yield row_number, f"Numero di colonne errato: {len(values)} invece di {len(header)}"
+                continue
+            yield row_number, dict(zip(header, values))
+
+    def _ndjson_lines(self):
+        for row_number, line in enumerate(self._text.splitlines(), start=1):
+            if line.strip():
+                yield row_number, line
+
+    def _ndjson_fieldnames(self):
+        # Every record may carry different keys: the columns are their union
+        fieldnames = set()
+        for _, line in self._ndjson_lines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                fieldnames.update(record)
+        return fieldnames
+
+    def _ndjson_records(self):
+        for row_number, line in self._ndjson_lines():
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row_number, f"JSON non valido: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield row_number, "Ogni riga deve essere un oggetto JSON"
+                continue
+            yield row_number, record
+
+    def _validate(self, row_number: int, record: dict):
+        data = {}
+        for field in self.columns:
+            value = record.get(field)
+            if isinstance(value, str):
+                value = value.strip()
+                if value == "":
+                    value = None
+                elif field not in ("alimento", "sorgente"):
+                    # Decimal commas, as in Italian spreadsheets
+                    value = value.replace(",", ".")
+            if value is not None:
+                data[field] = value
+
+        try:
+            alimento = self._model.model_validate(data)
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            self._reject(row_number, f"{field}: {error['msg']}")
+            return None
+
+        missing = [field for field in ALIMENTI_REQUIRED_FIELDS if getattr(alimento, field, None) is None]
+        if missing:
+            self._reject(row_number, f"Campi obbligatori mancanti: {', '.join(missing)}")
+            return None
+
+        return tuple(getattr(alimento, field) for field in self.columns)
+
+    def _reject(self, row_number: int, error: str):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": error})
@@ -0,0 +1,86 @@
+"""
+Async twin of database.py for the FastAPI endpoints.
+
+Every function here has the same name and signature as its counterpart in
+database.py but is a coroutine: the blocking psycopg2 call runs in a worker
+thread, so a slow query no longer stalls the event loop. Concurrency is
+capped at the connection pool size, so excess requests wait on the event
+loop instead of each tying up a thread while blocked on the pool.
+"""
+import functools
+
+import anyio
+
+import database
+from config import DB_POOL_MAX_SIZE
+
+_limiter = None
+
+def _get_limiter():
+    """Get the limiter shared by all database calls, creating it on first use"""
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(DB_POOL_MAX_SIZE)
+    return _limiter
+
+def _run_in_thread(func):
+    """Wrap a blocking data-access function into a coroutine function"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await anyio.to_thread.run_sync(
+            functools.partial(func, *args, **kwargs),
+            limiter=_get_limiter()
+        )
+    return wrapper
+
+open_db_pool = _run_in_thread(database.open_db_pool)
+close_db_pool = _run_in_thread(database.close_db_pool)
+create_pazienti_table = _run_in_thread(database.create_pazienti_table)
+create_indexes = _run_in_thread(database.create_indexes)
+create_diete_versioni_table = _run_in_thread(database.create_diete_versioni_table)
+load_alimenti_catalog = _run_in_thread(database.load_alimenti_catalog)
+load_alimenti_columns = _run_in_thread(database.load_alimenti_columns)
+
+# Alimenti
+get_alimenti_data = _run_in_thread(database.get_alimenti_data)
+_get_alimento_by_id = _run_in_thread(database.get_alimento_by_id)
+create_alimento = _run_in_thread(database.create_alimento)
+get_total_count = _run_in_thread(database.get_total_count)
+bulk_upsert_alimenti = _run_in_thread(database.bulk_upsert_alimenti)
+resolve_alimenti_columns = _run_in_thread(database.resolve_alimenti_columns)
+get_alimenti_by_ids = _run_in_thread(database.get_alimenti_by_ids)
+get_nutrient_matrix = _run_in_thread(database.get_nutrient_matrix)
+get_alimento_substitutes = _run_in_thread(database.get_alimento_substitutes)
+# A blocking generator: StreamingResponse already iterates it in a worker thread
+iter_alimenti_export = database.iter_alimenti_export
+
+async def get_alimento_by_id(alimento_id: int):
+    """Get a food item by ID, answering catalog cache hits without a thread hop"""
+    cached = database.alimenti_catalog.get(alimento_id)
+    if cached is not None:
+        return cached
+    return await _get_alimento_by_id(alimento_id, use_cache=False)
+
+# Pazienti
+get_pazienti_data = _run_in_thread(database.get_pazienti_data)
+get_paziente_by_id = _run_in_thread(database.get_paziente_by_id)
+create_paziente = _run_in_thread(database.create_paziente)
+update_paziente = _run_in_thread(database.update_paziente)
+delete_paziente = _run_in_thread(database.delete_paziente)
+get_pazienti_total_count = _run_in_thread(database.get_pazienti_total_count)
+
+# Diete
+fetch_all_pazienti_with_diete = _run_in_thread(database.fetch_all_pazienti_with_diete)
+get_dieta_by_paziente_id = _run_in_thread(database.get_dieta_by_paziente_id)
+update_dieta_by_paziente_id = _run_in_thread(database.update_dieta_by_paziente_id)
+patch_dieta_by_paziente_id = _run_in_thread(database.patch_dieta_by_paziente_id)
+add_alimento_to_pasto = _run_in_thread(database.add_alimento_to_pasto)
+recompute_diete = _run_in_thread(database.recompute_diete)
+copy_dieta_from_paziente = _run_in_thread(database.copy_dieta_from_paziente)
+get_dieta_versioni = _run_in_thread(database.get_dieta_versioni)
+get_dieta_versione = _run_in_thread(database.get_dieta_versione)
+diff_dieta_versioni = _run_in_thread(database.diff_dieta_versioni)
+
+# Metrics are read from in-memory counters and never block
+get_pool_stats = database.get_pool_stats
+get_catalog_stats = database.get_catalog_stats
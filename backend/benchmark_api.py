@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the NutriApp API
+
+Runs N concurrent clients against a running server for a fixed duration and
+reports requests per second and latency percentiles for each endpoint.
+Run it once against the server before a change and once after to compare.
+
+Usage:
+    python benchmark_api.py --clients 50 --duration 15
+    python benchmark_api.py --url http://localhost:8000 --path "/alimenti?limit=20&search=pane"
+"""
+
+import argparse
+import threading
+import time
+
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+DEFAULT_PATHS = [
+    "/alimenti?limit=20",
+    "/alimenti?limit=20&search=pane",
+    "/alimenti/1",
+    "/pazienti?limit=20",
+    "/health",
+]
+
+def run_client(base_url, path, stop_at, latencies, errors, lock):
+    """Issue requests in a loop until stop_at, recording latencies"""
+    session = requests.Session()
+    local_latencies = []
+    local_errors = 0
+
+    while time.perf_counter() < stop_at:
+        started = time.perf_counter()
+        try:
+            response = session.get(f"{base_url}{path}", timeout=30)
+            if response.status_code >= 400:
+                local_errors += 1
+        except requests.exceptions.RequestException:
+            local_errors += 1
+        local_latencies.append(time.perf_counter() - started)
+
+    with lock:
+        latencies.extend(local_latencies)
+        errors[0] += local_errors
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def benchmark_path(base_url, path, clients, duration):
+    """Benchmark a single path and return a result summary"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    threads = [
+        threading.Thread(target=run_client, args=(base_url, path, stop_at, latencies, errors, lock))
+        for _ in range(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "path": path,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriApp API throughput benchmark")
+    parser.add_argument("--url", default=BASE_URL, help="Base URL of the running API")
+    parser.add_argument("--clients", type=int, default=50, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run each path")
+    parser.add_argument("--path", action="append", help="Path to benchmark (repeatable)")
+    args = parser.parse_args()
+
+    paths = args.path or DEFAULT_PATHS
+
+    print(f"=== NutriApp API benchmark: {args.clients} clients, {args.duration}s per path ===\n")
+    print(f"{'path':<40} {'req':>7} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+
+    try:
+        for path in paths:
+            result = benchmark_path(args.url, path, args.clients, args.duration)
+            print(
+                f"{result['path']:<40} {result['requests']:>7} {result['errors']:>5} "
+                f"{result['rps']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}"
+            )
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+
+if __name__ == "__main__":
+    main()
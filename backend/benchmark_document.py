@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Per-document cost of the Word export of a diet
+
+Builds synthetic diets of increasing size and renders each of them
+repeatedly in this process with each engine, reporting the one-off cost of
+building the base template and the time and size of each document. No
+server or database is needed.
+
+Usage:
+    python benchmark_document.py
+    python benchmark_document.py --iterations 50 --items 2 5 10 --equivalents 3
+    python benchmark_document.py --engine xml
+"""
+
+import argparse
+import time
+
+from diet_utils import PASTI
+from document_utils import create_diet_document, get_document_template, get_xml_writer, DOCUMENT_ENGINES
+
+PAZIENTE = {"nome": "Mario", "cognome": "Rossi", "eta": 45, "email": "mario.rossi@example.com"}
+
+# Foods cycled through the meals: carbohydrates, proteins, fats and sides,
+# so that larger meals get several categories and the table layout
+FOODS = ["Pasta integrale", "Petto di pollo", "Olio di oliva", "Zucchine", "Pane", "Ricotta", "Mandorle", "Insalata"]
+
+def build_diet(items, equivalents):
+    """Diet with the given number of main foods per meal, each with some equivalents"""
+    dieta = {}
+    for pasto in PASTI:
+        alimenti = []
+        for i in range(items):
+            nome = FOODS[i % len(FOODS)]
+            alimenti.append({
+                "id": i + 1,
+                "nome": f"{nome} {i + 1}",
+                "quantita": 50 + 10 * i,
+                "unita": "g",
+                "tipo": "principale",
+                "equivalenti": [
+                    {"id": 100 + j, "nome": f"{nome} alternativa {j + 1}", "quantita": 40 + 5 * j, "unita": "g", "tipo": "equivalente"}
+                    for j in range(equivalents)
+                ],
+            })
+        dieta[pasto] = {"alimenti": alimenti, "note": f"Note per {pasto}"}
+    dieta["note"] = "Bere **molta acqua**\nCamminare ogni giorno"
+    return dieta
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def benchmark_diet(dieta, iterations, engine):
+    """Render a diet repeatedly and return a result summary"""
+    timings = []
+    size = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        size = len(create_diet_document(PAZIENTE, dieta, engine).getvalue())
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    return {
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "docs_per_s": len(timings) / sum(timings),
+        "size": size,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriApp Word export benchmark")
+    parser.add_argument("--iterations", type=int, default=20, help="Documents rendered per diet")
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 3, 6, 10], help="Main foods per meal (one run each)")
+    parser.add_argument("--equivalents", type=int, default=2, help="Equivalents of each main food")
+    parser.add_argument("--engine", choices=DOCUMENT_ENGINES, action="append", help="Engine to benchmark (repeatable, default all)")
+    args = parser.parse_args()
+
+    engines = args.engine or DOCUMENT_ENGINES
+
+    started = time.perf_counter()
+    get_document_template()
+    print(f"=== NutriApp Word export benchmark: {args.iterations} documents per diet ===\n")
+    print(f"Base template built in {(time.perf_counter() - started) * 1000:.1f} ms (once per process)")
+    if "xml" in engines:
+        started = time.perf_counter()
+        get_xml_writer()
+        print(f"XML writer built in {(time.perf_counter() - started) * 1000:.1f} ms (once per process)")
+    print(f"\n{'engine':<7} {'items/meal':>10} {'foods':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'docs/s':>8} {'bytes':>8}")
+
+    for items in args.items:
+        dieta = build_diet(items, args.equivalents)
+        foods = len(PASTI) * items * (1 + args.equivalents)
+        for engine in engines:
+            # The first render also builds the run formats it uses
+            create_diet_document(PAZIENTE, dieta, engine)
+            result = benchmark_diet(dieta, args.iterations, engine)
+            print(
+                f"{engine:<7} {items:>10} {foods:>7} {result['mean_ms']:>9.1f} {result['p50_ms']:>9.1f} "
+                f"{result['p95_ms']:>9.1f} {result['docs_per_s']:>8.1f} {result['size']:>8}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import re
+import struct
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+# Names at least this word-similar to the search term match even without
+# containing it. The database search runs with the same value as
+# pg_trgm.word_similarity_threshold (pg_trgm's own default).
+SIMILARITY_THRESHOLD = 0.6
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def normalize_name(name: str):
+    """Lowercase a food name and strip its accents, like lower(f_unaccent(...)) in SQL"""
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def _word_trigrams(word: str):
+    """Trigrams of a single word padded the way pg_trgm pads it"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _trigrams(words):
+    trigrams = set()
+    for word in words:
+        trigrams |= _word_trigrams(word)
+    return trigrams
+
+
+def _name_trigrams(words):
+    """Trigrams of a name in text order, repeats included, like pg_trgm's generate_trgm_only"""
+    trigrams = []
+    for word in words:
+        padded = f"  {word} "
+        trigrams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def _float4(value):
+    """Round to single precision, the type pg_trgm computes similarities in"""
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def word_similarity(query_trigrams, name_trigrams):
+    """
+    pg_trgm's word_similarity(query, name): the greatest similarity between
+    the query trigrams and any continuous extent of the name's trigrams
+
+    A port of iterate_word_similarity in contrib/pg_trgm/trgm_op.c, down to
+    its greedy choice of the extent's lower bound and its float4 results, so
+    that tiers, distances and cursors agree with the database search.
+
+    Args:
+        query_trigrams: Set of trigrams of the normalized query
+        name_trigrams: Trigrams of the normalized name from _name_trigrams
+    """
+    query_count = len(query_trigrams)
+
+    def similarity(count, name_count):
+        return _float4(count / (query_count + name_count - count))
+
+    last_position = {}
+    name_count = count = 0
+    lower = -1
+    best = 0.0
+    for i, trigram in enumerate(name_trigrams):
+        found = trigram in query_trigrams
+        if lower >= 0 or found:
+            if trigram not in last_position:
+                name_count += 1
+                if found:
+                    count += 1
+            last_position[trigram] = i
+
+        if not found:
+            continue
+
+        # The extent ends at every query trigram; then move its start right
+        # while that improves the similarity
+        upper = i
+        if lower == -1:
+            lower = i
+            name_count = 1
+        current = similarity(count, name_count)
+
+        candidate_count, candidate_name_count, previous_lower = count, name_count, lower
+        for candidate_lower in range(lower, upper + 1):
+            candidate = similarity(candidate_count, candidate_name_count)
+            if candidate > current:
+                current = candidate
+                name_count = candidate_name_count
+                lower = candidate_lower
+                count = candidate_count
+            dropped = name_trigrams[candidate_lower]
+            if last_position.get(dropped) == candidate_lower:
+                candidate_name_count -= 1
+                if dropped in query_trigrams:
+                    candidate_count -= 1
+
+        best = max(best, current)
+
+        for dropped_lower in range(previous_lower, lower):
+            dropped = name_trigrams[dropped_lower]
+            if last_position.get(dropped) == dropped_lower:
+                del last_position[dropped]
+    return best
+
+
+class AlimentiCatalog:
+    """
+    In-memory copy of the alimenti catalog.
+
+    Holds id -> row for the projected food columns and a name index sorted
+    by normalized name. When the whole table fits in max_items the catalog
+    is complete and also answers name searches with the same ranking as the
+    database (exact, prefix, substring, similar); otherwise it only acts as
+    an LRU cache of rows by id. Entries older than ttl seconds are reloaded
+    so that foods created by other workers eventually show up.
+    """
+
+    def __init__(self, max_items=20000, ttl=300):
+        self.max_items = max_items
+        self.ttl = ttl
+
+        self._lock = threading.RLock()
+        self._rows = OrderedDict()
+        # Sorted (normalized name, id) pairs, normalized names and name trigrams by id
+        # and trigram -> ids postings, only maintained when complete
+        self._names = []
+        self._normalized = {}
+        self._name_trigrams = {}
+        self._postings = defaultdict(set)
+        self._complete = False
+        self._loaded_at = None
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "searches": 0,
+            "evictions": 0,
+            "loads": 0,
+            "invalidations": 0,
+        }
+
+    @property
+    def complete(self):
+        """True when every food is cached and searches can be served from memory"""
+        with self._lock:
+            return self._complete and not self._expired()
+
+    @property
+    def loaded(self):
+        with self._lock:
+            return self._loaded_at is not None and not self._expired()
+
+    def load(self, rows):
+        """
+        Replace the catalog contents
+
+        Args:
+            rows: Food rows ordered by id; more than max_items rows marks
+                the catalog as incomplete and only the first max_items are kept
+        """
+        rows = list(rows)
+        complete = len(rows) <= self.max_items
+        rows = rows[:self.max_items]
+
+        with self._lock:
+            self._rows = OrderedDict((row["id"], row) for row in rows)
+            self._complete = complete
+            self._names = []
+            self._normalized = {}
+            self._name_trigrams = {}
+            self._postings = defaultdict(set)
+            if complete:
+                self._names = sorted(self._index(row) for row in rows)
+            self._loaded_at = time.monotonic()
+            self._stats["loads"] += 1
+
+    def invalidate(self):
+        """Drop every cached row; the next access reloads the catalog"""
+        with self._lock:
+            self._rows = OrderedDict()
+            self._names = []
+            self._normalized = {}
+            self._name_trigrams = {}
+            self._postings = defaultdict(set)
+            self._complete = False
+            self._loaded_at = None
+            self._stats["invalidations"] += 1
+
+    def get(self, alimento_id: int):
+        """
+        Look up a food by ID
+
+        Returns:
+            The cached row, or None on a miss
+        """
+        with self._lock:
+            row = self._rows.get(alimento_id)
+            if row is None or self._expired():
+                self._stats["misses"] += 1
+                return None
+            self._rows.move_to_end(alimento_id)
+            self._stats["hits"] += 1
+            return dict(row)
+
+    def put(self, row: dict):
+        """Add or replace a single food, e.g. after it has been created"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+
+            previous = self._rows.pop(row["id"], None)
+            self._rows[row["id"]] = row
+
+            if self._complete:
+                if previous is not None:
+                    self._unindex(previous)
+                if len(self._rows) > self.max_items:
+                    # The catalog outgrew its bound: keep serving IDs only
+                    self._complete = False
+                    self._names = []
+                    self._normalized = {}
+                    self._name_trigrams = {}
+                    self._postings = defaultdict(set)
+                else:
+                    entry = self._index(row)
+                    self._names.insert(bisect_left(self._names, entry), entry)
+
+            while len(self._rows) > self.max_items:
+                self._rows.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def search(self, term: str, limit: int, offset: int = 0, after=None, count: str = "exact"):
+        """
+        Search food names the same way get_alimenti_data does
+
+        Must only be called when the catalog is complete.
+
+        Args:
+            term: Search term
+            limit: Maximum number of records to return
+            offset: Number of records to skip (ignored when after is given)
+            after: Decoded keyset cursor (tier, distance, alimento, id)
+            count: 'exact', 'estimated' or 'none'
+
+        Returns:
+            Tuple of (list of rows with tier and distance, total or None)
+        """
+        query = normalize_name(term)
+        query_words = _WORD_RE.findall(query)
+        query_trigrams = _trigrams(query_words)
+
+        with self._lock:
+            self._stats["searches"] += 1
+            matches = []
+
+            # Exact and prefix matches are a contiguous run of the sorted index
+            prefix_ids = set()
+            start = bisect_left(self._names, (query,))
+            for name, alimento_id in self._names[start:]:
+                if not name.startswith(query):
+                    break
+                prefix_ids.add(alimento_id)
+                tier = 0 if name == query else 1
+                matches.append((tier, alimento_id))
+
+            # Substring matches contain every trigram lying inside a query word
+            inner = [t for word in query_words for t in _word_trigrams(word) if " " not in t]
+            if inner:
+                candidates = set.intersection(*(self._postings.get(t, set()) for t in inner))
+            else:
+                candidates = self._rows.keys()
+            substring_ids = {
+                alimento_id for alimento_id in candidates
+                if alimento_id not in prefix_ids and query in self._normalized[alimento_id]
+            }
+            matches.extend((2, alimento_id) for alimento_id in substring_ids)
+
+            # Similar names share at least a threshold fraction of the query
+            # trigrams, since word similarity never exceeds that fraction
+            shared = Counter()
+            for trigram in query_trigrams:
+                shared.update(self._postings.get(trigram, ()))
+            min_shared = SIMILARITY_THRESHOLD * len(query_trigrams)
+            for alimento_id, common in shared.items():
+                if common < min_shared or alimento_id in prefix_ids or alimento_id in substring_ids:
+                    continue
+                if word_similarity(query_trigrams, self._name_trigrams[alimento_id]) >= SIMILARITY_THRESHOLD:
+                    matches.append((3, alimento_id))
+
+            ranked = []
+            for tier, alimento_id in matches:
+                row = dict(self._rows[alimento_id])
+                row["tier"] = tier
+                # In SQL 1 - word_similarity(...) promotes the float4 similarity
+                # to float8 before subtracting, so only the similarity is rounded
+                row["distance"] = 1 - word_similarity(query_trigrams, self._name_trigrams[alimento_id])
+                ranked.append(row)
+
+        ranked.sort(key=lambda row: (row["tier"], row["distance"], row["alimento"], row["id"]))
+        total = None if count == "none" else len(ranked)
+
+        if after is not None:
+            after = tuple(after)
+            ranked = [
+                row for row in ranked
+                if (row["tier"], row["distance"], row["alimento"], row["id"]) > after
+            ]
+            return ranked[:limit], total
+        return ranked[offset:offset + limit], total
+
+    def stats(self):
+        """Snapshot of cache size and hit/miss counters"""
+        with self._lock:
+            snapshot = {
+                "items": len(self._rows),
+                "max_items": self.max_items,
+                "complete": self._complete,
+                "loaded": self._loaded_at is not None,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            }
+            snapshot.update(self._stats)
+
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = round(snapshot["hits"] / lookups, 3) if lookups else None
+        return snapshot
+
+    def _expired(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at > self.ttl
+
+    def _index(self, row):
+        """Record the trigrams of a row's name (lock held) and return its name index entry"""
+        name = normalize_name(row["alimento"])
+        words = _WORD_RE.findall(name)
+        trigrams = _name_trigrams(words)
+        self._normalized[row["id"]] = name
+        self._name_trigrams[row["id"]] = trigrams
+        for trigram in set(trigrams):
+            self._postings[trigram].add(row["id"])
+        return (name, row["id"])
+
+    def _unindex(self, row):
+        """Remove a row from the name index and trigram postings (lock held)"""
+        name = self._normalized.pop(row["id"])
+        self._names.remove((name, row["id"]))
+        for trigram in set(self._name_trigrams.pop(row["id"], [])):
+            self._postings[trigram].discard(row["id"])
@@ -6,4 +6,53 @@ load_dotenv()
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
-    raise ValueError("No DATABASE_URL environment variable set. Please check your .env file.") 
\ No newline at end of file
+    raise ValueError("No DATABASE_URL environment variable set. Please check your .env file.") 
+
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Seconds an idle connection above the minimum size is kept open
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+# Connections idle for longer than this many seconds are checked with SELECT 1 before reuse
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+# Seconds to wait for a free connection when the pool is saturated
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30"))
+
+# Alimenti catalog cache
+# Maximum number of foods kept in memory; name searches are only served from
+# the cache when the whole table fits (0 disables the cache)
+CATALOG_CACHE_MAX_ITEMS = int(os.getenv("CATALOG_CACHE_MAX_ITEMS", "20000"))
+# Seconds after which the cache is reloaded to pick up foods created by other workers
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+# Alimenti export
+# Rows fetched from the server-side cursor and written to the response at a time
+ALIMENTI_EXPORT_BATCH_SIZE = int(os.getenv("ALIMENTI_EXPORT_BATCH_SIZE", "2000"))
+
+# Diet recomputation
+# Diets read and written back per batch by recompute_diete
+DIETE_RECOMPUTE_BATCH_SIZE = int(os.getenv("DIETE_RECOMPUTE_BATCH_SIZE", "500"))
+
+# Diet version history
+# Every this many versions a diet is stored in full instead of as a JSON
+# Patch, so rebuilding any version applies at most this many - 1 patches
+DIETE_SNAPSHOT_INTERVAL = int(os.getenv("DIETE_SNAPSHOT_INTERVAL", "10"))
+
+# Word export
+# Worker processes building diet documents
+DOCUMENT_RENDER_WORKERS = int(os.getenv("DOCUMENT_RENDER_WORKERS", "2"))
+# Exports waiting for a free worker; further exports get 503 until the queue drains
+DOCUMENT_RENDER_QUEUE_SIZE = int(os.getenv("DOCUMENT_RENDER_QUEUE_SIZE", "8"))
+# Run the workers as 'process'es or as 'thread's of the API process (for runtimes
+# that cannot start processes, such as Vercel); 'process' falls back to threads there
+DOCUMENT_RENDER_EXECUTOR = os.getenv("DOCUMENT_RENDER_EXECUTOR", "process")
+# Engine building the documents: 'docx' (python-docx) or 'xml' (direct writer, same output)
+DOCUMENT_ENGINE = os.getenv("DOCUMENT_ENGINE", "docx")
+# Meals whose food combinations would be more bullets than this are exported as a table
+DOCUMENT_MAX_BULLET_COMBINATIONS = int(os.getenv("DOCUMENT_MAX_BULLET_COMBINATIONS", "50"))
+# Bytes of rendered documents kept in memory, least recently used evicted first (0 disables the cache)
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Optional directory where documents evicted from memory are kept
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR") or None
+# Bytes of documents kept in DOCUMENT_CACHE_DIR
+DOCUMENT_CACHE_DISK_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
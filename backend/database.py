@@ -1,12 +1,71 @@
+import base64
+import csv
+import functools
+import io
+import json
+import threading
+import time
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from config import DATABASE_URL
+import psycopg2.errors
+from psycopg2.extras import RealDictCursor, execute_values
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_IDLE_TIMEOUT,
+    DB_POOL_HEALTH_CHECK_INTERVAL, DB_POOL_ACQUIRE_TIMEOUT,
+    CATALOG_CACHE_MAX_ITEMS, CATALOG_CACHE_TTL, ALIMENTI_EXPORT_BATCH_SIZE,
+    DIETE_RECOMPUTE_BATCH_SIZE, DIETE_SNAPSHOT_INTERVAL
+)
+from db_pool import ConnectionPool, PoolTimeoutError
+from catalog_cache import AlimentiCatalog, SIMILARITY_THRESHOLD
+from nutrient_matrix import NutrientMatrix
+from diet_utils import (
+    PASTI, TOTALI_NUTRIENTI, CAMPI_ALIMENTI, recompute_totals, diet_food_ids, refresh_diet_values
+)
+from json_patch import apply_patch, make_patch
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                    health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+                    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT
+                )
+    return _pool
+
+def open_db_pool():
+    """Open the minimum number of pooled connections"""
+    get_pool().open()
+
+def close_db_pool():
+    """Close the connection pool and all of its idle connections"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_pool_stats():
+    """Get usage and saturation metrics of the connection pool"""
+    return get_pool().stats()
 
 def get_db_connection():
-    """Get a database connection"""
+    """Borrow a database connection from the pool"""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = get_pool().getconn()
         return conn
+    except PoolTimeoutError as e:
+        print(f"Database pool exhausted: {e}")
+        raise
     except psycopg2.OperationalError as e:
         print(f"Database connection error: {e}")
         # Add more detailed error message
@@ -17,6 +76,369 @@ def get_db_connection():
         error_msg = f"Unexpected database error: {type(e).__name__} - {str(e)}"
         raise ConnectionError(error_msg) from e
 
+def release_db_connection(conn):
+    """Return a borrowed connection to the pool"""
+    get_pool().putconn(conn)
+
+# Keyset pagination: sort key of each listing, in ORDER BY order
+class PreconditionFailedError(Exception):
+    """Raised by a conditional write when the row was changed since the client read it"""
+
+def _version_condition(expected_versions):
+    """
+    Build the WHERE condition of a conditional write
+    
+    Args:
+        expected_versions: updated_at values the client has seen, or None
+            to write whatever the current version is
+    
+    Returns:
+        Tuple of (SQL condition, parameters)
+    """
+    if expected_versions is None:
+        return "", []
+    return " AND updated_at = ANY(%s::timestamp[])", [list(expected_versions)]
+
+def _raise_if_paziente_exists(cursor, paziente_id: int):
+    """Tell a failed conditional write on an existing patient apart from a missing one"""
+    cursor.execute("SELECT 1 FROM pazienti WHERE id = %s", (paziente_id,))
+    if cursor.fetchone():
+        raise PreconditionFailedError(f"Paziente {paziente_id} modificato da un'altra richiesta")
+
+ALIMENTI_CURSOR_KEYS = ("alimento", "id")
+ALIMENTI_SEARCH_CURSOR_KEYS = ("tier", "distance", "alimento", "id")
+PAZIENTI_CURSOR_KEYS = ("cognome", "nome", "id")
+PAZIENTI_DIETE_CURSOR_KEYS = ("nome", "cognome", "id")
+
+# Sort keys that may be NULL; PostgreSQL sorts NULLs last in ascending order
+NULLABLE_CURSOR_KEYS = ("alimento",)
+
+# Expected JSON type of each cursor value; keys not listed are strings
+_CURSOR_KEY_TYPES = {
+    "id": int,
+    "tier": int,
+    "distance": (int, float),
+}
+
+def encode_cursor(row: dict, keys):
+    """
+    Encode the sort key of the last row of a page into an opaque cursor
+    
+    Args:
+        row: Last row of the current page
+        keys: Sort key columns of the listing
+    
+    Returns:
+        URL-safe cursor string pointing after the given row
+    """
+    payload = json.dumps([row[key] for key in keys], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, keys, nullable=()):
+    """
+    Decode a cursor produced by encode_cursor
+    
+    Args:
+        cursor: Opaque cursor string
+        keys: Sort key columns of the listing
+        nullable: Keys whose value may be null in this listing
+    
+    Returns:
+        List of sort key values, one per key
+    
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another listing
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Cursore di paginazione non valido") from e
+    
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Cursore di paginazione non valido")
+    for key, value in zip(keys, values):
+        if value is None and key in nullable:
+            continue
+        expected_type = _CURSOR_KEY_TYPES.get(key, str)
+        if not isinstance(value, expected_type) or isinstance(value, bool):
+            raise ValueError("Cursore di paginazione non valido")
+    
+    return values
+
+def _keyset_condition(keys):
+    """Build the row-value comparison that selects rows after a cursor"""
+    columns = ", ".join(keys)
+    placeholders = ", ".join(["%s"] * len(keys))
+    return f"({columns}) > ({placeholders})"
+
+# How list endpoints compute their total: COUNT(*), planner statistics or not at all
+COUNT_MODES = ("exact", "estimated", "none")
+
+def _total_count_query(table: str, condition: str = None, count: str = "exact"):
+    """
+    Build the query returning the total number of rows of a listing
+    
+    Args:
+        table: Table being listed
+        condition: WHERE condition of the listing (without the keyset part), None if unfiltered
+        count: 'exact' for COUNT(*), 'estimated' for planner statistics, 'none' to skip
+    
+    Returns:
+        SQL query returning a single total_count row
+    """
+    if count not in COUNT_MODES:
+        raise ValueError(f"Modalità di conteggio non valida: {count}. Deve essere una di: {', '.join(COUNT_MODES)}")
+    
+    if count == "none":
+        return "SELECT NULL::bigint AS total_count"
+    
+    if count == "estimated" and condition is None:
+        # reltuples is -1 until the table has been vacuumed or analyzed
+        return f"""
+        SELECT CASE
+            WHEN c.reltuples >= 0 THEN c.reltuples::bigint
+            ELSE (SELECT COUNT(*) FROM {table})
+        END AS total_count
+        FROM pg_class c
+        WHERE c.oid = '{table}'::regclass
+        """
+    
+    # Filtered listings are counted exactly: the search indexes keep them cheap
+    return f"SELECT COUNT(*) AS total_count FROM {table} WHERE {condition or '1=1'}"
+
+def _fetch_page_with_total(cursor, page_query: str, page_params: list, order_by: str, total_query: str, total_params: list):
+    """
+    Fetch a page of rows and the listing total in a single statement
+    
+    Args:
+        cursor: RealDictCursor to execute on
+        page_query: Query returning the page, including ORDER BY and LIMIT
+        page_params: Parameters of page_query
+        order_by: Sort key columns of the page
+        total_query: Query returning a single total_count row
+        total_params: Parameters of total_query
+    
+    Returns:
+        Tuple of (list of row dictionaries, total or None)
+    """
+    query = f"""
+    WITH page AS ({page_query})
+    SELECT page.*, total.total_count
+    FROM ({total_query}) total
+    LEFT JOIN page ON true
+    ORDER BY {order_by}
+    """
+    
+    cursor.execute(query, page_params + total_params)
+    results = cursor.fetchall()
+    
+    total = results[0]["total_count"] if results else None
+    rows = []
+    for result in results:
+        # An empty page still yields one row carrying the total
+        if result["id"] is None:
+            continue
+        row = dict(result)
+        del row["total_count"]
+        rows.append(row)
+    
+    return rows, total
+
+# Case- and accent-insensitive food name, indexed with pg_trgm
+ALIMENTO_NORMALIZED = "lower(f_unaccent(alimento))"
+
+def alimenti_cursor_keys(search: str = None):
+    """Get the keyset sort key of the alimenti listing (ranked when searching)"""
+    return ALIMENTI_SEARCH_CURSOR_KEYS if search else ALIMENTI_CURSOR_KEYS
+
+def alimenti_nullable_cursor_keys(search: str = None):
+    """Get the sort keys that may be NULL in the alimenti listing (none when searching)"""
+    # A search never matches a food without a name
+    return () if search else NULLABLE_CURSOR_KEYS
+
+def _escape_like(term: str):
+    """Escape LIKE wildcards so the term is matched literally"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _alimenti_search_filter(search: str):
+    """
+    Build the WHERE condition of a food name search
+    
+    A name matches when it contains the term or is similar to it (typos),
+    ignoring case and accents. Both branches are served by the trigram index.
+    The similarity cutoff of <% is pg_trgm.word_similarity_threshold, see
+    _set_similarity_threshold.
+    
+    Returns:
+        Tuple of (SQL condition, parameters)
+    """
+    condition = f"""(
+        {ALIMENTO_NORMALIZED} LIKE lower(f_unaccent(%s))
+        OR lower(f_unaccent(%s)) <%% {ALIMENTO_NORMALIZED}
+    )"""
+    return condition, [f"%{_escape_like(search)}%", search]
+
+def _set_similarity_threshold(cursor):
+    """Make <% use the catalog cache's threshold for the rest of the transaction"""
+    cursor.execute(
+        "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+        (str(SIMILARITY_THRESHOLD),),
+    )
+
+def _alimenti_search_rank(search: str):
+    """
+    Build the relevance columns of a food name search
+    
+    tier is 0 for exact matches, 1 for prefix matches, 2 for substring
+    matches and 3 for similar names only; distance orders results within a
+    tier by trigram word similarity.
+    
+    Returns:
+        Tuple of (SQL select columns, parameters)
+    """
+    escaped = _escape_like(search)
+    columns = f"""
+        CASE
+            WHEN {ALIMENTO_NORMALIZED} = lower(f_unaccent(%s)) THEN 0
+            WHEN {ALIMENTO_NORMALIZED} LIKE lower(f_unaccent(%s)) THEN 1
+            WHEN {ALIMENTO_NORMALIZED} LIKE lower(f_unaccent(%s)) THEN 2
+            ELSE 3
+        END AS tier,
+        (1 - word_similarity(lower(f_unaccent(%s)), {ALIMENTO_NORMALIZED}))::float8 AS distance
+    """
+    return columns, [search, f"{escaped}%", f"%{escaped}%", search]
+
+ALIMENTO_COLUMNS = """
+    id,
+    alimento,
+    energia_kcal as kcal,
+    proteine_totali_g as proteine,
+    lipidi_totali_g as lipidi,
+    carboidrati_disponibili_g as carboidrati,
+    fibra_alimentare_totale_g as fibre,
+    sorgente
+"""
+
+alimenti_catalog = AlimentiCatalog(max_items=CATALOG_CACHE_MAX_ITEMS, ttl=CATALOG_CACHE_TTL)
+_catalog_lock = threading.Lock()
+
+def load_alimenti_catalog():
+    """Load the alimenti table into the in-memory catalog cache"""
+    if alimenti_catalog.max_items <= 0:
+        return
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        # One row more than fits tells whether the catalog is complete
+        cursor.execute(
+            f"SELECT {ALIMENTO_COLUMNS} FROM alimenti ORDER BY id LIMIT %s",
+            (alimenti_catalog.max_items + 1,)
+        )
+        alimenti_catalog.load(dict(row) for row in cursor.fetchall())
+        print(f"Alimenti catalog loaded: {alimenti_catalog.stats()['items']} items")
+        
+    except Exception as e:
+        print(f"Error loading alimenti catalog: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def _ensure_alimenti_catalog():
+    """
+    Reload the catalog cache if it has expired
+    
+    Returns:
+        True when the catalog is loaded; a failed reload leaves callers on the database path
+    """
+    if alimenti_catalog.max_items <= 0:
+        return False
+    if not alimenti_catalog.loaded:
+        with _catalog_lock:
+            if not alimenti_catalog.loaded:
+                try:
+                    load_alimenti_catalog()
+                except Exception:
+                    return False
+    return True
+
+def get_catalog_stats():
+    """Get size and hit/miss metrics of the alimenti catalog cache"""
+    return alimenti_catalog.stats()
+
+# Numeric alimenti columns that are not nutrient values
+NON_NUTRIENT_COLUMNS = ("id", "parte_edibile_percent")
+
+nutrient_matrix = NutrientMatrix(ttl=CATALOG_CACHE_TTL)
+_nutrient_matrix_lock = threading.Lock()
+
+def load_nutrient_matrix():
+    """Load the numeric columns of every food into the nutrient matrix"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'alimenti' 
+            AND data_type IN ('double precision', 'real', 'numeric', 'integer', 'smallint', 'bigint')
+            AND column_name <> ALL(%s)
+            ORDER BY ordinal_position
+        """, (list(NON_NUTRIENT_COLUMNS),))
+        columns = [row[0] for row in cursor.fetchall()]
+        
+        cursor.execute(f"SELECT id, {', '.join(columns)} FROM alimenti")
+        nutrient_matrix.load(columns, cursor.fetchall())
+        
+    except Exception as e:
+        print(f"Error loading nutrient matrix: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def get_nutrient_matrix():
+    """
+    Get the nutrient matrix, rebuilding it if it is stale
+    
+    Returns:
+        The shared NutrientMatrix
+    """
+    if not nutrient_matrix.loaded:
+        with _nutrient_matrix_lock:
+            if not nutrient_matrix.loaded:
+                load_nutrient_matrix()
+    return nutrient_matrix
+
+def get_alimento_substitutes(alimento_id: int, k: int = 10, basis: str = "macro", kcal: float = None):
+    """
+    Find the foods whose nutrient profile is closest to a food
+    
+    Args:
+        alimento_id: ID of the reference food
+        k: Number of substitutes
+        basis: 'macro' or 'full', see NutrientMatrix.substitutes
+        kcal: Calories each substitute must provide
+    
+    Returns:
+        List of food dictionaries with distance and quantita, closest
+        first, or None if the reference food does not exist
+    """
+    matches = get_nutrient_matrix().substitutes(alimento_id, k=k, basis=basis, kcal=kcal)
+    if matches is None:
+        return None
+    
+    # The rows come from the catalog cache, like GET /alimenti/{id}
+    alimenti = {row["id"]: row for row in get_alimenti_by_ids([match["id"] for match in matches])}
+    return [
+        {**alimenti[match["id"]], "distanza": match["distance"], "quantita": match["quantita"]}
+        for match in matches if match["id"] in alimenti
+    ]
+
 def create_pazienti_table():
     """Create the pazienti table if it doesn't exist"""
     conn = get_db_connection()
@@ -101,86 +523,225 @@ def create_pazienti_table():
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+def create_diete_versioni_table():
+    """Create the diete_versioni table holding the diet history if it doesn't exist"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # Each version is either the full diet (snapshot) or the JSON Patch
+        # from the previous version (delta)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS diete_versioni (
+            paziente_id INTEGER NOT NULL REFERENCES pazienti(id) ON DELETE CASCADE,
+            versione INTEGER NOT NULL,
+            tipo VARCHAR(10) NOT NULL CHECK (tipo IN ('snapshot', 'delta')),
+            contenuto JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (paziente_id, versione)
+        );
+        """)
+        conn.commit()
+        print("Table 'diete_versioni' created successfully or already exists!")
+        
+    except Exception as e:
+        print(f"Error creating diete_versioni table: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def create_indexes():
+    """Create the extensions and indexes used by the listing endpoints if they don't exist"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # Trigram search on food names, ignoring case and accents.
+        # unaccent() is only STABLE, so it is wrapped in an IMMUTABLE function
+        # that can be used in an index expression.
+        search_statements = [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            "CREATE EXTENSION IF NOT EXISTS unaccent",
+            """
+            CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS $$
+                SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+            $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            """,
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_alimenti_alimento_trgm
+            ON alimenti USING gin ({ALIMENTO_NORMALIZED} gin_trgm_ops)
+            """,
+        ]
+        
+        # Btree indexes matching the keyset pagination sort keys
+        index_statements = search_statements + [
+            "CREATE INDEX IF NOT EXISTS idx_alimenti_alimento_id ON alimenti (alimento, id)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_cognome_nome_id ON pazienti (cognome, nome, id)",
+            """
+            CREATE INDEX IF NOT EXISTS idx_pazienti_diete_nome_cognome_id
+            ON pazienti (nome, cognome, id) WHERE dieta IS NOT NULL
+            """,
+        ]
+        
+        for statement in index_statements:
+            cursor.execute(statement)
+        conn.commit()
+        print("Indexes created successfully or already exist!")
+        
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+        conn.rollback()
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
 
-def get_alimenti_data(limit: int = 100, offset: int = 0, search: str = None):
+def get_alimenti_data(limit: int = 100, offset: int = 0, search: str = None, page_cursor: str = None,
+                      count: str = "exact"):
     """
-    Retrieve food data from the database
+    Retrieve a page of food data and the total number of matches in one round trip
+    
+    Name searches are served from the alimenti catalog cache, without any
+    database traffic, whenever the whole catalog is cached.
     
     Args:
         limit: Maximum number of records to return
-        offset: Number of records to skip
+        offset: Number of records to skip (ignored when a cursor is given)
         search: Optional search term for food names
+        page_cursor: Optional keyset cursor returned with the previous page
+        count: How to compute the total: 'exact', 'estimated' or 'none'
     
     Returns:
-        List of dictionaries containing food data
+        Tuple of (list of dictionaries containing food data, total or None)
     """
+    keys = alimenti_cursor_keys(search)
+    after = decode_cursor(page_cursor, keys, alimenti_nullable_cursor_keys(search)) if page_cursor else None
+    
+    # Name searches are answered from memory when the whole catalog is cached
+    if search and _ensure_alimenti_catalog() and alimenti_catalog.complete:
+        return alimenti_catalog.search(search, limit, offset, after, count)
+    
+    search_filter, search_params = _alimenti_search_filter(search) if search else (None, [])
+    total_query = _total_count_query("alimenti", search_filter, count)
+    total_params = search_params if count != "none" else []
+    
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        # Base query
-        query = """
-        SELECT 
-            id,
-            alimento,
-            energia_kcal as kcal,
-            proteine_totali_g as proteine,
-            lipidi_totali_g as lipidi,
-            carboidrati_disponibili_g as carboidrati,
-            fibra_alimentare_totale_g as fibre,
-            sorgente
-        FROM alimenti
-        WHERE 1=1
-        """
-        
         params = []
         
-        # Add search filter if provided
+        # Base query, ranked by relevance when searching
         if search:
-            query += " AND alimento ILIKE %s"
-            params.append(f"%{search}%")
+            _set_similarity_threshold(cursor)
+            rank_columns, rank_params = _alimenti_search_rank(search)
+            query = f"""
+            SELECT * FROM (
+                SELECT {ALIMENTO_COLUMNS}, {rank_columns}
+                FROM alimenti
+                WHERE {search_filter}
+            ) ranked
+            WHERE 1=1
+            """
+            params.extend(rank_params + search_params)
+        else:
+            query = f"""
+            SELECT {ALIMENTO_COLUMNS}
+            FROM alimenti
+            WHERE 1=1
+            """
         
         # Add ordering and pagination
-        query += " ORDER BY alimento LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
-        return [dict(row) for row in results]
+        order_by = ", ".join(keys)
+        if after and not search:
+            query, params = _alimenti_keyset_page(after, limit)
+        elif after:
+            query += f" AND {_keyset_condition(keys)}"
+            params.extend(after)
+            query += f" ORDER BY {order_by} LIMIT %s"
+            params.append(limit)
+        else:
+            query += f" ORDER BY {order_by} LIMIT %s OFFSET %s"
+            params.extend([limit, offset])
+        
+        return _fetch_page_with_total(cursor, query, params, order_by, total_query, total_params)
         
     except Exception as e:
         print(f"Error fetching data: {e}")
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
-def get_alimento_by_id(alimento_id: int):
+def _alimenti_keyset_page(after, limit: int):
+    """
+    Build the query of the unsearched alimenti page following a cursor
+    
+    Foods without a name sort after all the others (NULLS LAST), which a
+    row-value comparison cannot express, so the page is the named foods
+    after the cursor followed by the nameless ones. Each branch is an
+    ordered range of idx_alimenti_alimento_id.
+    
+    Args:
+        after: Decoded (alimento, id) cursor, alimento None for a nameless food
+        limit: Maximum number of records to return
+    
+    Returns:
+        Tuple of (SQL query, parameters)
+    """
+    alimento, alimento_id = after
+    if alimento is None:
+        query = f"""
+        SELECT {ALIMENTO_COLUMNS}
+        FROM alimenti
+        WHERE alimento IS NULL AND id > %s
+        ORDER BY alimento, id LIMIT %s
+        """
+        return query, [alimento_id, limit]
+    
+    query = f"""
+    SELECT * FROM (
+        (SELECT {ALIMENTO_COLUMNS}
+         FROM alimenti
+         WHERE (alimento, id) > (%s, %s)
+         ORDER BY alimento, id LIMIT %s)
+        UNION ALL
+        (SELECT {ALIMENTO_COLUMNS}
+         FROM alimenti
+         WHERE alimento IS NULL
+         ORDER BY alimento, id LIMIT %s)
+    ) after_cursor
+    ORDER BY alimento, id LIMIT %s
+    """
+    return query, [alimento, alimento_id, limit, limit, limit]
+
+def get_alimento_by_id(alimento_id: int, use_cache: bool = True):
     """
     Get a specific food item by ID
     
     Args:
         alimento_id: The ID of the food item
+        use_cache: Look the food up in the catalog cache before querying
+            the database; False when the caller already missed it
     
     Returns:
         Dictionary containing food data or None if not found
     """
+    if _ensure_alimenti_catalog() and use_cache:
+        cached = alimenti_catalog.get(alimento_id)
+        if cached is not None:
+            return cached
+    
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        query = """
-        SELECT 
-            id,
-            alimento,
-            energia_kcal as kcal,
-            proteine_totali_g as proteine,
-            lipidi_totali_g as lipidi,
-            carboidrati_disponibili_g as carboidrati,
-            fibra_alimentare_totale_g as fibre,
-            sorgente
+        query = f"""
+        SELECT {ALIMENTO_COLUMNS}
         FROM alimenti
         WHERE id = %s
         """
@@ -188,70 +749,150 @@ def get_alimento_by_id(alimento_id: int):
         cursor.execute(query, (alimento_id,))
         result = cursor.fetchone()
         
-        return dict(result) if result else None
+        if result is None:
+            return None
+        alimenti_catalog.put(dict(result))
+        return dict(result)
         
     except Exception as e:
         print(f"Error fetching alimento by ID: {e}")
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
-def create_alimento(alimento_data: dict):
-    """
-    Create a new food item in the database
+# Fields a new food must have, besides the optional nutrient columns
+ALIMENTI_REQUIRED_FIELDS = [
+    "alimento", 
+    "sorgente", 
+    "energia_kcal", 
+    "proteine_totali_g", 
+    "lipidi_totali_g", 
+    "carboidrati_disponibili_g", 
+    "fibra_alimentare_totale_g"
+]
 
-    Args:
-        alimento_data: Dictionary containing food data with optional fields
+# Columns of alimenti that create_alimento never writes
+ALIMENTI_GENERATED_COLUMNS = ("id", "created_at")
+
+# Projection with the macronutrients only, under their database names
+ALIMENTI_MACRO_COLUMNS = ["id", *ALIMENTI_REQUIRED_FIELDS]
 
+# Minimum seconds between schema reloads triggered by unknown input fields
+SCHEMA_REFRESH_INTERVAL = 60
+
+_alimenti_columns = None
+_alimenti_columns_loaded_at = 0.0
+_alimenti_columns_lock = threading.Lock()
+
+def load_alimenti_columns(cursor=None):
+    """
+    Read the insertable alimenti columns from information_schema into the schema cache
+    
+    Called once on first use; call it again after a migration changes the table.
+    
+    Args:
+        cursor: Optional open cursor to run the query on
+    
     Returns:
-        Dictionary containing the created food item
+        Tuple of column names in table order
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Match the required fields from your Pydantic model
-    REQUIRED_FIELDS = [
-        "alimento", 
-        "sorgente", 
-        "energia_kcal", 
-        "proteine_totali_g", 
-        "lipidi_totali_g", 
-        "carboidrati_disponibili_g", 
-        "fibra_alimentare_totale_g"
-    ]
+    global _alimenti_columns, _alimenti_columns_loaded_at
     
-    # Initialize valid_data at the top to avoid UnboundLocalError
-    valid_data = {}
+    conn = None
+    if cursor is None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
     
     try:
-        # Get all column names from the database (excluding id and created_at)
         cursor.execute("""
             SELECT column_name 
             FROM information_schema.columns 
             WHERE table_name = 'alimenti' 
-            AND column_name NOT IN ('id', 'created_at') 
+            AND column_name <> ALL(%s)
             ORDER BY ordinal_position
-        """)
+        """, (list(ALIMENTI_GENERATED_COLUMNS),))
+        columns = tuple(
+            row['column_name'] if isinstance(row, dict) else row[0]
+            for row in cursor.fetchall()
+        )
         
-        # Fix the KeyError issue - fetchall() returns a list of RealDictRow objects
-        db_columns_result = cursor.fetchall()
-        db_columns = [row['column_name'] for row in db_columns_result]  # Access by key name, not index
+        with _alimenti_columns_lock:
+            _alimenti_columns = columns
+            _alimenti_columns_loaded_at = time.monotonic()
+        return columns
         
-        print(f"Available database columns: {db_columns}")
-        print(f"Input data keys: {list(alimento_data.keys())}")
+    finally:
+        if conn is not None:
+            cursor.close()
+            release_db_connection(conn)
 
-        # Filter the input data to only include valid columns
-        # Include fields that are not None (0 is a valid value for nutritional data)
-        for col in db_columns:
-            if col in alimento_data and alimento_data[col] is not None:
-                valid_data[col] = alimento_data[col]
+def get_alimenti_columns(cursor=None, requested=()):
+    """
+    Get the insertable alimenti columns from the schema cache
+    
+    Args:
+        cursor: Optional open cursor used if the cache has to be loaded
+        requested: Input fields; fields missing from the cache trigger a
+            reload (at most every SCHEMA_REFRESH_INTERVAL seconds) in case
+            a migration added them
+    
+    Returns:
+        Tuple of column names in table order
+    """
+    columns = _alimenti_columns
+    if columns is None:
+        return load_alimenti_columns(cursor)
+    
+    unknown = set(requested) - set(columns)
+    if unknown and time.monotonic() - _alimenti_columns_loaded_at > SCHEMA_REFRESH_INTERVAL:
+        return load_alimenti_columns(cursor)
+    return columns
+
+@functools.lru_cache(maxsize=256)
+def _alimenti_insert_query(columns: tuple):
+    """Build the INSERT statement for a set of columns, once per column set"""
+    return f"""
+        INSERT INTO alimenti ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        RETURNING 
+            id,
+            alimento,
+            energia_kcal,
+            proteine_totali_g,
+            lipidi_totali_g,
+            carboidrati_disponibili_g,
+            fibra_alimentare_totale_g,
+            sorgente,
+            created_at
+        """
+
+def create_alimento(alimento_data: dict):
+    """
+    Create a new food item in the database
+
+    The insertable columns come from the schema cache and the INSERT
+    statement is built once per column set, so creating a food is a single
+    round trip.
 
-        print(f"Valid data after filtering: {valid_data}")
+    Args:
+        alimento_data: Dictionary containing food data with optional fields
+
+    Returns:
+        Dictionary containing the created food item
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    try:
+        # Include fields that are not None (0 is a valid value for nutritional data)
+        provided = {key: value for key, value in alimento_data.items() if value is not None}
+        db_columns = get_alimenti_columns(cursor, provided)
+        valid_data = {col: provided[col] for col in db_columns if col in provided}
 
         # Check for required fields
         missing_fields = []
-        for field in REQUIRED_FIELDS:
+        for field in ALIMENTI_REQUIRED_FIELDS:
             if field not in valid_data:
                 missing_fields.append(field)
             elif isinstance(valid_data[field], str) and not valid_data[field].strip():
@@ -260,66 +901,288 @@ def create_alimento(alimento_data: dict):
         if missing_fields:
             raise ValueError(f"I seguenti campi obbligatori mancano o sono vuoti: {', '.join(missing_fields)}")
 
-        # Build the INSERT query dynamically
-        columns = list(valid_data.keys())
-        placeholders = ', '.join(['%s'] * len(columns))
-        column_names = ', '.join(columns)
+        columns = tuple(valid_data)
+        values = [valid_data[col] for col in columns]
+        try:
+            cursor.execute(_alimenti_insert_query(columns), values)
+        except psycopg2.errors.UndefinedColumn:
+            # A migration dropped a cached column: reload the schema and retry once
+            conn.rollback()
+            db_columns = load_alimenti_columns(cursor)
+            columns = tuple(col for col in columns if col in db_columns)
+            values = [valid_data[col] for col in columns]
+            cursor.execute(_alimenti_insert_query(columns), values)
 
-        insert_query = f"""
-        INSERT INTO alimenti ({column_names})
-        VALUES ({placeholders})
-        RETURNING 
-            id,
-            alimento,
-            energia_kcal,
-            proteine_totali_g,
-            lipidi_totali_g,
-            carboidrati_disponibili_g,
-            fibra_alimentare_totale_g,
-            sorgente,
-            created_at
+        # Get the inserted record
+        result = cursor.fetchone()
+        conn.commit()
+
+        nutrient_matrix.invalidate()
+        if result:
+            alimenti_catalog.put({
+                "id": result["id"],
+                "alimento": result["alimento"],
+                "kcal": result["energia_kcal"],
+                "proteine": result["proteine_totali_g"],
+                "lipidi": result["lipidi_totali_g"],
+                "carboidrati": result["carboidrati_disponibili_g"],
+                "fibre": result["fibra_alimentare_totale_g"],
+                "sorgente": result["sorgente"],
+            })
+
+        return dict(result) if result else None
+
+    except ValueError as ve:
+        # Handle validation errors
+        conn.rollback()
+        raise ve
+    except Exception as e:
+        conn.rollback()
+        print(f"Database error creating alimento: {type(e).__name__}: {str(e)}")
+        
+        # Create a more descriptive error message
+        error_msg = f"Database error: {type(e).__name__} - {str(e)}"
+        raise Exception(error_msg)
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+class _LineReader:
+    """File-like object over an iterator of text lines, read by COPY ... FROM STDIN"""
+    
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ""
+    
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+def _copy_lines(rows):
+    """Encode (row number, values) pairs as CSV lines for COPY"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row_number, values in rows:
+        writer.writerow((row_number,) + tuple(values))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def bulk_upsert_alimenti(columns, rows):
+    """
+    Insert or update many foods at once
+    
+    Rows are streamed with COPY into a temporary staging table and merged
+    into alimenti in the same transaction: a row updates the foods with the
+    same normalized name and sorgente, or is inserted when there is none.
+    Empty values never overwrite existing data. When the same food appears
+    more than once in the input the last occurrence wins.
+    
+    Args:
+        columns: alimenti columns of each row; must include alimento and sorgente
+        rows: Iterable of (row number, tuple of values in columns order)
+    
+    Returns:
+        Dictionary with the number of inserted, updated and duplicate rows
+    """
+    columns = list(columns)
+    db_columns = get_alimenti_columns(requested=columns)
+    unknown = [col for col in columns if col not in db_columns]
+    if unknown:
+        raise ValueError(f"Colonne sconosciute: {', '.join(unknown)}")
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        column_list = ", ".join(columns)
+        match = """
+            lower(f_unaccent(a.alimento)) = s._key
+            AND a.sorgente IS NOT DISTINCT FROM s.sorgente
         """
+        
+        cursor.execute(f"""
+            CREATE TEMP TABLE alimenti_staging ON COMMIT DROP AS
+            SELECT 0 AS _row, {column_list} FROM alimenti WITH NO DATA
+        """)
+        cursor.copy_expert(
+            f"COPY alimenti_staging (_row, {column_list}) FROM STDIN WITH (FORMAT csv)",
+            _LineReader(_copy_lines(rows))
+        )
+        
+        # Keep the last occurrence of each food and compute its match key once
+        cursor.execute(f"""
+            ALTER TABLE alimenti_staging ADD COLUMN _key text;
+            UPDATE alimenti_staging SET _key = {ALIMENTO_NORMALIZED};
+            DELETE FROM alimenti_staging
+            WHERE _row IN (
+                SELECT _row FROM (
+                    SELECT _row, row_number() OVER (PARTITION BY _key, sorgente ORDER BY _row DESC) AS rn
+                    FROM alimenti_staging
+                ) ranked
+                WHERE rn > 1
+            );
+        """)
+        duplicates = cursor.rowcount
+        cursor.execute("ANALYZE alimenti_staging")
+        
+        # Concurrent imports would both insert the same new foods
+        cursor.execute("LOCK TABLE alimenti IN SHARE ROW EXCLUSIVE MODE")
+        
+        assignments = ", ".join(f"{col} = COALESCE(s.{col}, a.{col})" for col in columns)
+        cursor.execute(f"""
+            WITH updated AS (
+                UPDATE alimenti a
+                SET {assignments}
+                FROM alimenti_staging s
+                WHERE {match}
+                RETURNING s._row
+            )
+            SELECT count(DISTINCT _row) FROM updated
+        """)
+        updated = cursor.fetchone()[0]
+        
+        cursor.execute(f"""
+            INSERT INTO alimenti ({column_list})
+            SELECT {', '.join(f's.{col}' for col in columns)}
+            FROM alimenti_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM alimenti a WHERE {match})
+            ORDER BY s._row
+        """)
+        inserted = cursor.rowcount
+        conn.commit()
+        
+        # Names and values changed in bulk: reload the catalog on next use
+        alimenti_catalog.invalidate()
+        nutrient_matrix.invalidate()
+        
+        return {"inserted": inserted, "updated": updated, "duplicates": duplicates}
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error importing alimenti: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def resolve_alimenti_columns(fields=None):
+    """
+    Resolve a projection of the alimenti columns
+    
+    Args:
+        fields: Optional column names; all columns when empty
+    
+    Returns:
+        List of column names, id first
+    """
+    available = ["id", *get_alimenti_columns(requested=fields or ()), "created_at"]
+    if not fields:
+        return available
+    
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ValueError(f"Colonne sconosciute: {', '.join(unknown)}")
+    
+    # id is always returned first so that rows can be matched back
+    return ["id"] + [col for col in available if col in fields and col != "id"]
 
-        print(f"SQL Query: {insert_query}")
-        
-        # Execute the insert
-        values = [valid_data[col] for col in columns]
-        print(f"Values to insert: {values}")
+def get_alimenti_by_ids(alimento_ids, columns=None):
+    """
+    Get many food items by ID in a single query
+    
+    With the columns of get_alimento_by_id the foods are looked up in the
+    catalog cache first, and only the misses are queried.
+    
+    Args:
+        alimento_ids: IDs of the food items
+        columns: Columns to read, as returned by resolve_alimenti_columns;
+            the columns of get_alimento_by_id when None
+    
+    Returns:
+        List of dictionaries in the order of alimento_ids; IDs that do not
+        exist are left out
+    """
+    if not alimento_ids:
+        return []
+    
+    cached = {}
+    if columns is None and _ensure_alimenti_catalog():
+        for alimento_id in alimento_ids:
+            row = alimenti_catalog.get(alimento_id)
+            if row is not None:
+                cached[alimento_id] = row
+        if len(cached) == len(set(alimento_ids)):
+            return [cached[alimento_id] for alimento_id in alimento_ids]
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        projection = ALIMENTO_COLUMNS if columns is None else ", ".join(columns)
+        cursor.execute(
+            f"SELECT {projection} FROM alimenti WHERE id = ANY(%s)",
+            ([alimento_id for alimento_id in alimento_ids if alimento_id not in cached],)
+        )
+        rows = {row["id"]: dict(row) for row in cursor.fetchall()}
+        if columns is None:
+            for row in rows.values():
+                alimenti_catalog.put(row)
+        rows.update(cached)
+        return [rows[alimento_id] for alimento_id in alimento_ids if alimento_id in rows]
         
-        cursor.execute(insert_query, values)
+    except Exception as e:
+        print(f"Error fetching alimenti by IDs: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
 
-        # Get the inserted record
-        result = cursor.fetchone()
-        conn.commit()
+def iter_alimenti_export(columns, batch_size: int = ALIMENTI_EXPORT_BATCH_SIZE):
+    """
+    Stream the alimenti table ordered by id
+    
+    Rows are read through a server-side cursor, so memory stays bounded by
+    batch_size whatever the size of the table. The connection is borrowed
+    on the first iteration and returned when the generator is exhausted or
+    closed; a streaming caller must close it when the client goes away.
+    
+    Args:
+        columns: Columns to read, as returned by resolve_alimenti_columns
+        batch_size: Number of rows fetched per round trip
+    
+    Yields:
+        Lists of row tuples in columns order
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(name="alimenti_export")
+    cursor.itersize = batch_size
+    
+    try:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM alimenti ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
         
-        print(f"Insert result: {result}")
-
-        return dict(result) if result else None
-
-    except ValueError as ve:
-        # Handle validation errors
-        conn.rollback()
-        print(f"Validation error: {ve}")
-        raise ve
     except Exception as e:
-        conn.rollback()
-        print(f"Database error creating alimento: {type(e).__name__}: {str(e)}")
-        print(f"Exception args: {e.args}")
-        print(f"Valid data being inserted: {valid_data}")
-        
-        # Check if we have the query variables defined
-        try:
-            print(f"SQL query: {insert_query}")
-            print(f"Values: {values}")
-        except NameError:
-            print("Query variables not yet defined when error occurred")
-        
-        # Create a more descriptive error message
-        error_msg = f"Database error: {type(e).__name__} - {str(e)}"
-        raise Exception(error_msg)
+        print(f"Error exporting alimenti: {e}")
+        raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 def get_total_count(search: str = None):
     """
@@ -339,8 +1202,9 @@ def get_total_count(search: str = None):
         params = []
         
         if search:
-            query += " AND alimento ILIKE %s"
-            params.append(f"%{search}%")
+            search_filter, search_params = _alimenti_search_filter(search)
+            query += f" AND {search_filter}"
+            params.extend(search_params)
         
         cursor.execute(query, params)
         result = cursor.fetchone()
@@ -352,28 +1216,20 @@ def get_total_count(search: str = None):
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 # Pazienti functions
-def get_pazienti_data(limit: int = 100, offset: int = 0, search: str = None):
+def _pazienti_search_filter(search: str):
     """
-    Retrieve patients data from the database
-    
-    Args:
-        limit: Maximum number of records to return
-        offset: Number of records to skip
-        search: Optional search term for patient names
+    Build the WHERE condition of a patient search on nome, cognome or email
     
     Returns:
-        List of dictionaries containing patient data
+        Tuple of (SQL condition, parameters)
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        # Base query
-        query = """
-        SELECT 
+    search_term = f"%{search}%"
+    return "(nome ILIKE %s OR cognome ILIKE %s OR email ILIKE %s)", [search_term, search_term, search_term]
+
+PAZIENTI_COLUMNS = """
             id,
             nome,
             cognome,
@@ -384,6 +1240,51 @@ def get_pazienti_data(limit: int = 100, offset: int = 0, search: str = None):
             dieta,
             created_at,
             updated_at
+"""
+
+# Identity fields and the daily totals, without decoding and shipping the diet
+PAZIENTI_SUMMARY_COLUMNS = """
+            id,
+            nome,
+            cognome,
+            eta,
+            email,
+            telefono,
+            created_at,
+            updated_at,
+            COALESCE(jsonb_path_exists(dieta, '$.*.alimenti[*]'), false) AS has_diet,
+            dieta -> 'totale_giornaliero' AS totale_giornaliero
+"""
+
+def get_pazienti_data(limit: int = 100, offset: int = 0, search: str = None, page_cursor: str = None,
+                      count: str = "exact", summary: bool = False):
+    """
+    Retrieve a page of patients and the total number of matches in one round trip
+    
+    Args:
+        limit: Maximum number of records to return
+        offset: Number of records to skip (ignored when a cursor is given)
+        search: Optional search term for patient names
+        page_cursor: Optional keyset cursor returned with the previous page
+        count: How to compute the total: 'exact', 'estimated' or 'none'
+        summary: Return PAZIENTI_SUMMARY_COLUMNS instead of the full patients:
+            has_diet tells whether any meal has foods
+    
+    Returns:
+        Tuple of (list of dictionaries containing patient data, total or None)
+    """
+    after = decode_cursor(page_cursor, PAZIENTI_CURSOR_KEYS) if page_cursor else None
+    search_filter, search_params = _pazienti_search_filter(search) if search else (None, [])
+    total_query = _total_count_query("pazienti", search_filter, count)
+    total_params = search_params if count != "none" else []
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        # Base query
+        query = f"""
+        SELECT {PAZIENTI_SUMMARY_COLUMNS if summary else PAZIENTI_COLUMNS}
         FROM pazienti
         WHERE 1=1
         """
@@ -391,26 +1292,29 @@ def get_pazienti_data(limit: int = 100, offset: int = 0, search: str = None):
         params = []
         
         # Add search filter if provided
-        if search:
-            query += " AND (nome ILIKE %s OR cognome ILIKE %s OR email ILIKE %s)"
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term, search_term])
+        if search_filter:
+            query += f" AND {search_filter}"
+            params.extend(search_params)
         
         # Add ordering and pagination
-        query += " ORDER BY cognome, nome LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
-        return [dict(row) for row in results]
+        order_by = ", ".join(PAZIENTI_CURSOR_KEYS)
+        if after:
+            query += f" AND {_keyset_condition(PAZIENTI_CURSOR_KEYS)}"
+            params.extend(after)
+            query += f" ORDER BY {order_by} LIMIT %s"
+            params.append(limit)
+        else:
+            query += f" ORDER BY {order_by} LIMIT %s OFFSET %s"
+            params.extend([limit, offset])
+        
+        return _fetch_page_with_total(cursor, query, params, order_by, total_query, total_params)
         
     except Exception as e:
         print(f"Error fetching pazienti data: {e}")
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 def get_paziente_by_id(paziente_id: int):
     """
@@ -452,7 +1356,7 @@ def get_paziente_by_id(paziente_id: int):
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 def create_paziente(paziente_data: dict):
     """
@@ -505,18 +1409,22 @@ def create_paziente(paziente_data: dict):
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
-def update_paziente(paziente_id: int, paziente_data: dict):
+def update_paziente(paziente_id: int, paziente_data: dict, expected_versions=None):
     """
     Update an existing patient in the database
     
     Args:
         paziente_id: The ID of the patient to update
         paziente_data: Dictionary containing updated patient data
+        expected_versions: Optional updated_at values the update is conditional on
     
     Returns:
         Dictionary containing the updated patient or None if not found
+    
+    Raises:
+        PreconditionFailedError: If the patient changed since the expected versions
     """
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -554,12 +1462,14 @@ def update_paziente(paziente_id: int, paziente_data: dict):
             raise ValueError("No fields to update")
         
         set_clauses.append("updated_at = CURRENT_TIMESTAMP")
+        version_condition, version_params = _version_condition(expected_versions)
         values.append(paziente_id)
+        values.extend(version_params)
         
         query = f"""
         UPDATE pazienti 
         SET {', '.join(set_clauses)}
-        WHERE id = %s
+        WHERE id = %s{version_condition}
         RETURNING 
             id,
             nome,
@@ -575,17 +1485,22 @@ def update_paziente(paziente_id: int, paziente_data: dict):
         
         cursor.execute(query, values)
         result = cursor.fetchone()
+        if not result and expected_versions is not None:
+            _raise_if_paziente_exists(cursor, paziente_id)
         conn.commit()
         
         return dict(result) if result else None
         
+    except PreconditionFailedError:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         print(f"Error updating paziente: {e}")
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 def delete_paziente(paziente_id: int):
     """
@@ -615,7 +1530,7 @@ def delete_paziente(paziente_id: int):
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 def get_pazienti_total_count(search: str = None):
     """
@@ -635,9 +1550,9 @@ def get_pazienti_total_count(search: str = None):
         params = []
         
         if search:
-            query += " AND (nome ILIKE %s OR cognome ILIKE %s OR email ILIKE %s)"
-            search_term = f"%{search}%"
-            params.extend([search_term, search_term, search_term])
+            search_filter, search_params = _pazienti_search_filter(search)
+            query += f" AND {search_filter}"
+            params.extend(search_params)
         
         cursor.execute(query, params)
         result = cursor.fetchone()
@@ -649,20 +1564,23 @@ def get_pazienti_total_count(search: str = None):
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 # Diet functions
-def fetch_all_pazienti_with_diete(limit: int = 100, offset: int = 0):
+def fetch_all_pazienti_with_diete(limit: int = 100, offset: int = 0, page_cursor: str = None):
     """
     Get all patients with their diets
     
     Args:
         limit: Maximum number of results to return
-        offset: Number of results to skip
+        offset: Number of results to skip (ignored when a cursor is given)
+        page_cursor: Optional keyset cursor returned with the previous page
         
     Returns:
         List of dictionaries containing patient data with diets
     """
+    after = decode_cursor(page_cursor, PAZIENTI_DIETE_CURSOR_KEYS) if page_cursor else None
+    
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
@@ -682,11 +1600,17 @@ def fetch_all_pazienti_with_diete(limit: int = 100, offset: int = 0):
             updated_at
         FROM pazienti
         WHERE dieta IS NOT NULL
-        ORDER BY nome, cognome
-        LIMIT %s OFFSET %s
         """
         
-        cursor.execute(query, (limit, offset))
+        if after:
+            query += f" AND {_keyset_condition(PAZIENTI_DIETE_CURSOR_KEYS)}"
+            query += " ORDER BY nome, cognome, id LIMIT %s"
+            params = [*after, limit]
+        else:
+            query += " ORDER BY nome, cognome, id LIMIT %s OFFSET %s"
+            params = [limit, offset]
+        
+        cursor.execute(query, params)
         results = cursor.fetchall()
         
         return [dict(result) for result in results]
@@ -696,7 +1620,151 @@ def fetch_all_pazienti_with_diete(limit: int = 100, offset: int = 0):
         return []
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+def _record_dieta_versions(conn, changes):
+    """
+    Append new diet versions to the history, in the caller's transaction
+    
+    The caller must hold the lock on the patient rows, so that versions of
+    the same diet are numbered one after the other. A diet without history
+    first gets its previous content recorded as version 1.
+    
+    Args:
+        conn: Connection of the transaction writing the diets
+        changes: Tuples of (patient ID, previous diet, new diet)
+    """
+    changes = [change for change in changes if change[2] is not None and change[1] != change[2]]
+    if not changes:
+        return
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT paziente_id, max(versione)
+            FROM diete_versioni
+            WHERE paziente_id = ANY(%s)
+            GROUP BY paziente_id
+            """,
+            ([paziente_id for paziente_id, _, _ in changes],)
+        )
+        latest = dict(cursor.fetchall())
+        interval = max(DIETE_SNAPSHOT_INTERVAL, 1)
+        
+        rows = []
+        for paziente_id, previous, dieta in changes:
+            versione = latest.get(paziente_id, 0)
+            if versione == 0 and previous is not None:
+                versione = 1
+                rows.append((paziente_id, versione, "snapshot", psycopg2.extras.Json(previous)))
+            versione += 1
+            latest[paziente_id] = versione
+            
+            # Snapshots at versions 1, interval + 1, ... bound the deltas applied by get_dieta_versione
+            if (versione - 1) % interval == 0 or not isinstance(previous, dict) or not isinstance(dieta, dict):
+                rows.append((paziente_id, versione, "snapshot", psycopg2.extras.Json(dieta)))
+            else:
+                rows.append((paziente_id, versione, "delta", psycopg2.extras.Json(make_patch(previous, dieta))))
+        
+        execute_values(
+            cursor,
+            "INSERT INTO diete_versioni (paziente_id, versione, tipo, contenuto) VALUES %s",
+            rows, template="(%s, %s, %s, %s::jsonb)", page_size=1000
+        )
+    finally:
+        cursor.close()
+
+def recompute_diete(batch_size: int = DIETE_RECOMPUTE_BATCH_SIZE, dry_run: bool = False):
+    """
+    Recompute the stored food values and totals of every diet from the catalog
+    
+    Diets are streamed through a server-side cursor and the changed ones
+    are written back with one UPDATE per batch on a second connection, so
+    memory is bounded by batch_size and each batch commits on its own. A
+    diet edited while the batch was being computed keeps the edit and is
+    counted as a conflict. Every updated diet gets a new version in the
+    history.
+    
+    Args:
+        batch_size: Number of diets read and written at a time
+        dry_run: Only count the diets that would change
+    
+    Returns:
+        Dictionary with the number of scanned, changed and updated diets,
+        conflicts and foods missing from the catalog
+    """
+    # Catalog corrections may have been made directly in the database
+    load_nutrient_matrix()
+    
+    read_conn = get_db_connection()
+    write_conn = get_db_connection()
+    cursor = read_conn.cursor(name="diete_recompute")
+    cursor.itersize = batch_size
+    write_cursor = write_conn.cursor()
+    
+    report = {"scanned": 0, "changed": 0, "updated": 0, "conflicts": 0}
+    missing_foods = set()
+    
+    try:
+        cursor.execute("SELECT id, dieta, updated_at FROM pazienti WHERE dieta IS NOT NULL ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            
+            food_ids = set()
+            for _, dieta, _ in rows:
+                food_ids |= diet_food_ids(dieta)
+            valori = nutrient_matrix.values_per_100g(food_ids, CAMPI_ALIMENTI)
+            missing_foods |= food_ids - valori.keys()
+            
+            changes = []
+            for paziente_id, dieta, updated_at in rows:
+                if refresh_diet_values(dieta, valori):
+                    changes.append((paziente_id, dieta, updated_at))
+            
+            report["scanned"] += len(rows)
+            report["changed"] += len(changes)
+            if not changes or dry_run:
+                continue
+            
+            # Lock the rows and keep the previous diets for the history
+            write_cursor.execute(
+                "SELECT id, updated_at, dieta FROM pazienti WHERE id = ANY(%s) FOR UPDATE",
+                ([paziente_id for paziente_id, _, _ in changes],)
+            )
+            current = {paziente_id: (updated_at, dieta) for paziente_id, updated_at, dieta in write_cursor.fetchall()}
+            fresh = [change for change in changes if current.get(change[0], (None,))[0] == change[2]]
+            
+            if fresh:
+                execute_values(write_cursor, """
+                    UPDATE pazienti p
+                    SET dieta = v.dieta, updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v(id, dieta)
+                    WHERE p.id = v.id
+                """, [(paziente_id, psycopg2.extras.Json(dieta)) for paziente_id, dieta, _ in fresh],
+                    template="(%s, %s::jsonb)", page_size=len(fresh))
+                _record_dieta_versions(write_conn, [
+                    (paziente_id, current[paziente_id][1], dieta)
+                    for paziente_id, dieta, _ in fresh
+                ])
+            write_conn.commit()
+            report["updated"] += len(fresh)
+            report["conflicts"] += len(changes) - len(fresh)
+        
+        report["missing_foods"] = len(missing_foods)
+        return report
+        
+    except Exception as e:
+        write_conn.rollback()
+        print(f"Error recomputing diete: {e}")
+        raise e
+    finally:
+        write_cursor.close()
+        cursor.close()
+        release_db_connection(write_conn)
+        release_db_connection(read_conn)
 
 def get_dieta_by_paziente_id(paziente_id: int):
     """
@@ -728,105 +1796,439 @@ def get_dieta_by_paziente_id(paziente_id: int):
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
-def update_dieta_by_paziente_id(paziente_id: int, dieta_data: dict):
+def update_dieta_by_paziente_id(paziente_id: int, dieta_data: dict, expected_versions=None):
     """
     Update diet data for a specific patient
     
     Args:
         paziente_id: The ID of the patient
         dieta_data: Dictionary containing diet data
+        expected_versions: Optional updated_at values the update is conditional on
     
     Returns:
-        Dictionary containing the updated diet data or None if not found
+        Dictionary with the updated diet data (dieta) and its updated_at,
+        or None if not found
+    
+    Raises:
+        PreconditionFailedError: If the patient changed since the expected versions
     """
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        query = """
+        version_condition, version_params = _version_condition(expected_versions)
+        # The subquery locks the row and returns the diet being replaced
+        query = f"""
         UPDATE pazienti 
         SET dieta = %s::jsonb, updated_at = CURRENT_TIMESTAMP
-        WHERE id = %s
-        RETURNING dieta
+        FROM (SELECT id, dieta FROM pazienti WHERE id = %s FOR UPDATE) AS previous
+        WHERE pazienti.id = previous.id{version_condition}
+        RETURNING pazienti.dieta, pazienti.updated_at, previous.dieta AS previous
         """
         
-        cursor.execute(query, (psycopg2.extras.Json(dieta_data), paziente_id))
+        cursor.execute(query, [psycopg2.extras.Json(dieta_data), paziente_id] + version_params)
         result = cursor.fetchone()
+        if not result and expected_versions is not None:
+            _raise_if_paziente_exists(cursor, paziente_id)
+        if result:
+            result = dict(result)
+            _record_dieta_versions(conn, [(paziente_id, result.pop('previous'), result['dieta'])])
         conn.commit()
         
-        return result['dieta'] if result else None
+        return result
         
+    except PreconditionFailedError:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         print(f"Error updating dieta: {e}")
         raise e
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+def patch_dieta_by_paziente_id(paziente_id: int, operations: list, expected_versions=None):
+    """
+    Apply a JSON Patch to the diet of a patient
+    
+    The patient row is locked while the patch is applied, and only the
+    totals of the meals touched by the patch are recomputed. Only the
+    changed top-level sections are sent back to the database.
+    
+    Args:
+        paziente_id: The ID of the patient
+        operations: JSON Patch (RFC 6902) operations relative to the diet document
+        expected_versions: Optional updated_at values the update is conditional on
+    
+    Returns:
+        Dictionary with the changed top-level sections of the diet (dieta),
+        i.e. meals and totale_giornaliero, and the new updated_at, or None
+        if the patient has no diet
+    
+    Raises:
+        PreconditionFailedError: If the patient changed since the expected versions
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute("SELECT dieta, updated_at FROM pazienti WHERE id = %s FOR UPDATE", (paziente_id,))
+        result = cursor.fetchone()
+        if result and expected_versions is not None and result['updated_at'] not in expected_versions:
+            raise PreconditionFailedError(f"Paziente {paziente_id} modificato da un'altra richiesta")
+        if not result or not result['dieta']:
+            conn.rollback()
+            return None
+        
+        dieta, touched = apply_patch(result['dieta'], operations)
+        recompute_totals(dieta, [pasto for pasto in PASTI if pasto in touched])
+        changed = {key: dieta[key] for key in touched | {"totale_giornaliero"} if key in dieta}
+        removed = [key for key in touched if key not in dieta]
+        
+        cursor.execute(
+            """
+            UPDATE pazienti
+            SET dieta = (dieta - %s::text[]) || %s::jsonb, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            RETURNING updated_at
+            """,
+            (removed, psycopg2.extras.Json(changed), paziente_id)
+        )
+        updated_at = cursor.fetchone()['updated_at']
+        _record_dieta_versions(conn, [(paziente_id, result['dieta'], dieta)])
+        conn.commit()
+        
+        return {"dieta": changed, "updated_at": updated_at}
+        
+    except PreconditionFailedError:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        print(f"Error patching dieta: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
 
-def add_alimento_to_pasto(paziente_id: int, pasto_name: str, alimento_data: dict):
+def add_alimento_to_pasto(paziente_id: int, pasto_name: str, alimento_data: dict, expected_versions=None):
     """
     Add a food item to a specific meal for a patient
     
+    The food is appended to the meal inside the database, which locks the
+    patient row, so concurrent additions to the same diet are applied one
+    after the other and none of them is lost. The meal and daily totals are
+    then recomputed with recompute_totals, like every other diet update,
+    before the lock is released.
+    
     Args:
         paziente_id: The ID of the patient
         pasto_name: Name of the meal (colazione, spuntino, pranzo, merenda, cena)
         alimento_data: Dictionary containing food data with quantity
+        expected_versions: Optional updated_at values the update is conditional on
     
     Returns:
-        Dictionary containing the updated diet data or None if not found
+        Dictionary with the updated diet (dieta) and the new updated_at
+    
+    Raises:
+        PreconditionFailedError: If the patient changed since the expected versions
     """
+    if pasto_name not in PASTI:
+        raise ValueError(f"Invalid pasto name: {pasto_name}")
+    
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        # First get current diet data
-        current_dieta = get_dieta_by_paziente_id(paziente_id)
-        if not current_dieta:
+        version_condition, version_params = _version_condition(expected_versions)
+        cursor.execute(
+            f"""
+            WITH locked AS (
+                SELECT id, dieta
+                FROM pazienti
+                WHERE id = %s
+                AND jsonb_typeof(dieta -> %s) = 'object'{version_condition}
+                FOR UPDATE
+            )
+            UPDATE pazienti
+            SET dieta = jsonb_set(
+                    locked.dieta,
+                    ARRAY[%s, 'alimenti'],
+                    COALESCE(locked.dieta -> %s -> 'alimenti', '[]'::jsonb)
+                        || jsonb_build_array(%s::jsonb)
+                )
+            FROM locked
+            WHERE pazienti.id = locked.id
+            RETURNING pazienti.dieta, locked.dieta AS previous
+            """,
+            [paziente_id, pasto_name, *version_params, pasto_name, pasto_name, psycopg2.extras.Json(alimento_data)]
+        )
+        result = cursor.fetchone()
+        if not result:
+            conn.rollback()
+            cursor.execute(
+                "SELECT 1 FROM pazienti WHERE id = %s AND jsonb_typeof(dieta -> %s) = 'object'",
+                (paziente_id, pasto_name)
+            )
+            if cursor.fetchone() and expected_versions is not None:
+                _raise_if_paziente_exists(cursor, paziente_id)
             raise ValueError(f"Paziente with ID {paziente_id} not found")
         
-        # Add alimento to the specified pasto
-        if pasto_name not in current_dieta:
-            raise ValueError(f"Invalid pasto name: {pasto_name}")
-        
-        # Add the alimento to the pasto
-        current_dieta[pasto_name]["alimenti"].append(alimento_data)
-        
-        # Recalculate totals for this pasto
-        totale_kcal = sum(alimento["kcal"] or 0 for alimento in current_dieta[pasto_name]["alimenti"])
-        totale_proteine = sum(alimento["proteine"] or 0 for alimento in current_dieta[pasto_name]["alimenti"])
-        totale_lipidi = sum(alimento["lipidi"] or 0 for alimento in current_dieta[pasto_name]["alimenti"])
-        totale_carboidrati = sum(alimento["carboidrati"] or 0 for alimento in current_dieta[pasto_name]["alimenti"])
-        totale_fibre = sum(alimento["fibre"] or 0 for alimento in current_dieta[pasto_name]["alimenti"])
-        
-        current_dieta[pasto_name]["totale_kcal"] = totale_kcal
-        current_dieta[pasto_name]["totale_proteine"] = totale_proteine
-        current_dieta[pasto_name]["totale_lipidi"] = totale_lipidi
-        current_dieta[pasto_name]["totale_carboidrati"] = totale_carboidrati
-        current_dieta[pasto_name]["totale_fibre"] = totale_fibre
-        
-        # Recalculate daily totals
-        pasti = ["colazione", "spuntino", "pranzo", "merenda", "cena"]
-        totale_giornaliero_kcal = sum(current_dieta[pasto]["totale_kcal"] for pasto in pasti)
-        totale_giornaliero_proteine = sum(current_dieta[pasto]["totale_proteine"] for pasto in pasti)
-        totale_giornaliero_lipidi = sum(current_dieta[pasto]["totale_lipidi"] for pasto in pasti)
-        totale_giornaliero_carboidrati = sum(current_dieta[pasto]["totale_carboidrati"] for pasto in pasti)
-        totale_giornaliero_fibre = sum(current_dieta[pasto]["totale_fibre"] for pasto in pasti)
-        
-        current_dieta["totale_giornaliero"]["totale_kcal"] = totale_giornaliero_kcal
-        current_dieta["totale_giornaliero"]["totale_proteine"] = totale_giornaliero_proteine
-        current_dieta["totale_giornaliero"]["totale_lipidi"] = totale_giornaliero_lipidi
-        current_dieta["totale_giornaliero"]["totale_carboidrati"] = totale_giornaliero_carboidrati
-        current_dieta["totale_giornaliero"]["totale_fibre"] = totale_giornaliero_fibre
-        
-        # Update the database
-        return update_dieta_by_paziente_id(paziente_id, current_dieta)
+        dieta = recompute_totals(result['dieta'], [pasto_name])
+        changed = {key: dieta[key] for key in (pasto_name, "totale_giornaliero")}
+        cursor.execute(
+            """
+            UPDATE pazienti
+            SET dieta = dieta || %s::jsonb, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            RETURNING updated_at
+            """,
+            (psycopg2.extras.Json(changed), paziente_id)
+        )
+        updated_at = cursor.fetchone()['updated_at']
+        _record_dieta_versions(conn, [(paziente_id, result['previous'], dieta)])
+        conn.commit()
+        
+        return {"dieta": dieta, "updated_at": updated_at}
         
+    except PreconditionFailedError:
+        conn.rollback()
+        raise
     except Exception as e:
+        conn.rollback()
         print(f"Error adding alimento to pasto: {e}")
         raise e
     finally:
         cursor.close()
-        conn.close() 
\ No newline at end of file
+        release_db_connection(conn)
+
+def copy_dieta_from_paziente(paziente_id: int, source_id: int, pasti=None, expected_versions=None):
+    """
+    Copy the diet of another patient, or some of its meals, into a patient's diet
+    
+    The copy is a single UPDATE that reads the source diet inside the
+    database, so the diet never travels through the application. Copied
+    meals replace the meals of the same name, the other meals are kept,
+    and the daily totals are recomputed.
+    
+    Args:
+        paziente_id: The ID of the patient receiving the diet
+        source_id: The ID of the patient whose diet is copied
+        pasti: Names of the meals to copy; the whole diet when None
+        expected_versions: Optional updated_at values the update is conditional on
+    
+    Returns:
+        Dictionary with the new diet (dieta) and its updated_at, or None if
+        either patient doesn't exist or the source patient has no diet
+    
+    Raises:
+        PreconditionFailedError: If the patient changed since the expected versions
+    """
+    if paziente_id == source_id:
+        raise ValueError("Il paziente di origine deve essere diverso da quello di destinazione")
+    if pasti is not None:
+        invalid = [pasto for pasto in pasti if pasto not in PASTI]
+        if invalid:
+            raise ValueError(f"Pasti non validi: {', '.join(invalid)}. Usare uno tra: {', '.join(PASTI)}")
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        if pasti is None:
+            copied = "source.dieta"
+            params = []
+        else:
+            copied = """COALESCE(previous.dieta, '{}'::jsonb) || COALESCE((
+                SELECT jsonb_object_agg(pasto, source.dieta -> pasto)
+                FROM unnest(%s::text[]) pasto
+                WHERE jsonb_typeof(source.dieta -> pasto) = 'object'
+            ), '{}'::jsonb)"""
+            params = [list(pasti)]
+        daily_totals = ", ".join(
+            f"'{totale}', COALESCE(sum((merged.dieta -> pasto ->> '{totale}')::numeric), 0)"
+            for totale, _ in TOTALI_NUTRIENTI
+        )
+        version_condition, version_params = _version_condition(expected_versions)
+        
+        query = f"""
+        WITH previous AS (
+            SELECT id, dieta
+            FROM pazienti
+            WHERE id = %s
+            FOR UPDATE
+        ),
+        merged AS (
+            SELECT previous.id, previous.dieta AS previous, {copied} AS dieta
+            FROM previous, pazienti source
+            WHERE source.id = %s
+            AND jsonb_typeof(source.dieta) = 'object'
+        )
+        UPDATE pazienti
+        SET dieta = jsonb_set(
+                merged.dieta,
+                '{{totale_giornaliero}}',
+                COALESCE(merged.dieta -> 'totale_giornaliero', '{{}}'::jsonb)
+                    || (
+                        SELECT jsonb_build_object({daily_totals})
+                        FROM unnest(%s::text[]) pasto
+                    )
+            ),
+            updated_at = CURRENT_TIMESTAMP
+        FROM merged
+        WHERE pazienti.id = merged.id{version_condition}
+        RETURNING pazienti.dieta, pazienti.updated_at, merged.previous
+        """
+        
+        cursor.execute(query, [paziente_id, *params, source_id, PASTI] + version_params)
+        result = cursor.fetchone()
+        
+        if not result:
+            conn.rollback()
+            cursor.execute(
+                "SELECT 1 FROM pazienti WHERE id = %s AND jsonb_typeof(dieta) = 'object'",
+                (source_id,)
+            )
+            if cursor.fetchone() and expected_versions is not None:
+                _raise_if_paziente_exists(cursor, paziente_id)
+            return None
+        
+        result = dict(result)
+        _record_dieta_versions(conn, [(paziente_id, result.pop('previous'), result['dieta'])])
+        conn.commit()
+        
+        return result
+        
+    except PreconditionFailedError:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        print(f"Error copying dieta: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def get_dieta_versioni(paziente_id: int, limit: int = 100, offset: int = 0):
+    """
+    List the versions in the diet history of a patient, newest first
+    
+    Args:
+        paziente_id: The ID of the patient
+        limit: Maximum number of versions to return
+        offset: Number of versions to skip
+    
+    Returns:
+        Dictionary with the versions (data), each with versione, tipo,
+        created_at and the stored size in bytes (dimensione), and their
+        total count (total), or None if the patient doesn't exist
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute("SELECT 1 FROM pazienti WHERE id = %s", (paziente_id,))
+        if not cursor.fetchone():
+            return None
+        
+        cursor.execute(
+            """
+            SELECT versione, tipo, created_at, pg_column_size(contenuto) AS dimensione
+            FROM diete_versioni
+            WHERE paziente_id = %s
+            ORDER BY versione DESC
+            LIMIT %s OFFSET %s
+            """,
+            (paziente_id, limit, offset)
+        )
+        versioni = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.execute("SELECT count(*) AS total FROM diete_versioni WHERE paziente_id = %s", (paziente_id,))
+        total = cursor.fetchone()['total']
+        
+        return {"data": versioni, "total": total}
+        
+    except Exception as e:
+        print(f"Error fetching dieta versioni: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def get_dieta_versione(paziente_id: int, versione: int):
+    """
+    Rebuild a version of the diet of a patient
+    
+    Starts from the closest snapshot at or before the version and applies
+    the deltas that follow it, at most DIETE_SNAPSHOT_INTERVAL - 1.
+    
+    Args:
+        paziente_id: The ID of the patient
+        versione: Version number
+    
+    Returns:
+        Dictionary with versione, the diet (dieta) and created_at, or None
+        if the version doesn't exist
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cursor.execute(
+            """
+            SELECT versione, tipo, contenuto, created_at
+            FROM diete_versioni
+            WHERE paziente_id = %(paziente_id)s
+            AND versione <= %(versione)s
+            AND versione >= (
+                SELECT max(versione)
+                FROM diete_versioni
+                WHERE paziente_id = %(paziente_id)s
+                AND versione <= %(versione)s
+                AND tipo = 'snapshot'
+            )
+            ORDER BY versione
+            """,
+            {"paziente_id": paziente_id, "versione": versione}
+        )
+        rows = cursor.fetchall()
+        if not rows or rows[-1]['versione'] != versione:
+            return None
+        
+        dieta = rows[0]['contenuto']
+        for row in rows[1:]:
+            dieta, _ = apply_patch(dieta, row['contenuto'])
+        
+        return {"versione": versione, "dieta": dieta, "created_at": rows[-1]['created_at']}
+        
+    except Exception as e:
+        print(f"Error fetching dieta versione: {e}")
+        raise e
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+def diff_dieta_versioni(paziente_id: int, from_versione: int, to_versione: int):
+    """
+    Compute the changes between two versions of the diet of a patient
+    
+    Args:
+        paziente_id: The ID of the patient
+        from_versione: Version to start from
+        to_versione: Version to reach
+    
+    Returns:
+        JSON Patch operations turning the first version into the second,
+        or None if either version doesn't exist
+    """
+    source = get_dieta_versione(paziente_id, from_versione)
+    if source is None:
+        return None
+    target = get_dieta_versione(paziente_id, to_versione)
+    if target is None:
+        return None
+    return make_patch(source['dieta'], target['dieta'])
@@ -0,0 +1,262 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeoutError(ConnectionError):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are lent out with getconn() and must be given back with
+    putconn(). Idle connections above min_size are closed once they have
+    been unused for idle_timeout seconds, and connections that have been
+    idle for longer than health_check_interval seconds are checked with a
+    cheap query before being lent out again.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, idle_timeout=300,
+                 health_check_interval=30, acquire_timeout=30):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if min_size < 0 or min_size > max_size:
+            raise ValueError("min_size must be between 0 and max_size")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        # Idle connections as (connection, last_used) pairs; the right end
+        # holds the most recently returned ones
+        self._idle = deque()
+        self._in_use = set()
+        self._opening = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._stats = {
+            "requests": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "health_check_failures": 0,
+        }
+
+    def open(self):
+        """Open min_size connections up front"""
+        with self._cond:
+            missing = self.min_size - self._size()
+            self._opening += max(missing, 0)
+
+        for _ in range(max(missing, 0)):
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        """
+        Borrow a connection from the pool
+
+        Blocks for up to acquire_timeout seconds when the pool is saturated.
+
+        Returns:
+            An open psycopg2 connection
+        """
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        waited = False
+
+        while True:
+            conn = None
+            last_used = None
+            expired = []
+
+            with self._cond:
+                if self._closed:
+                    raise ConnectionError("Connection pool is closed")
+
+                while True:
+                    expired.extend(self._pop_expired())
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        self._in_use.add(conn)
+                        break
+                    if self._size() < self.max_size:
+                        self._opening += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {self.acquire_timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            self._close_all(expired)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use.add(conn)
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+
+            self._record_request(started, waited)
+            return conn
+
+    def putconn(self, conn):
+        """Give a borrowed connection back to the pool"""
+        if conn.closed:
+            self._discard(conn)
+            return
+
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if self._closed:
+                close_now = True
+            else:
+                close_now = False
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if close_now:
+            self._close_all([conn])
+
+    def close(self):
+        """Close every idle connection and refuse further borrowing"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_all(idle)
+
+    def stats(self):
+        """
+        Snapshot of pool usage
+
+        Returns:
+            Dictionary with current sizes, saturation and lifetime counters
+        """
+        with self._cond:
+            in_use = len(self._in_use)
+            size = self._size()
+            snapshot = {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "waiting": self._waiting,
+                "saturation": round(in_use / self.max_size, 3),
+            }
+            snapshot.update(self._stats)
+
+        snapshot["wait_time_ms"] = round(snapshot["wait_time_ms"], 3)
+        snapshot["max_wait_ms"] = round(snapshot["max_wait_ms"], 3)
+        return snapshot
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        with self._cond:
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats["health_check_failures"] += 1
+            return False
+
+    def _pop_expired(self):
+        """Remove idle connections past idle_timeout, keeping min_size open (lock held)"""
+        expired = []
+        now = time.monotonic()
+        while self._idle and self._size() > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.popleft()
+            expired.append(conn)
+        return expired
+
+    def _discard(self, conn):
+        with self._cond:
+            self._in_use.discard(conn)
+            self._cond.notify()
+        self._close_all([conn])
+
+    def _close_all(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if connections:
+            with self._cond:
+                self._stats["connections_closed"] += len(connections)
+
+    def _record_request(self, started, waited):
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._stats["requests"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time_ms"] += wait_ms
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
@@ -0,0 +1,209 @@
+import copy
+
+import numpy as np
+
+from diet_utils import PASTI, TOTALI_NUTRIENTI, meal_groups, recompute_totals
+
+NUTRIENTI = [campo for _, campo in TOTALI_NUTRIENTI]
+
+# Scope of the targets that apply to the whole day
+GIORNALIERO = "totale_giornaliero"
+
+# Weight of staying close to the current quantities, relative to the targets
+REGULARIZATION = 1e-3
+
+MAX_ITERATIONS = 200
+# Largest distance of the factors from the optimum when the solver stops
+TOLERANCE = 1e-4
+
+
+def _amount(alimento: dict, campo: str):
+    value = alimento.get(campo)
+    return value if isinstance(value, (int, float)) else 0
+
+
+def _target_rows(groups, fixed, giornaliero, pasti):
+    """
+    Build one row per target: the contribution of each group at its
+    current quantities, and the range the weighted sum must fall in once
+    the contribution of the fixed foods is taken out
+    """
+    rows, bounds, labels = [], [], []
+    scopes = [(GIORNALIERO, giornaliero)] + [(pasto, pasti.get(pasto)) for pasto in PASTI]
+
+    for scope, targets in scopes:
+        for campo, (low, high) in (targets or {}).items():
+            if campo not in NUTRIENTI:
+                raise ValueError(f"Nutriente sconosciuto: {campo}")
+            if low is None and high is None:
+                continue
+            if low is not None and high is not None and low > high:
+                raise ValueError(f"Intervallo non valido per {campo} in {scope}: min maggiore di max")
+
+            row = [
+                contribution[campo] if scope in (GIORNALIERO, pasto) else 0.0
+                for pasto, contribution, _ in groups
+            ]
+            offset = sum(
+                contribution[campo] for pasto, contribution in fixed if scope in (GIORNALIERO, pasto)
+            )
+            rows.append(row)
+            bounds.append((
+                -np.inf if low is None else low,
+                np.inf if high is None else high,
+                offset
+            ))
+            labels.append((scope, campo))
+
+    return np.array(rows, dtype=np.float64).reshape(len(rows), len(groups)), bounds, labels
+
+
+def _solve(matrix, low, high, lower, upper):
+    """
+    Minimise the squared relative distance of matrix @ x from [low, high]
+    plus a small pull of x towards 1, with lower <= x <= upper
+
+    Uses projected Newton (Bertsekas): the objective is piecewise quadratic,
+    so on the rows currently out of range and the factors not held at a
+    bound each step solves the problem exactly, and a search along the
+    projection arc keeps the objective decreasing while the active rows and
+    bounds settle. It stops once the projected gradient bounds the distance
+    of x from the optimum by TOLERANCE.
+    """
+    scale = np.maximum(np.maximum(np.abs(np.where(np.isfinite(low), low, 0)),
+                                  np.abs(np.where(np.isfinite(high), high, 0))), 1.0)
+    matrix = matrix / scale[:, None]
+    low = low / scale
+    high = high / scale
+
+    lipschitz = 2 * (np.linalg.norm(matrix, 2) ** 2 + REGULARIZATION)
+    convexity = 2 * REGULARIZATION
+
+    def evaluate(x):
+        values = matrix @ x
+        violation = values - np.clip(values, low, high)
+        return violation @ violation + REGULARIZATION * (x - 1) @ (x - 1), values, violation
+
+    x = np.clip(np.ones(matrix.shape[1]), lower, upper)
+    objective, values, violation = evaluate(x)
+    for _ in range(MAX_ITERATIONS):
+        gradient = 2 * (matrix.T @ violation) + 2 * REGULARIZATION * (x - 1)
+        mapping = x - np.clip(x - gradient / lipschitz, lower, upper)
+        if np.linalg.norm(mapping) * lipschitz / convexity <= TOLERANCE:
+            break
+
+        # Factors at a bound that the gradient pushes outwards stay there
+        margin = min(1e-3, np.linalg.norm(x - np.clip(x - gradient, lower, upper)))
+        held = ((x <= lower + margin) & (gradient > 0)) | ((x >= upper - margin) & (gradient < 0))
+        free = ~held
+
+        active = matrix[(values < low) | (values > high)][:, free]
+        hessian = 2 * (active.T @ active) + convexity * np.eye(free.sum())
+        direction = np.zeros_like(x)
+        direction[free] = -np.linalg.solve(hessian, gradient[free])
+        direction[held] = -gradient[held] / lipschitz
+
+        length = 1.0
+        while True:
+            x_next = np.clip(x + length * direction, lower, upper)
+            objective_next, values_next, violation_next = evaluate(x_next)
+            decrease = (-length * gradient[free] @ direction[free]
+                        + gradient[held] @ (x[held] - x_next[held]))
+            if objective - objective_next >= 1e-4 * decrease or length < 1e-12:
+                break
+            length /= 2
+        x, objective, values, violation = x_next, objective_next, values_next, violation_next
+    return x
+
+
+def optimize_diet(dieta: dict, giornaliero: dict = None, pasti: dict = None,
+                  quantita_min: float = 5, quantita_max: float = 500):
+    """
+    Adjust the quantities of a diet to meet nutrient targets
+
+    Every main food is scaled together with its equivalents, so equivalents
+    stay interchangeable; the nutrient values of each food are scaled with
+    its quantity. Among the quantities that meet the targets the closest
+    to the current ones are chosen; when the targets cannot all be met the
+    total squared relative shortfall is minimised.
+
+    Args:
+        dieta: Diet document
+        giornaliero: Targets for the whole day, nutrient -> (min, max)
+            where either bound may be None
+        pasti: Targets per meal, meal -> nutrient -> (min, max)
+        quantita_min: Minimum quantity in grams of each food
+        quantita_max: Maximum quantity in grams of each food
+
+    Returns:
+        Tuple of (optimised copy of the diet with recomputed totals, list
+        of dictionaries describing each target and its final value)
+    """
+    pasti = pasti or {}
+    unknown = set(pasti) - set(PASTI)
+    if unknown:
+        raise ValueError(f"Pasti non validi: {', '.join(sorted(unknown))}. Usare uno tra: {', '.join(PASTI)}")
+    if quantita_min > quantita_max:
+        raise ValueError("quantita_min non può essere maggiore di quantita_max")
+
+    dieta = copy.deepcopy(dieta)
+
+    # One variable per food group: the factor applied to all its quantities.
+    # Foods without a quantity cannot be scaled and only count as fixed values
+    groups, fixed = [], []
+    for pasto in PASTI:
+        meal = dieta.get(pasto)
+        if not isinstance(meal, dict):
+            continue
+        for group in meal_groups(meal.get("alimenti") or []):
+            contribution = {
+                campo: sum(_amount(item, campo) for item in group) / len(group)
+                for campo in NUTRIENTI
+            }
+            quantities = [item.get("quantita") for item in group]
+            if not all(isinstance(q, (int, float)) and q > 0 for q in quantities):
+                fixed.append((pasto, contribution))
+                continue
+            lower = max(quantita_min / q for q in quantities)
+            upper = min(quantita_max / q for q in quantities)
+            groups.append((pasto, contribution, (group, lower, max(lower, upper))))
+
+    if not groups:
+        raise ValueError("La dieta non contiene alimenti con quantità da ottimizzare")
+
+    matrix, bounds, labels = _target_rows(groups, fixed, giornaliero, pasti)
+    if not labels:
+        raise ValueError("Specificare almeno un obiettivo")
+
+    low = np.array([bound[0] - bound[2] for bound in bounds])
+    high = np.array([bound[1] - bound[2] for bound in bounds])
+    lower = np.array([limits[1] for _, _, limits in groups])
+    upper = np.array([limits[2] for _, _, limits in groups])
+
+    factors = _solve(matrix, low, high, lower, upper)
+
+    for (_, _, (group, _, _)), factor in zip(groups, factors):
+        for item in group:
+            quantita = max(quantita_min, min(quantita_max, round(item["quantita"] * factor)))
+            ratio = quantita / item["quantita"]
+            item["quantita"] = quantita
+            for campo in NUTRIENTI:
+                if isinstance(item.get(campo), (int, float)):
+                    item[campo] = round(item[campo] * ratio, 1)
+
+    recompute_totals(dieta)
+
+    results = []
+    for (scope, campo), (minimo, massimo, _) in zip(labels, bounds):
+        totals = dieta.get(scope) or {}
+        valore = totals.get(f"totale_{campo}", 0)
+        results.append({
+            "pasto": scope,
+            "nutriente": campo,
+            "valore": round(valore, 1),
+            "min": minimo if np.isfinite(minimo) else None,
+            "max": massimo if np.isfinite(massimo) else None,
+            "rispettato": bool(minimo <= valore <= massimo),
+        })
+
+    return dieta, results
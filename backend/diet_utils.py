@@ -0,0 +1,178 @@
+PASTI = ["colazione", "spuntino", "pranzo", "merenda", "cena"]
+
+# Meal and daily total keys with the food field they sum
+TOTALI_NUTRIENTI = [
+    ("totale_kcal", "kcal"),
+    ("totale_proteine", "proteine"),
+    ("totale_lipidi", "lipidi"),
+    ("totale_carboidrati", "carboidrati"),
+    ("totale_fibre", "fibre"),
+]
+
+# Food fields of a diet item with the alimenti column holding their value per 100 g
+CAMPI_ALIMENTI = [
+    ("kcal", "energia_kcal"),
+    ("proteine", "proteine_totali_g"),
+    ("lipidi", "lipidi_totali_g"),
+    ("carboidrati", "carboidrati_disponibili_g"),
+    ("fibre", "fibra_alimentare_totale_g"),
+]
+
+# Differences below the one-decimal rounding of totals are not changes
+TOLLERANZA_VALORI = 0.05
+
+
+def _value(alimento: dict, campo: str):
+    value = alimento.get(campo)
+    return value if isinstance(value, (int, float)) else 0
+
+
+def meal_groups(alimenti: list):
+    """
+    Group the foods of a meal the way calculateMealTotals in the frontend does
+
+    A main food with equivalents forms a group with its equivalents; any
+    other main food is a group of its own, as is a selected equivalent not
+    attached to a main food. Foods of any other type, or without one, are
+    left out, as the frontend ignores them too.
+    """
+    groups = []
+    for alimento in alimenti:
+        tipo = alimento.get("tipo")
+        equivalenti = alimento.get("equivalenti") or []
+        if tipo == "equivalente":
+            if not alimento.get("parentId") and alimento.get("selected"):
+                groups.append([alimento])
+        elif tipo == "principale":
+            groups.append([alimento] + equivalenti)
+    return groups
+
+
+def calculate_meal_totals(alimenti: list):
+    """
+    Calculate the totals of a meal, like calculateMealTotals in the frontend
+
+    A main food with equivalents counts as the mean of the main food and its
+    equivalents; any other main food counts in full, as does a selected
+    equivalent not attached to a main food. Other foods do not count.
+
+    Args:
+        alimenti: Foods of the meal
+
+    Returns:
+        Dictionary of meal totals rounded to one decimal
+    """
+    totals = dict.fromkeys((totale for totale, _ in TOTALI_NUTRIENTI), 0)
+    for group in meal_groups(alimenti):
+        for totale, campo in TOTALI_NUTRIENTI:
+            totals[totale] += sum(_value(item, campo) for item in group) / len(group)
+    return {totale: round(total, 1) for totale, total in totals.items()}
+
+
+def meal_weights(alimenti: list):
+    """
+    Yield the foods of a meal with the weight they count with in the totals
+
+    Foods in a group of a main food and its equivalents weigh 1/len(group),
+    so that weighted sums give the same totals as calculate_meal_totals.
+    """
+    for group in meal_groups(alimenti):
+        for alimento in group:
+            yield alimento, 1 / len(group)
+
+
+def calculate_daily_totals(dieta: dict):
+    """Sum the totals of every meal of a diet"""
+    return {
+        totale: sum(_value(dieta.get(pasto) or {}, totale) for pasto in PASTI)
+        for totale, _ in TOTALI_NUTRIENTI
+    }
+
+
+def recompute_totals(dieta: dict, pasti=None):
+    """
+    Recompute meal totals and the daily totals of a diet in place
+
+    Args:
+        dieta: Diet document
+        pasti: Meals whose totals changed; all meals when None
+    """
+    for pasto in (PASTI if pasti is None else pasti):
+        meal = dieta.get(pasto)
+        if isinstance(meal, dict):
+            meal.update(calculate_meal_totals(meal.get("alimenti") or []))
+
+    daily = dieta.get("totale_giornaliero")
+    dieta["totale_giornaliero"] = {**(daily if isinstance(daily, dict) else {}), **calculate_daily_totals(dieta)}
+    return dieta
+
+
+def _items(dieta: dict):
+    """Every food of a diet, equivalents included"""
+    for pasto in PASTI:
+        meal = dieta.get(pasto)
+        if not isinstance(meal, dict):
+            continue
+        for alimento in meal.get("alimenti") or []:
+            yield alimento
+            yield from alimento.get("equivalenti") or []
+
+
+def diet_food_ids(dieta: dict):
+    """IDs of every food of a diet, equivalents included"""
+    return {alimento["id"] for alimento in _items(dieta) if isinstance(alimento.get("id"), int)}
+
+
+def _changed(old, new):
+    if not isinstance(old, (int, float)):
+        return True
+    return abs(old - new) > TOLLERANZA_VALORI
+
+
+def _totals(dieta: dict):
+    """Snapshot of the meal and daily totals of a diet"""
+    sections = [dieta.get(pasto) for pasto in PASTI] + [dieta.get("totale_giornaliero")]
+    return [
+        [section.get(totale) for totale, _ in TOTALI_NUTRIENTI] if isinstance(section, dict) else None
+        for section in sections
+    ]
+
+
+def refresh_diet_values(dieta: dict, valori: dict):
+    """
+    Recompute the food values and totals of a diet from catalog values, in place
+
+    Every food with a known ID gets its fields recomputed from the values
+    per 100 g scaled by quantita, the same way the frontend fills them in
+    when a food is added; then meal and daily totals are recomputed.
+
+    Args:
+        dieta: Diet document
+        valori: Food ID -> {field: value per 100 g} for the fields of CAMPI_ALIMENTI
+
+    Returns:
+        True if any value changed by more than the rounding of totals
+    """
+    changed = False
+    for alimento in _items(dieta):
+        per_100g = valori.get(alimento.get("id"))
+        quantita = alimento.get("quantita")
+        if per_100g is None or not isinstance(quantita, (int, float)):
+            continue
+        factor = quantita / 100
+        for campo, _ in CAMPI_ALIMENTI:
+            value = per_100g[campo] * factor
+            if not changed and _changed(alimento.get(campo), value):
+                changed = True
+            alimento[campo] = value
+
+    before = _totals(dieta)
+    recompute_totals(dieta)
+    if not changed:
+        for old, new in zip(before, _totals(dieta)):
+            if old is None and new is None:
+                continue
+            if old is None or any(_changed(a, b) for a, b in zip(old, new)):
+                changed = True
+                break
+    return changed
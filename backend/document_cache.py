@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from document_utils import TEMPLATE_VERSION, DOCUMENT_PATIENT_FIELDS
+
+
+def document_cache_key(paziente_data: dict, dieta_data: dict, max_combinations=None):
+    """
+    Hash of everything a diet document is built from
+
+    Covers the patient fields printed in the document, the diet, the
+    template version and the layout options, so any change to them yields
+    a different document key.
+    """
+    content = {
+        "template": TEMPLATE_VERSION,
+        "max_combinations": max_combinations,
+        "paziente": {field: paziente_data.get(field) for field in DOCUMENT_PATIENT_FIELDS},
+        "dieta": dieta_data,
+    }
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class DocumentCache:
+    """
+    Thread-safe LRU cache of rendered documents bounded by their size.
+
+    Documents are kept in memory up to max_bytes in total; the least
+    recently used are evicted first. When a directory is given, evicted
+    documents are written there and served from disk until the directory
+    holds more than disk_max_bytes, so documents survive restarts and a
+    larger set than fits in memory stays cached.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Documents on disk, least recently used first, with their sizes
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._index_directory()
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, f"{key}.docx")
+
+    def _index_directory(self):
+        """Pick up the documents spilled by a previous run, oldest first"""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".docx"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name[:-len(".docx")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._trim_disk()
+
+    def get(self, key: str):
+        """
+        Look up a rendered document
+
+        Returns:
+            Bytes of the document, or None when it is not cached
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return data
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                self.put(key, data)
+                return data
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, data: bytes):
+        """Store a rendered document, evicting the least recently used ones over max_bytes"""
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+
+            evicted = []
+            while self._bytes > self.max_bytes:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._bytes -= len(old_data)
+                self._stats["evictions"] += 1
+                evicted.append((old_key, old_data))
+
+        if self.directory:
+            for old_key, old_data in evicted:
+                self._spill(old_key, old_data)
+
+    def _spill(self, key: str, data: bytes):
+        """Write an evicted document to the disk directory"""
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                return
+
+        path = self._path(key)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Delete the least recently used documents over disk_max_bytes (lock held)"""
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Snapshot of cache size and hit/miss counters"""
+        with self._lock:
+            snapshot = {
+                "items": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_enabled": bool(self.directory),
+            }
+            snapshot.update(self._stats)
+
+        lookups = snapshot["hits"] + snapshot["disk_hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = round((snapshot["hits"] + snapshot["disk_hits"]) / lookups, 3) if lookups else None
+        return snapshot
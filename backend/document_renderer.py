@@ -0,0 +1,180 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from document_utils import create_diet_document, DOCUMENT_ENGINES, MAX_BULLET_COMBINATIONS
+
+# Where documents are built: worker processes, or threads of the API
+# process where processes cannot be started
+EXECUTORS = ("process", "thread")
+
+
+class RendererBusyError(Exception):
+    """Raised when the render queue is full and a document cannot be accepted"""
+
+
+def _render(paziente_data: dict, dieta_data: dict, engine: str, max_combinations: int):
+    """Build a diet document in a worker and time it"""
+    started = time.perf_counter()
+    data = create_diet_document(paziente_data, dieta_data, engine, max_combinations).getvalue()
+    return data, time.perf_counter() - started
+
+
+class DocumentRenderer:
+    """
+    Bounded pool of worker processes building diet documents.
+
+    Rendering a document with python-docx is CPU-bound pure Python, so it
+    runs in separate processes and neither blocks the event loop nor holds
+    the GIL of the API process. At most workers documents are built at a
+    time and at most queue_size more wait for a worker; further requests
+    are rejected with RendererBusyError instead of piling up. The worker
+    processes are started on the first render.
+
+    With executor "thread", or when the platform cannot start a process
+    pool (serverless runtimes without /dev/shm have no semaphores), the
+    workers are threads of the API process instead, with the same limits.
+    """
+
+    def __init__(self, workers=2, queue_size=8, engine="docx", max_combinations=MAX_BULLET_COMBINATIONS,
+                 executor="process"):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if queue_size < 0:
+            raise ValueError("queue_size must not be negative")
+        if engine not in DOCUMENT_ENGINES:
+            raise ValueError(f"engine must be one of: {', '.join(DOCUMENT_ENGINES)}")
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor must be one of: {', '.join(EXECUTORS)}")
+
+        self.workers = workers
+        self.queue_size = queue_size
+        self.engine = engine
+        self.max_combinations = max_combinations
+        self.executor = executor
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._stats = {
+            "rendered": 0,
+            "rejected": 0,
+            "failed": 0,
+            "render_time_ms": 0.0,
+            "max_render_ms": 0.0,
+            "wait_time_ms": 0.0,
+        }
+
+    def _get_executor(self):
+        """Get the worker pool, starting it on first use (lock held)"""
+        if self._executor is None and self.executor == "process":
+            try:
+                # Forking a process that runs threads (the event loop, the
+                # database pool) is unsafe, so workers start from scratch
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError, ImportError):
+                # No working multiprocessing locks: render in threads from now on
+                self.executor = "thread"
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="document-renderer")
+        return self._executor
+
+    async def render(self, paziente_data: dict, dieta_data: dict):
+        """
+        Build the Word document of a diet in a worker
+
+        Args:
+            paziente_data: Dictionary containing patient data
+            dieta_data: Dictionary containing diet data
+
+        Returns:
+            Bytes of the .docx file
+
+        Raises:
+            RendererBusyError: If every worker is busy and the queue is full
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self._stats["rejected"] += 1
+                raise RendererBusyError("Troppe esportazioni in corso, riprovare tra qualche secondo")
+            self._pending += 1
+            executor = self._get_executor()
+
+        submitted = time.perf_counter()
+        try:
+            try:
+                future = executor.submit(_render, paziente_data, dieta_data, self.engine, self.max_combinations)
+            except BaseException:
+                self._release()
+                raise
+            # The slot is freed when the worker is done with the document, not
+            # when this request ends: a client that disconnects mid-render
+            # cancels the await but not the render
+            future.add_done_callback(self._release)
+            data, render_seconds = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # A worker died: start a fresh pool for the next requests
+            with self._lock:
+                self._stats["failed"] += 1
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+
+        render_ms = render_seconds * 1000
+        with self._lock:
+            self._stats["rendered"] += 1
+            self._stats["render_time_ms"] += render_ms
+            self._stats["max_render_ms"] = max(self._stats["max_render_ms"], render_ms)
+            self._stats["wait_time_ms"] += max((time.perf_counter() - submitted) * 1000 - render_ms, 0.0)
+        return data
+
+    def _release(self, future=None):
+        """Free the slot of a finished or never started render"""
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        """Stop the workers; they are started again on the next render"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        """
+        Snapshot of renderer usage
+
+        Returns:
+            Dictionary with the pool limits, the documents in progress and
+            waiting for a worker, and lifetime counters and timings
+        """
+        with self._lock:
+            snapshot = {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "engine": self.engine,
+                "executor": self.executor,
+                "started": self._executor is not None,
+                "in_progress": min(self._pending, self.workers),
+                "queued": max(self._pending - self.workers, 0),
+            }
+            snapshot.update(self._stats)
+
+        rendered = snapshot["rendered"]
+        snapshot["avg_render_ms"] = round(snapshot["render_time_ms"] / rendered, 3) if rendered else None
+        snapshot["avg_wait_ms"] = round(snapshot["wait_time_ms"] / rendered, 3) if rendered else None
+        snapshot["render_time_ms"] = round(snapshot["render_time_ms"], 3)
+        snapshot["max_render_ms"] = round(snapshot["max_render_ms"], 3)
+        snapshot["wait_time_ms"] = round(snapshot["wait_time_ms"], 3)
+        return snapshot
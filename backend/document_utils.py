@@ -1,647 +1,814 @@
+import copy
+import itertools
+import math
+import re
+import threading
+import zipfile
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
 from docx import Document
-from docx.shared import Pt, RGBColor, Inches, Cm
+from docx.shared import Pt, RGBColor, Inches, Emu
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.section import WD_ORIENT
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
+from docx.text.run import Run
 from io import BytesIO
 
-def set_cell_background(cell, fill):
-    """
-    Set cell background color
-    """
-    cell_properties = cell._element.tcPr
-    if cell_properties is None:
-        cell_properties = OxmlElement('w:tcPr')
-        cell._element.append(cell_properties)
-    
-    shading = OxmlElement('w:shd')
-    shading.set(qn('w:fill'), fill)
-    cell_properties.append(shading)
-
-def create_diet_document(paziente_data, dieta_data):
+# Bump whenever a change to this module changes the generated documents, so
+# that cached renders of the previous layout are no longer served
+TEMPLATE_VERSION = 3
+
+# Patient fields printed in the document
+DOCUMENT_PATIENT_FIELDS = ("nome", "cognome", "eta", "email", "telefono")
+
+# Engines of create_diet_document: python-docx, or the direct XML writer
+DOCUMENT_ENGINES = ("docx", "xml")
+
+# Meals whose bullet layout would list more combinations than this are laid
+# out as a table instead
+MAX_BULLET_COMBINATIONS = 50
+
+BODY_FONT = 'Century Gothic'
+TITLE_FONT = 'Muthiara -Demo Version-'
+BLACK = RGBColor(0, 0, 0)
+TITLE_COLOR = RGBColor(0x77, 0x20, 0x6d)  # #77206d
+SUBTITLE_COLOR = RGBColor(0xe5, 0x9e, 0xdc)  # #e59edc
+
+# Meal titles in UPPERCASE
+MEAL_TITLES = {
+    'colazione': 'COLAZIONE',
+    'spuntino': 'SPUNTINO',
+    'pranzo': 'PRANZO',
+    'merenda': 'MERENDA',
+    'cena': 'CENA'
+}
+
+# Parts of the PRANZO and CENA title after "<MEAL>, scegli "
+MAIN_MEAL_INSTRUCTIONS = [
+    "1 fonte di carboidrati",
+    ", ",
+    "1 fonte di proteine",
+    ", ",
+    "1 fonte di grassi",
+    " e ",
+    "1 contorno",
+    " per comporre il tuo piatto:",
+]
+
+# Printed when the diet has no consigli_generali of its own
+DEFAULT_GENERAL_TIPS = [
+    "Non è necessario rispettare quantità precise per la **verdura**. Anzi aumentane le quantità durante i pasti se hai ancora fame.",
+    "Il **caffè** non è inserito nel piano, ma puoi berne quanto ne vuoi durante la giornata.",
+    "Per la **frutta** scegli quella che preferisci (considera 150 g come riferimento) di base corrisponde ad 1 frutto grande (pesca) o 2 piccole (ad esempio le albicocche).",
+    "**Spuntini e merende** possono essere **scambiati** tra mattina e pomeriggio, così come **pranzi e cene** sia all'interno della stessa, che tra giornate diverse.",
+    "Tutte le cose, pesale la prima settimana, **poi vai ad occhio**!",
+    "**L'olio** indicato include sia quello per condire i piatti sia quello usato per la cottura delle verdure, fai attenzione!",
+    "Ridurre al **minimo l'aggiunta di sale**.",
+    "Preferire **pane e pasta integrali**.",
+    "**Evita di trascorrere troppo tempo a digiuno**, ne risentirà il tuo pasto successivo poi!",
+    "Bere almeno **2 L di acqua** al giorno (molto importante!!!)"
+]
+
+# Keywords matched against name, category and type of a food, in order
+CARB_KEYWORDS = ['pane', 'pasta', 'riso', 'cereali', 'farro', 'orzo', 'avena',
+                 'quinoa', 'patate', 'patata', 'biscotti', 'crackers', 'fette',
+                 'gallette', 'muesli', 'cornflakes', 'fiocchi']
+PROTEIN_KEYWORDS = ['carne', 'pollo', 'manzo', 'maiale', 'pesce', 'salmone',
+                    'tonno', 'merluzzo', 'uova', 'uovo', 'formaggio', 'ricotta',
+                    'mozzarella', 'parmigiano', 'legumi', 'fagioli', 'lenticchie',
+                    'ceci', 'piselli', 'tofu', 'seitan', 'prosciutto', 'bresaola']
+FAT_KEYWORDS = ['olio', 'burro', 'noci', 'mandorle', 'nocciole', 'semi',
+                'avocado', 'olive', 'oliva']
+VEGETABLE_KEYWORDS = ['verdura', 'insalata', 'spinaci', 'broccoli', 'zucchine',
+                      'pomodori', 'carote', 'peperoni', 'melanzane', 'contorno']
+
+
+def set_cell_background(cell, color_hex):
+    """Set background color for table cell"""
+    table_cell_properties = cell._tc.get_or_add_tcPr()
+
+    # Remove any existing shading first
+    for shd in table_cell_properties.findall(qn('w:shd')):
+        table_cell_properties.remove(shd)
+
+    shade_obj = OxmlElement('w:shd')
+    shade_obj.set(qn('w:fill'), color_hex)
+    shade_obj.set(qn('w:val'), 'clear')
+    table_cell_properties.append(shade_obj)
+
+
+def _border(tag, val='single'):
+    border = OxmlElement(tag)
+    border.set(qn('w:val'), val)
+    if val != 'none':
+        border.set(qn('w:sz'), '4')
+        border.set(qn('w:color'), '000000')
+    return border
+
+
+def categorize_food_by_nutrition(alimento):
     """
-    Create a Word document containing the patient's diet plan.
-    
-    Args:
-        paziente_data: Dictionary containing patient data
-        dieta_data: Dictionary containing diet data
-    
-    Returns:
-        BytesIO object containing the Word document
+    Categorize food by nutritional type based on food name or category.
+    Returns one of: 'FONTI DI CARBOIDRATI', 'FONTI DI PROTEINE', 'FONTI DI GRASSI', 'CONTORNI'
     """
-    from docx.oxml import OxmlElement
-    from docx.oxml.ns import qn
-    from docx.shared import RGBColor, Inches
-    from docx.enum.section import WD_ORIENT
-    
-    def set_cell_background(cell, color_hex):
-        """Set background color for table cell"""
-        cell_xml_element = cell._tc
-        table_cell_properties = cell_xml_element.get_or_add_tcPr()
-        
-        # Remove any existing shading first
-        for shd in table_cell_properties.xpath('.//w:shd'):
-            table_cell_properties.remove(shd)
-            
-        # Add new shading
-        shade_obj = OxmlElement('w:shd')
-        shade_obj.set(qn('w:fill'), color_hex)
-        shade_obj.set(qn('w:val'), 'clear')
-        table_cell_properties.append(shade_obj)
-    
-    # Create a new document
-    doc = Document()
-    
-    # Set document to horizontal/landscape orientation
-    section = doc.sections[0]
-    section.orientation = WD_ORIENT.LANDSCAPE
-    # Swap width and height for landscape
-    new_width, new_height = section.page_height, section.page_width
-    section.page_width = new_width
-    section.page_height = new_height
-    
-    # Set narrow margins
-    from docx.shared import Inches
-    section.top_margin = Inches(0.5)
-    section.bottom_margin = Inches(0.5)
-    section.left_margin = Inches(0.5)
-    section.right_margin = Inches(0.5)
-    
-    # Set default font for the document to Century Gothic
-    style = doc.styles['Normal']
-    font = style.font
-    font.name = 'Century Gothic'
-    font.size = Pt(12)
-    
-    # Set document title with specific styling
-    title = doc.add_paragraph()  # Use paragraph instead of heading to remove delimiter
-    title_run = title.add_run(f'Piano nutrizionale {paziente_data.get("nome", "Paziente")}')
-    title_run.font.name = 'Muthiara -Demo Version-'
-    title_run.font.size = Pt(20)
-    title_run.font.color.rgb = RGBColor(0x77, 0x20, 0x6d)  # #77206d
-    title_run.bold = False  # Regular style
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title.paragraph_format.space_after = Pt(3)  # Reduced spacing after title
-    
-    # Add subtitle with same font and new color
-    subtitle = doc.add_paragraph()  # Use paragraph instead of heading to remove delimiter
-    subtitle_run = subtitle.add_run('Piano a scelta libera')
-    subtitle_run.font.name = 'Muthiara -Demo Version-'
-    subtitle_run.font.size = Pt(20)
-    subtitle_run.font.color.rgb = RGBColor(0xe5, 0x9e, 0xdc)  # #e59edc
-    subtitle_run.bold = False  # Regular style
-    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    subtitle.paragraph_format.space_before = Pt(3)  # Reduced spacing before subtitle
-    
-    # Add patient information if needed (without heading)
-    if any(paziente_data.get(key) for key in ['cognome', 'eta', 'email', 'telefono']):
-        patient_info = doc.add_paragraph()
-        
-        if paziente_data.get('cognome'):
-            patient_run = patient_info.add_run(f"Nome: {paziente_data['nome']} {paziente_data['cognome']}")
-            patient_run.bold = True
-            patient_run.font.name = 'Century Gothic'
-            patient_run.font.size = Pt(12)
-            patient_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-        
-        if paziente_data.get('eta'):
-            age_run = patient_info.add_run(f"\nEtà: {paziente_data['eta']} anni")
-            age_run.font.name = 'Century Gothic'
-            age_run.font.size = Pt(12)
-            age_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-    
-    # Define meal titles in UPPERCASE
-    meal_titles = {
-        'colazione': 'COLAZIONE',
-        'spuntino': 'SPUNTINO',
-        'pranzo': 'PRANZO',
-        'merenda': 'MERENDA',
-        'cena': 'CENA'
-    }
-    
-    def categorize_food_by_nutrition(alimento):
-        """
-        Categorize food by nutritional type based on food name or category.
-        Returns one of: 'FONTI DI CARBOIDRATI', 'FONTI DI PROTEINE', 'FONTI DI GRASSI', 'CONTORNI'
-        """
-        nome = alimento.get('nome', '').lower()
-        categoria = alimento.get('categoria', '').lower()
-        tipo = alimento.get('tipo', '').lower()
-        
-        # Carboidrate sources
-        carb_keywords = ['pane', 'pasta', 'riso', 'cereali', 'farro', 'orzo', 'avena', 
-                        'quinoa', 'patate', 'patata', 'biscotti', 'crackers', 'fette', 
-                        'gallette', 'muesli', 'cornflakes', 'fiocchi']
-        
-        # Protein sources
-        protein_keywords = ['carne', 'pollo', 'manzo', 'maiale', 'pesce', 'salmone', 
-                           'tonno', 'merluzzo', 'uova', 'uovo', 'formaggio', 'ricotta', 
-                           'mozzarella', 'parmigiano', 'legumi', 'fagioli', 'lenticchie', 
-                           'ceci', 'piselli', 'tofu', 'seitan', 'prosciutto', 'bresaola']
-        
-        # Fat sources
-        fat_keywords = ['olio', 'burro', 'noci', 'mandorle', 'nocciole', 'semi', 
-                       'avocado', 'olive', 'oliva']
-        
-        # Vegetables/sides
-        vegetable_keywords = ['verdura', 'insalata', 'spinaci', 'broccoli', 'zucchine', 
-                             'pomodori', 'carote', 'peperoni', 'melanzane', 'contorno']
-        
-        # Check against keywords
-        text_to_check = f"{nome} {categoria} {tipo}"
-        
-        if any(keyword in text_to_check for keyword in carb_keywords):
+    nome = alimento.get('nome', '').lower()
+    categoria = alimento.get('categoria', '').lower()
+    tipo = alimento.get('tipo', '').lower()
+
+    text_to_check = f"{nome} {categoria} {tipo}"
+
+    if any(keyword in text_to_check for keyword in CARB_KEYWORDS):
+        return 'FONTI DI CARBOIDRATI'
+    elif any(keyword in text_to_check for keyword in PROTEIN_KEYWORDS):
+        return 'FONTI DI PROTEINE'
+    elif any(keyword in text_to_check for keyword in FAT_KEYWORDS):
+        return 'FONTI DI GRASSI'
+    elif any(keyword in text_to_check for keyword in VEGETABLE_KEYWORDS):
+        return 'CONTORNI'
+    else:
+        # Default categorization based on original category if available
+        if 'carboidrat' in text_to_check or 'cereale' in text_to_check:
             return 'FONTI DI CARBOIDRATI'
-        elif any(keyword in text_to_check for keyword in protein_keywords):
+        elif 'protein' in text_to_check or 'carne' in text_to_check:
             return 'FONTI DI PROTEINE'
-        elif any(keyword in text_to_check for keyword in fat_keywords):
+        elif 'grass' in text_to_check or 'condimento' in text_to_check:
             return 'FONTI DI GRASSI'
-        elif any(keyword in text_to_check for keyword in vegetable_keywords):
+        elif 'verdur' in text_to_check or 'contorn' in text_to_check:
             return 'CONTORNI'
         else:
-            # Default categorization based on original category if available
-            if 'carboidrat' in text_to_check or 'cereale' in text_to_check:
-                return 'FONTI DI CARBOIDRATI'
-            elif 'protein' in text_to_check or 'carne' in text_to_check:
-                return 'FONTI DI PROTEINE'
-            elif 'grass' in text_to_check or 'condimento' in text_to_check:
-                return 'FONTI DI GRASSI'
-            elif 'verdur' in text_to_check or 'contorn' in text_to_check:
-                return 'CONTORNI'
-            else:
-                return 'FONTI DI CARBOIDRATI'  # Default fallback
-    
-    def should_use_table(meal_data):
-        """
-        Determine if meal should use table format based on:
-        1. Multiple categories (different food types) - based on main foods only
-        2. Any food item has more than 2 equivalents
-        """
-        if not meal_data or not meal_data.get('alimenti'):
-            return False
-        
-        # Check for multiple nutritional categories based on main foods only
-        categories = set()
-        for alimento in meal_data['alimenti']:
-            nutrition_category = categorize_food_by_nutrition(alimento)
-            categories.add(nutrition_category)
-        
-        # Use table if more than 1 nutritional category
-        if len(categories) > 1:
-            return True
-        
-        # Use table if any food item has more than 2 equivalents
-        for alimento in meal_data['alimenti']:
-            if alimento.get('equivalenti') and len(alimento['equivalenti']) > 2:
-                return True
-        
+            return 'FONTI DI CARBOIDRATI'  # Default fallback
+
+
+def too_many_combinations(meal_data, max_combinations):
+    """Whether the bullet layout of a meal would list more than max_combinations combinations"""
+    if max_combinations is None:
         return False
-    
-    def get_food_categories_with_equivalents(meal_data):
-        """
-        Extract and organize food by nutritional categories.
-        Only the main food (alimento principale) determines the category.
-        All equivalents stay in the same column as their main food.
-        """
-        if not meal_data or not meal_data.get('alimenti'):
-            return {}
-        
-        # Check if we need special handling for equivalents
-        has_many_equivalents = any(
-            alimento.get('equivalenti') and len(alimento['equivalenti']) > 2
-            for alimento in meal_data['alimenti']
-        )
-        
-        if has_many_equivalents:
-            # Create columns based on nutritional categories of main foods only
-            categories = {
-                'FONTI DI CARBOIDRATI': [],
-                'FONTI DI PROTEINE': [],
-                'FONTI DI GRASSI': [],
-                'CONTORNI': []
-            }
-            
-            for alimento in meal_data['alimenti']:
-                # Categorize based only on the main food
-                nutrition_category = categorize_food_by_nutrition(alimento)
-                
-                # Add main food to appropriate category
-                categories[nutrition_category].append(alimento)
-                
-                # Add ALL equivalents to the SAME category as the main food
-                if alimento.get('equivalenti'):
-                    for equiv in alimento['equivalenti']:
-                        categories[nutrition_category].append(equiv)
-            
-            # Remove empty categories
-            return {k: v for k, v in categories.items() if v}
-        else:
-            # Standard category grouping by nutrition type (main foods only)
-            categories = {}
-            for alimento in meal_data['alimenti']:
-                nutrition_category = categorize_food_by_nutrition(alimento)
-                if nutrition_category not in categories:
-                    categories[nutrition_category] = []
-                categories[nutrition_category].append(alimento)
-            
-            return categories
-    
-    def get_food_for_bullets(meal_data):
-        """
-        Get food organized specifically for bullet point combinations.
-        Each main food item becomes its own "category" for combination purposes.
-        """
-        if not meal_data or not meal_data.get('alimenti'):
-            return {}
-        
-        # Each main food item becomes its own category for combinations
-        categories = {}
-        for i, alimento in enumerate(meal_data['alimenti']):
-            # Use food name or index as category to ensure separate grouping
-            category_key = f"FOOD_{i+1}_{alimento['nome'][:20]}"  # Truncate long names
-            categories[category_key] = [alimento]
-        
-        return categories
-    
-    def format_food_with_quantity(alimento):
-        """Format food item with quantity - NOT uppercase"""
-        name = alimento['nome']  # Remove .upper()
-        if alimento.get('quantita') and alimento.get('unita'):
-            quantity = alimento['quantita']
-            unit = alimento['unita']
-            
-            if unit.lower() in ['g', 'grammi']:
-                if quantity == int(quantity):
-                    return f"{name} ({int(quantity)} g)"
-                else:
-                    return f"{name} ({quantity} g)"
-            else:
-                if quantity == int(quantity):
-                    return f"{name} ({int(quantity)} {unit})"
-                else:
-                    return f"{name} ({quantity} {unit})"
-        return name
-    
-    def create_bullet_combinations(categoria_foods):
-        """
-        Create bullet point combinations for simple meals.
-        Each main food + equivalents should be combined with other foods.
-        This creates ALL possible combinations between each food group.
-        """
-        if not categoria_foods:
-            return []
-        
-        # First, expand each category to include main foods + their equivalents
-        expanded_categories = {}
-        
-        for category_name, foods in categoria_foods.items():
-            expanded_foods = []
-            for alimento in foods:
-                # Add the main food
-                expanded_foods.append(alimento)
-                # Add all its equivalents
-                if alimento.get('equivalenti'):
-                    expanded_foods.extend(alimento['equivalenti'])
-            expanded_categories[category_name] = expanded_foods
-        
-        category_names = list(expanded_categories.keys())
-        combinations = []
-        
-        if len(category_names) == 1:
-            # Single category - list all items (main + equivalents) separately
-            for alimento in expanded_categories[category_names[0]]:
-                combinations.append([format_food_with_quantity(alimento)])
-        
-        elif len(category_names) == 2:
-            # Two categories - create ALL combinations between them
-            cat1_foods = expanded_categories[category_names[0]]
-            cat2_foods = expanded_categories[category_names[1]]
-            
-            for food1 in cat1_foods:
-                for food2 in cat2_foods:
-                    combination = [
-                        format_food_with_quantity(food1),
-                        format_food_with_quantity(food2)
-                    ]
-                    combinations.append(combination)
-        
-        else:
-            # More than 2 categories - create combinations with Cartesian product
-            import itertools
-            
-            # Get all expanded food lists
-            food_lists = [expanded_categories[cat] for cat in category_names]
-            
-            # Create all combinations using Cartesian product
-            for combination_tuple in itertools.product(*food_lists):
-                combination = [format_food_with_quantity(food) for food in combination_tuple]
-                combinations.append(combination)
-        
-        return combinations
-    
-    # Process each meal
-    for meal_key, meal_title in meal_titles.items():
+    return bullet_combination_count(get_food_for_bullets(meal_data)) > max_combinations
+
+
+def needs_table_layout(meal_data):
+    """
+    Whether a meal is a table whatever its number of combinations:
+    1. Multiple categories (different food types) - based on main foods only
+    2. Any food item has more than 2 equivalents
+    """
+    # Use table if more than 1 nutritional category
+    categories = {categorize_food_by_nutrition(alimento) for alimento in meal_data['alimenti']}
+    if len(categories) > 1:
+        return True
+
+    # Use table if any food item has more than 2 equivalents
+    return any(
+        alimento.get('equivalenti') and len(alimento['equivalenti']) > 2
+        for alimento in meal_data['alimenti']
+    )
+
+
+def should_use_table(meal_data, max_combinations=MAX_BULLET_COMBINATIONS):
+    """
+    Determine if meal should use table format: when needs_table_layout says
+    so, or when the bullet layout would list more than max_combinations
+    combinations
+    """
+    if not meal_data or not meal_data.get('alimenti'):
+        return False
+
+    return too_many_combinations(meal_data, max_combinations) or needs_table_layout(meal_data)
+
+
+def get_food_categories_with_equivalents(meal_data, max_combinations=MAX_BULLET_COMBINATIONS):
+    """
+    Extract and organize food by nutritional categories.
+    Only the main food (alimento principale) determines the category.
+    All equivalents stay in the same column as their main food.
+    """
+    if not meal_data or not meal_data.get('alimenti'):
+        return {}
+
+    has_many_equivalents = any(
+        alimento.get('equivalenti') and len(alimento['equivalenti']) > 2
+        for alimento in meal_data['alimenti']
+    )
+
+    # A meal that is a table only because of its many combinations keeps
+    # its equivalents, which the bullets would have listed; meals that are
+    # tables anyway are laid out as they always were
+    capped = not needs_table_layout(meal_data) and too_many_combinations(meal_data, max_combinations)
+    if has_many_equivalents or capped:
+        # Columns in a fixed order, each main food followed by ALL its equivalents
+        categories = {
+            'FONTI DI CARBOIDRATI': [],
+            'FONTI DI PROTEINE': [],
+            'FONTI DI GRASSI': [],
+            'CONTORNI': []
+        }
+        for alimento in meal_data['alimenti']:
+            foods = categories[categorize_food_by_nutrition(alimento)]
+            foods.append(alimento)
+            foods.extend(alimento.get('equivalenti') or [])
+
+        # Remove empty categories
+        return {k: v for k, v in categories.items() if v}
+
+    # Standard category grouping by nutrition type (main foods only)
+    categories = {}
+    for alimento in meal_data['alimenti']:
+        categories.setdefault(categorize_food_by_nutrition(alimento), []).append(alimento)
+    return categories
+
+
+def get_food_for_bullets(meal_data):
+    """
+    Get food organized specifically for bullet point combinations.
+    Each main food item becomes its own "category" for combination purposes.
+    """
+    if not meal_data or not meal_data.get('alimenti'):
+        return {}
+
+    # Use food name or index as category to ensure separate grouping
+    return {
+        f"FOOD_{i+1}_{alimento['nome'][:20]}": [alimento]  # Truncate long names
+        for i, alimento in enumerate(meal_data['alimenti'])
+    }
+
+
+def format_food_with_quantity(alimento):
+    """Format food item with quantity - NOT uppercase"""
+    name = alimento['nome']
+    if alimento.get('quantita') and alimento.get('unita'):
+        quantity = alimento['quantita']
+        unit = alimento['unita']
+        if quantity == int(quantity):
+            quantity = int(quantity)
+        if unit.lower() in ['g', 'grammi']:
+            unit = 'g'
+        return f"{name} ({quantity} {unit})"
+    return name
+
+
+def bullet_combination_count(categoria_foods):
+    """
+    Number of bullets create_bullet_combinations would produce, in O(n)
+
+    Every category contributes its main foods and their equivalents, and
+    bullets combine one item of each category.
+    """
+    if not categoria_foods:
+        return 0
+    return math.prod(
+        sum(1 + len(alimento.get('equivalenti') or []) for alimento in foods)
+        for foods in categoria_foods.values()
+    )
+
+
+def create_bullet_combinations(categoria_foods, max_combinations=None):
+    """
+    Create bullet point combinations for simple meals.
+    Each main food + equivalents should be combined with other foods.
+    This yields ALL possible combinations between each food group, lazily.
+
+    Raises:
+        ValueError: If there would be more than max_combinations combinations;
+            the count is checked before any combination is built
+    """
+    count = bullet_combination_count(categoria_foods)
+    if max_combinations is not None and count > max_combinations:
+        raise ValueError(f"Troppe combinazioni ({count}), il massimo è {max_combinations}")
+    if not count:
+        return iter(())
+
+    # Expand each category to its main foods followed by their equivalents
+    food_lists = []
+    for foods in categoria_foods.values():
+        expanded_foods = []
+        for alimento in foods:
+            expanded_foods.append(format_food_with_quantity(alimento))
+            expanded_foods.extend(format_food_with_quantity(equiv) for equiv in alimento.get('equivalenti') or [])
+        food_lists.append(expanded_foods)
+
+    # A single category lists every item separately; more categories
+    # combine every item of each with every item of the others
+    return map(list, itertools.product(*food_lists))
+
+
+# Run formatting: font, size in points, color, bold (None leaves it to the
+# paragraph style) and italic
+Format = namedtuple("Format", "font size color bold italic")
+
+TEXT = Format(BODY_FONT, 12, BLACK, None, False)
+TEXT_BOLD = Format(BODY_FONT, 12, BLACK, True, False)
+NOTE = Format(BODY_FONT, 12, BLACK, None, True)
+MEAL_TITLE = Format(BODY_FONT, 14, BLACK, True, False)
+TITLE = Format(TITLE_FONT, 20, TITLE_COLOR, False, False)
+SUBTITLE = Format(TITLE_FONT, 20, SUBTITLE_COLOR, False, False)
+ADVICE_TITLE = Format(TITLE_FONT, 18, SUBTITLE_COLOR, False, False)
+
+# A paragraph: runs as (text, Format) pairs, optional 'List Bullet' style,
+# centering and spacing in points
+Paragraph = namedtuple(
+    "Paragraph", "runs bullet center space_before space_after",
+    defaults=(False, False, None, None)
+)
+
+# A meal laid out as a table, one column per category of foods
+MealTable = namedtuple("MealTable", "categories")
+
+# The general advice section; tips is None for the default tips
+GeneralTips = namedtuple("GeneralTips", "tips")
+
+
+def marked_runs(text, run_format=TEXT):
+    """Runs of a text, with the parts between ** markers in bold"""
+    return [
+        # Odd indices are between ** markers
+        (part, run_format._replace(bold=True) if i % 2 == 1 else run_format)
+        for i, part in enumerate(text.split('**'))
+    ]
+
+
+def header_blocks(title):
+    """Title and subtitle paragraphs; paragraphs instead of headings to remove the delimiter"""
+    return [
+        Paragraph([(title, TITLE)], center=True, space_after=3),
+        Paragraph([('Piano a scelta libera', SUBTITLE)], center=True, space_before=3),
+    ]
+
+
+def tips_blocks(tips):
+    """General advice heading (without heading style) followed by one bullet per tip"""
+    blocks = [Paragraph([('Alcuni consigli generali', ADVICE_TITLE)])]
+    blocks.extend(Paragraph(marked_runs(tip), bullet=True, space_after=6) for tip in tips)
+    return blocks
+
+
+def table_header_block(category_name):
+    return Paragraph([(category_name, TEXT_BOLD)], center=True, space_after=6)
+
+
+def table_item_block(alimento):
+    # Extra spacing between rows
+    return Paragraph([("- ", TEXT), (format_food_with_quantity(alimento), TEXT)], space_before=6, space_after=12)
+
+
+def document_title(paziente_data):
+    return f'Piano nutrizionale {paziente_data.get("nome", "Paziente")}'
+
+
+def diet_blocks(paziente_data, dieta_data, max_combinations=MAX_BULLET_COMBINATIONS):
+    """
+    Layout of a diet document after the title and subtitle
+
+    Both engines render the same blocks, so their output is the same.
+    Meals are laid out as bullets of food combinations unless should_use_table
+    picks a table, which it also does when there would be more than
+    max_combinations bullets.
+
+    Yields:
+        Paragraph, MealTable and GeneralTips blocks in document order
+    """
+    # Add patient information if needed (without heading)
+    if any(paziente_data.get(key) for key in ['cognome', 'eta', 'email', 'telefono']):
+        runs = []
+        if paziente_data.get('cognome'):
+            runs.append((f"Nome: {paziente_data['nome']} {paziente_data['cognome']}", TEXT_BOLD))
+        if paziente_data.get('eta'):
+            runs.append((f"\nEtà: {paziente_data['eta']} anni", TEXT))
+        yield Paragraph(runs)
+
+    for meal_key, meal_title in MEAL_TITLES.items():
         meal_data = dieta_data.get(meal_key)
         if not meal_data or not meal_data.get('alimenti'):
             continue
-        
-        # Add meal title with "scegli:" or detailed instructions for PRANZO/CENA
-        meal_paragraph = doc.add_paragraph()
-        
+
+        # Meal title with "scegli:" or detailed instructions for PRANZO/CENA
         if meal_key in ['pranzo', 'cena']:
-            # Special formatting for PRANZO and CENA with detailed instructions
-            meal_run = meal_paragraph.add_run(f"{meal_title}, scegli ")
-            meal_run.font.name = 'Century Gothic'
-            meal_run.font.size = Pt(14)
-            meal_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            meal_run.bold = True
-            
-            # Add bold parts for nutritional categories
-            carb_run = meal_paragraph.add_run("1 fonte di carboidrati")
-            carb_run.font.name = 'Century Gothic'
-            carb_run.font.size = Pt(14)
-            carb_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            carb_run.bold = True
-            
-            comma1_run = meal_paragraph.add_run(", ")
-            comma1_run.font.name = 'Century Gothic'
-            comma1_run.font.size = Pt(14)
-            comma1_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            comma1_run.bold = True
-            
-            protein_run = meal_paragraph.add_run("1 fonte di proteine")
-            protein_run.font.name = 'Century Gothic'
-            protein_run.font.size = Pt(14)
-            protein_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            protein_run.bold = True
-            
-            comma2_run = meal_paragraph.add_run(", ")
-            comma2_run.font.name = 'Century Gothic'
-            comma2_run.font.size = Pt(14)
-            comma2_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            comma2_run.bold = True
-            
-            fat_run = meal_paragraph.add_run("1 fonte di grassi")
-            fat_run.font.name = 'Century Gothic'
-            fat_run.font.size = Pt(14)
-            fat_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            fat_run.bold = True
-            
-            and_run = meal_paragraph.add_run(" e ")
-            and_run.font.name = 'Century Gothic'
-            and_run.font.size = Pt(14)
-            and_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            and_run.bold = True
-            
-            contorno_run = meal_paragraph.add_run("1 contorno")
-            contorno_run.font.name = 'Century Gothic'
-            contorno_run.font.size = Pt(14)
-            contorno_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            contorno_run.bold = True
-            
-            final_run = meal_paragraph.add_run(" per comporre il tuo piatto:")
-            final_run.font.name = 'Century Gothic'
-            final_run.font.size = Pt(14)
-            final_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            final_run.bold = True
+            yield Paragraph([(f"{meal_title}, scegli ", MEAL_TITLE)] + [(part, MEAL_TITLE) for part in MAIN_MEAL_INSTRUCTIONS])
         else:
-            # Regular "scegli:" for other meals (not bold)
-            meal_run = meal_paragraph.add_run(f"{meal_title}, scegli:")
-            meal_run.font.name = 'Century Gothic'
-            meal_run.font.size = Pt(14)
-            meal_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            meal_run.bold = True
-        
-        categories = get_food_categories_with_equivalents(meal_data)
-        
-        if should_use_table(meal_data):
-            # Create table with nutritional categories as columns
-            category_names = list(categories.keys())
-            table = doc.add_table(rows=1, cols=len(category_names))
-            
-            # Remove table borders except for header row and vertical lines
-            from docx.oxml import OxmlElement
-            from docx.oxml.ns import qn
-            
-            tbl = table._tbl
-            tblPr = tbl.tblPr
-            
-            # Keep all borders including top
-            tblBorders = OxmlElement('w:tblBorders')
-            
-            # Keep all borders (top, left, right, bottom, vertical)
-            top = OxmlElement('w:top')
-            top.set(qn('w:val'), 'single')
-            top.set(qn('w:sz'), '4')
-            top.set(qn('w:color'), '000000')
-            tblBorders.append(top)
-            
-            left = OxmlElement('w:left')
-            left.set(qn('w:val'), 'single')
-            left.set(qn('w:sz'), '4')
-            left.set(qn('w:color'), '000000')
-            tblBorders.append(left)
-            
-            right = OxmlElement('w:right')
-            right.set(qn('w:val'), 'single')
-            right.set(qn('w:sz'), '4')
-            right.set(qn('w:color'), '000000')
-            tblBorders.append(right)
-            
-            bottom = OxmlElement('w:bottom')
-            bottom.set(qn('w:val'), 'single')
-            bottom.set(qn('w:sz'), '4')
-            bottom.set(qn('w:color'), '000000')
-            tblBorders.append(bottom)
-            
-            insideV = OxmlElement('w:insideV')
-            insideV.set(qn('w:val'), 'single')
-            insideV.set(qn('w:sz'), '4')
-            insideV.set(qn('w:color'), '000000')
-            tblBorders.append(insideV)
-            
-            # Remove only inside horizontal borders
-            insideH = OxmlElement('w:insideH')
-            insideH.set(qn('w:val'), 'none')
-            tblBorders.append(insideH)
-                
-            tblPr.append(tblBorders)
-            
-            # Set headers with bottom border only
-            header_cells = table.rows[0].cells
-            for i, category_name in enumerate(category_names):
-                header_cell = header_cells[i]
-                header_cell.text = category_name
-                
-                # Add bottom border to header cells only
-                tc = header_cell._tc
-                tcPr = tc.get_or_add_tcPr()
-                tcBorders = OxmlElement('w:tcBorders')
-                bottom = OxmlElement('w:bottom')
-                bottom.set(qn('w:val'), 'single')
-                bottom.set(qn('w:sz'), '4')
-                bottom.set(qn('w:color'), '000000')
-                tcBorders.append(bottom)
-                tcPr.append(tcBorders)
-                
-                # Set white background for all header cells
-                set_cell_background(header_cell, 'FFFFFF')
-                    
-                for paragraph in header_cell.paragraphs:
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    paragraph.paragraph_format.space_after = Pt(6)
-                    for run in paragraph.runs:
-                        run.bold = True
-                        run.font.name = 'Century Gothic'
-                        run.font.size = Pt(12)
-                        run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            
-            # Find max items in any category
-            max_items = max(len(foods) for foods in categories.values())
-            
-            # Add rows for food items with extra spacing
-            for row_idx in range(max_items):
-                row_cells = table.add_row().cells
-                
-                for col_idx, category_name in enumerate(category_names):
-                    foods_in_category = categories[category_name]
-                    
-                    if row_idx < len(foods_in_category):
-                        alimento = foods_in_category[row_idx]
-                        cell = row_cells[col_idx]
-                        
-                        # Clear cell and add formatted content
-                        cell.paragraphs[0].clear()
-                        paragraph = cell.paragraphs[0]
-                        
-                        # Add extra spacing between rows
-                        paragraph.paragraph_format.space_after = Pt(12)  # Increased spacing
-                        paragraph.paragraph_format.space_before = Pt(6)   # Space before
-                        
-                        # Add bullet and formatted food item
-                        bullet_run = paragraph.add_run("- ")
-                        bullet_run.font.name = 'Century Gothic'
-                        bullet_run.font.size = Pt(12)
-                        bullet_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-                        
-                        food_run = paragraph.add_run(format_food_with_quantity(alimento))
-                        food_run.font.name = 'Century Gothic'
-                        food_run.font.size = Pt(12)
-                        food_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
+            yield Paragraph([(f"{meal_title}, scegli:", MEAL_TITLE)])
+
+        if should_use_table(meal_data, max_combinations):
+            yield MealTable(get_food_categories_with_equivalents(meal_data, max_combinations))
         else:
             # Use bullet points with combinations
-            bullet_categories = get_food_for_bullets(meal_data)
-            combinations = create_bullet_combinations(bullet_categories)
-            
-            for combination in combinations:
-                paragraph = doc.add_paragraph(style='List Bullet')
-                paragraph.paragraph_format.space_after = Pt(6)
-                
-                # Join combination with " + "
-                combination_text = " + ".join(combination)
-                
-                run = paragraph.add_run(combination_text)
-                run.font.name = 'Century Gothic'
-                run.font.size = Pt(12)
-                run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-        
-        # Add meal notes if available
+            for combination in create_bullet_combinations(get_food_for_bullets(meal_data), max_combinations):
+                yield Paragraph([(" + ".join(combination), TEXT)], bullet=True, space_after=6)
+
         if meal_data.get('note'):
-            doc.add_paragraph()  # Add space
-            note_paragraph = doc.add_paragraph()
-            note_paragraph.paragraph_format.space_after = Pt(6)
-            
-            note_run = note_paragraph.add_run(f"Consigli: {meal_data['note']}")
-            note_run.italic = True
-            note_run.font.name = 'Century Gothic'
-            note_run.font.size = Pt(12)
-            note_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-        
+            yield Paragraph([])  # Add space
+            yield Paragraph([(f"Consigli: {meal_data['note']}", NOTE)], space_after=6)
+
         # Add spacing between meals
-        doc.add_paragraph()
-    
-    # Add general notes from diet data (without heading)
+        yield Paragraph([])
+
+    # General notes from diet data (without heading)
     if dieta_data.get('note'):
-        note_paragraph = doc.add_paragraph()
-        note_heading_run = note_paragraph.add_run('Note')
-        note_heading_run.font.name = 'Century Gothic'
-        note_heading_run.font.size = Pt(12)
-        note_heading_run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-        note_heading_run.bold = True
-        
-        # Split notes by line breaks and format properly
-        note_lines = dieta_data['note'].split('\n')
-        for line in note_lines:
+        yield Paragraph([('Note', TEXT_BOLD)])
+        for line in dieta_data['note'].split('\n'):
             if line.strip():
-                note_paragraph = doc.add_paragraph()
-                note_paragraph.paragraph_format.space_after = Pt(6)
-                
-                # Handle bold formatting within notes
-                if '**' in line:
-                    parts = line.split('**')
-                    for i, part in enumerate(parts):
-                        run = note_paragraph.add_run(part)
-                        run.font.name = 'Century Gothic'
-                        run.font.size = Pt(12)
-                        run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-                        if i % 2 == 1:  # Odd indices are between ** markers
-                            run.bold = True
-                else:
-                    run = note_paragraph.add_run(line)
-                    run.font.name = 'Century Gothic'
-                    run.font.size = Pt(12)
-                    run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-    
-    # Add general advice section (without heading style)
-    advice_paragraph = doc.add_paragraph()
-    advice_heading_run = advice_paragraph.add_run('Alcuni consigli generali')
-    advice_heading_run.font.name = 'Muthiara -Demo Version-'
-    advice_heading_run.font.size = Pt(18)  # Size 18 as requested
-    advice_heading_run.font.color.rgb = RGBColor(0xe5, 0x9e, 0xdc)  # #e59edc (same as subtitle)
-    advice_heading_run.bold = False
-    
-    # Get general tips from diet data or use defaults
-    general_tips = dieta_data.get('consigli_generali', [
-        "Non è necessario rispettare quantità precise per la **verdura**. Anzi aumentane le quantità durante i pasti se hai ancora fame.",
-        "Il **caffè** non è inserito nel piano, ma puoi berne quanto ne vuoi durante la giornata.",
-        "Per la **frutta** scegli quella che preferisci (considera 150 g come riferimento) di base corrisponde ad 1 frutto grande (pesca) o 2 piccole (ad esempio le albicocche).",
-        "**Spuntini e merende** possono essere **scambiati** tra mattina e pomeriggio, così come **pranzi e cene** sia all'interno della stessa, che tra giornate diverse.",
-        "Tutte le cose, pesale la prima settimana, **poi vai ad occhio**!",
-        "**L'olio** indicato include sia quello per condire i piatti sia quello usato per la cottura delle verdure, fai attenzione!",
-        "Ridurre al **minimo l'aggiunta di sale**.",
-        "Preferire **pane e pasta integrali**.",
-        "**Evita di trascorrere troppo tempo a digiuno**, ne risentirà il tuo pasto successivo poi!",
-        "Bere almeno **2 L di acqua** al giorno (molto importante!!!)"
-    ])
-    
-    for tip in general_tips:
-        paragraph = doc.add_paragraph(style='List Bullet')
-        paragraph.paragraph_format.space_after = Pt(6)
-        
-        # Handle bold formatting with ** markers
-        parts = tip.split('**')
-        for i, part in enumerate(parts):
-            run = paragraph.add_run(part)
-            run.font.name = 'Century Gothic'
-            run.font.size = Pt(12)
-            run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-            if i % 2 == 1:  # Odd indices are between ** markers
-                run.bold = True
-    
-    # Add extra notes if available
+                yield Paragraph(marked_runs(line), space_after=6)
+
+    yield GeneralTips(dieta_data.get('consigli_generali'))
+
     if dieta_data.get('note_extra'):
-        doc.add_paragraph()
-        extra_paragraph = doc.add_paragraph(dieta_data['note_extra'])
-        extra_paragraph.paragraph_format.space_after = Pt(6)
-        for run in extra_paragraph.runs:
-            run.font.name = 'Century Gothic'
-            run.font.size = Pt(12)
-            run.font.color.rgb = RGBColor(0, 0, 0)  # Black
-    
-    # Save document to BytesIO
+        yield Paragraph([])
+        yield Paragraph([(dieta_data['note_extra'], TEXT)], space_after=6)
+
+
+class DocumentTemplate:
+    """
+    Parts of the diet document that are the same for every export.
+
+    The base document, with the landscape section, the default style, the
+    title and subtitle and the default tips section, is built once; each
+    export starts from a deep copy of it and only adds the variable parts.
+    Run formatting is kept as prebuilt w:rPr elements that are copied into
+    each run, and the bullet style is resolved once instead of looking it
+    up by name for every paragraph.
+    """
+
+    def __init__(self):
+        self._formats = {}
+
+        doc = Document()
+
+        # Set document to horizontal/landscape orientation
+        section = doc.sections[0]
+        section.orientation = WD_ORIENT.LANDSCAPE
+        # Swap width and height for landscape
+        section.page_width, section.page_height = section.page_height, section.page_width
+
+        # Set narrow margins
+        section.top_margin = Inches(0.5)
+        section.bottom_margin = Inches(0.5)
+        section.left_margin = Inches(0.5)
+        section.right_margin = Inches(0.5)
+
+        # Set default font for the document to Century Gothic
+        font = doc.styles['Normal'].font
+        font.name = BODY_FONT
+        font.size = Pt(12)
+
+        self.bullet_style_id = doc.part.get_style_id('List Bullet', WD_STYLE_TYPE.PARAGRAPH)
+        # Width between the margins, split evenly between table columns
+        self.block_width = section.page_width - section.left_margin - section.right_margin
+
+        # The title is filled with the patient name on each export
+        for block in header_blocks('') + tips_blocks(DEFAULT_GENERAL_TIPS):
+            self.add_paragraph(doc, block)
+
+        self._document = doc
+
+        # Table borders: all outer borders and vertical lines, no inside
+        # horizontal lines; header cells get a bottom border of their own
+        self._table_borders = OxmlElement('w:tblBorders')
+        for tag in ('w:top', 'w:left', 'w:right', 'w:bottom', 'w:insideV'):
+            self._table_borders.append(_border(tag))
+        self._table_borders.append(_border('w:insideH', 'none'))
+
+        self._header_borders = OxmlElement('w:tcBorders')
+        self._header_borders.append(_border('w:bottom'))
+
+    def _format(self, run_format):
+        """Prebuilt w:rPr of a Format"""
+        rpr = self._formats.get(run_format)
+        if rpr is None:
+            run = Run(OxmlElement('w:r'), None)
+            if run_format.bold is not None:
+                run.bold = run_format.bold
+            if run_format.italic:
+                run.italic = True
+            run.font.name = run_format.font
+            run.font.size = Pt(run_format.size)
+            run.font.color.rgb = run_format.color
+            rpr = self._formats[run_format] = run._r.rPr
+        return rpr
+
+    def add_run(self, paragraph, text, run_format):
+        """Add a formatted run to a paragraph"""
+        run = paragraph.add_run(text)
+        run._r.insert(0, copy.deepcopy(self._format(run_format)))
+        return run
+
+    def fill_paragraph(self, paragraph, block):
+        """Apply the style, spacing and runs of a Paragraph block to a paragraph"""
+        if block.bullet:
+            paragraph._p.style = self.bullet_style_id
+        if block.center:
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        if block.space_after is not None:
+            paragraph.paragraph_format.space_after = Pt(block.space_after)
+        if block.space_before is not None:
+            paragraph.paragraph_format.space_before = Pt(block.space_before)
+        for text, run_format in block.runs:
+            self.add_run(paragraph, text, run_format)
+        return paragraph
+
+    def add_paragraph(self, doc, block):
+        return self.fill_paragraph(doc.add_paragraph(), block)
+
+    def add_table(self, doc, categories):
+        """Add a table with nutritional categories as columns"""
+        category_names = list(categories.keys())
+        table = doc.add_table(rows=1, cols=len(category_names))
+        table._tbl.tblPr.append(copy.deepcopy(self._table_borders))
+
+        # Set headers with bottom border only and a white background
+        for header_cell, category_name in zip(table.rows[0].cells, category_names):
+            self.fill_paragraph(header_cell.paragraphs[0], table_header_block(category_name))
+            header_cell._tc.get_or_add_tcPr().append(copy.deepcopy(self._header_borders))
+            set_cell_background(header_cell, 'FFFFFF')
+
+        # One row per item of the longest category
+        max_items = max(len(foods) for foods in categories.values())
+        for row_idx in range(max_items):
+            row_cells = table.add_row().cells
+            for cell, category_name in zip(row_cells, category_names):
+                foods_in_category = categories[category_name]
+                if row_idx < len(foods_in_category):
+                    self.fill_paragraph(cell.paragraphs[0], table_item_block(foods_in_category[row_idx]))
+
+    def new_document(self, title):
+        """
+        Copy the base document for an export
+
+        Returns:
+            Tuple of (document with its title set and an empty body, elements
+            of the default tips section to add back at the end)
+        """
+        # Copy the package through the document part: copying the Document
+        # object itself would leave its cached body pointing at the original
+        doc = copy.deepcopy(self._document.part).document
+        body = doc.element.body
+        paragraphs = body.findall(qn('w:p'))
+        Run(paragraphs[0].find(qn('w:r')), None).text = title
+
+        # Everything after the subtitle is the tips section
+        tips = paragraphs[2:]
+        for element in tips:
+            body.remove(element)
+        return doc, tips
+
+    def package(self):
+        """Bytes of the base document saved as a .docx file"""
+        stream = BytesIO()
+        self._document.save(stream)
+        return stream.getvalue()
+
+
+def _xml_text(text):
+    if _INVALID_XML_CHARS.search(text):
+        # Same error as lxml, so both engines reject the same input
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    return escape(text)
+
+
+def _xml_attribute(value):
+    return escape(value, {'"': '&quot;'})
+
+
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff\ud800-\udfff]')
+
+# A run of text is split into w:t elements at tabs and line breaks
+_RUN_BREAKS = re.compile(r'(\t|\r|\n)')
+
+_TABLE_PROPERTIES = (
+    '<w:tblPr><w:tblW w:type="auto" w:w="0"/>'
+    '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+    '<w:tblBorders>'
+    '<w:top w:val="single" w:sz="4" w:color="000000"/>'
+    '<w:left w:val="single" w:sz="4" w:color="000000"/>'
+    '<w:right w:val="single" w:sz="4" w:color="000000"/>'
+    '<w:bottom w:val="single" w:sz="4" w:color="000000"/>'
+    '<w:insideV w:val="single" w:sz="4" w:color="000000"/>'
+    '<w:insideH w:val="none"/>'
+    '</w:tblBorders></w:tblPr>'
+)
+
+_HEADER_CELL_PROPERTIES = (
+    '<w:tcBorders><w:bottom w:val="single" w:sz="4" w:color="000000"/></w:tcBorders>'
+    '<w:shd w:fill="FFFFFF" w:val="clear"/>'
+)
+
+
+class XmlDocumentWriter:
+    """
+    Writes diet documents without building a python-docx object tree.
+
+    Every part of the package except word/document.xml is taken from the
+    saved base template and compressed once into a static archive; each
+    document copies that archive and appends document.xml, streamed from
+    string fragments block by block. The fragments are written exactly as
+    python-docx serializes the same content, so the two engines produce
+    the same document.xml, and memory stays proportional to the largest
+    block rather than to the whole document.
+    """
+
+    DOCUMENT_PART = 'word/document.xml'
+
+    def __init__(self, template: DocumentTemplate):
+        self.bullet_style_id = template.bullet_style_id
+        self.block_width = template.block_width
+        self._formats = {}
+
+        static = BytesIO()
+        with zipfile.ZipFile(BytesIO(template.package())) as source, \
+                zipfile.ZipFile(static, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for info in source.infolist():
+                if info.filename == self.DOCUMENT_PART:
+                    document_xml = source.read(info).decode('utf-8')
+                else:
+                    archive.writestr(info.filename, source.read(info))
+        self._static = static.getvalue()
+
+        body_start = document_xml.index('<w:body>') + len('<w:body>')
+        self._prefix = document_xml[:body_start].encode('utf-8')
+        self._suffix = document_xml[document_xml.index('<w:sectPr'):].encode('utf-8')
+        self._default_tips = self.blocks_xml(tips_blocks(DEFAULT_GENERAL_TIPS)).encode('utf-8')
+
+    def _rpr(self, run_format):
+        """w:rPr fragment of a Format"""
+        rpr = self._formats.get(run_format)
+        if rpr is None:
+            font = _xml_attribute(run_format.font)
+            bold = '' if run_format.bold is None else ('<w:b/>' if run_format.bold else '<w:b w:val="0"/>')
+            italic = '<w:i/>' if run_format.italic else ''
+            rpr = self._formats[run_format] = (
+                f'<w:rPr><w:rFonts w:ascii="{font}" w:hAnsi="{font}"/>{bold}{italic}'
+                f'<w:color w:val="{run_format.color}"/><w:sz w:val="{run_format.size * 2}"/></w:rPr>'
+            )
+        return rpr
+
+    def run_xml(self, text, run_format):
+        if not _RUN_BREAKS.search(text):
+            # Plain text, by far the most common case
+            if not text:
+                return f'<w:r>{self._rpr(run_format)}</w:r>'
+            space = ' xml:space="preserve"' if len(text.strip()) < len(text) else ''
+            return f'<w:r>{self._rpr(run_format)}<w:t{space}>{_xml_text(text)}</w:t></w:r>'
+
+        parts = ['<w:r>', self._rpr(run_format)]
+        for piece in _RUN_BREAKS.split(text):
+            if piece == '\t':
+                parts.append('<w:tab/>')
+            elif piece in ('\r', '\n'):
+                parts.append('<w:br/>')
+            elif piece:
+                space = ' xml:space="preserve"' if len(piece.strip()) < len(piece) else ''
+                parts.append(f'<w:t{space}>{_xml_text(piece)}</w:t>')
+        parts.append('</w:r>')
+        return ''.join(parts)
+
+    def paragraph_xml(self, block):
+        properties = ''
+        if block.bullet:
+            properties += f'<w:pStyle w:val="{self.bullet_style_id}"/>'
+        spacing = ''
+        if block.space_after is not None:
+            spacing += f' w:after="{Pt(block.space_after).twips}"'
+        if block.space_before is not None:
+            spacing += f' w:before="{Pt(block.space_before).twips}"'
+        if spacing:
+            properties += f'<w:spacing{spacing}/>'
+        if block.center:
+            properties += '<w:jc w:val="center"/>'
+
+        runs = ''.join(self.run_xml(text, run_format) for text, run_format in block.runs)
+        if not properties and not runs:
+            return '<w:p/>'
+        if properties:
+            properties = f'<w:pPr>{properties}</w:pPr>'
+        return f'<w:p>{properties}{runs}</w:p>'
+
+    def table_xml(self, categories):
+        category_names = list(categories.keys())
+        width = Emu(self.block_width // len(category_names)).twips
+        cell_width = f'<w:tcW w:type="dxa" w:w="{width}"/>'
+
+        parts = [
+            '<w:tbl>', _TABLE_PROPERTIES, '<w:tblGrid>',
+            f'<w:gridCol w:w="{width}"/>' * len(category_names),
+            '</w:tblGrid><w:tr>'
+        ]
+        for category_name in category_names:
+            parts.append(
+                f'<w:tc><w:tcPr>{cell_width}{_HEADER_CELL_PROPERTIES}</w:tcPr>'
+                f'{self.paragraph_xml(table_header_block(category_name))}</w:tc>'
+            )
+        parts.append('</w:tr>')
+
+        max_items = max(len(foods) for foods in categories.values())
+        for row_idx in range(max_items):
+            parts.append('<w:tr>')
+            for category_name in category_names:
+                foods_in_category = categories[category_name]
+                if row_idx < len(foods_in_category):
+                    paragraph = self.paragraph_xml(table_item_block(foods_in_category[row_idx]))
+                else:
+                    paragraph = '<w:p/>'
+                parts.append(f'<w:tc><w:tcPr>{cell_width}</w:tcPr>{paragraph}</w:tc>')
+            parts.append('</w:tr>')
+        parts.append('</w:tbl>')
+        return ''.join(parts)
+
+    def blocks_xml(self, blocks):
+        return ''.join(self.paragraph_xml(block) for block in blocks)
+
+    def write(self, paziente_data, dieta_data, stream, max_combinations=MAX_BULLET_COMBINATIONS):
+        """Write the .docx package of a diet document to an empty binary stream"""
+        stream.write(self._static)
+        with zipfile.ZipFile(stream, 'a', zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(self.DOCUMENT_PART, 'w') as part:
+                part.write(self._prefix)
+                part.write(self.blocks_xml(header_blocks(document_title(paziente_data))).encode('utf-8'))
+                for block in diet_blocks(paziente_data, dieta_data, max_combinations):
+                    if isinstance(block, MealTable):
+                        xml = self.table_xml(block.categories)
+                    elif isinstance(block, GeneralTips):
+                        if block.tips is None:
+                            part.write(self._default_tips)
+                            continue
+                        xml = self.blocks_xml(tips_blocks(block.tips))
+                    else:
+                        xml = self.paragraph_xml(block)
+                    part.write(xml.encode('utf-8'))
+                part.write(self._suffix)
+
+
+_template = None
+_xml_writer = None
+_template_lock = threading.Lock()
+
+
+def get_document_template():
+    """Build the base document on first use, once per process"""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = DocumentTemplate()
+    return _template
+
+
+def get_xml_writer():
+    """Build the XML engine from the base document on first use, once per process"""
+    global _xml_writer
+    if _xml_writer is None:
+        template = get_document_template()
+        with _template_lock:
+            if _xml_writer is None:
+                _xml_writer = XmlDocumentWriter(template)
+    return _xml_writer
+
+
+def _create_docx_document(paziente_data, dieta_data, max_combinations):
+    template = get_document_template()
+    doc, default_tips = template.new_document(document_title(paziente_data))
+    body = doc.element.body
+
+    for block in diet_blocks(paziente_data, dieta_data, max_combinations):
+        if isinstance(block, MealTable):
+            template.add_table(doc, block.categories)
+        elif isinstance(block, GeneralTips):
+            # The tips section of the template, or its heading followed by
+            # the tips of the diet
+            for element in (default_tips if block.tips is None else default_tips[:1]):
+                body.sectPr.addprevious(element)
+            if block.tips is not None:
+                for tip in tips_blocks(block.tips)[1:]:
+                    template.add_paragraph(doc, tip)
+        else:
+            template.add_paragraph(doc, block)
+
     doc_stream = BytesIO()
     doc.save(doc_stream)
+    return doc_stream
+
+
+def create_diet_document(paziente_data, dieta_data, engine="docx", max_combinations=MAX_BULLET_COMBINATIONS):
+    """
+    Create a Word document containing the patient's diet plan.
+
+    Args:
+        paziente_data: Dictionary containing patient data
+        dieta_data: Dictionary containing diet data
+        engine: 'docx' to build the document with python-docx, 'xml' to
+            write document.xml directly; both give the same document
+        max_combinations: Most food combinations listed as bullets for a
+            meal; meals with more are laid out as a table (None for no limit)
+
+    Returns:
+        BytesIO object containing the Word document
+    """
+    if engine == "docx":
+        doc_stream = _create_docx_document(paziente_data, dieta_data, max_combinations)
+    elif engine == "xml":
+        doc_stream = BytesIO()
+        get_xml_writer().write(paziente_data, dieta_data, doc_stream, max_combinations)
+    else:
+        raise ValueError(f"Motore di esportazione non valido: {engine}. Usare uno tra: {', '.join(DOCUMENT_ENGINES)}")
+
     doc_stream.seek(0)
-    
-    return doc_stream
\ No newline at end of file
+    return doc_stream
@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+# updated_at is rendered with microseconds so that every write yields a new tag
+VERSION_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def row_etag(updated_at: datetime):
+    """Strong ETag of a database row, derived from its updated_at column"""
+    return f'"{updated_at.strftime(VERSION_FORMAT)}"'
+
+
+def http_date(updated_at: datetime):
+    """Format a naive UTC timestamp as an HTTP date for Last-Modified"""
+    return format_datetime(updated_at.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def _split_tags(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def etag_matches(header: str, etag: str):
+    """
+    Check an If-None-Match header against the current ETag
+
+    Uses the weak comparison required for If-None-Match, so W/ prefixes
+    added by proxies or compression do not prevent a 304.
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == current for tag in _split_tags(header))
+
+
+def versions_from_if_match(header: str):
+    """
+    Parse an If-Match header into the row versions it accepts
+
+    Returns:
+        None for "*" (any existing version), otherwise the list of
+        updated_at values named by the header; tags that were not issued
+        by row_etag are ignored and can never match
+    """
+    if header.strip() == "*":
+        return None
+
+    versions = []
+    for tag in _split_tags(header):
+        # If-Match uses strong comparison: weak tags never match
+        if tag.startswith("W/") or len(tag) < 2 or tag[0] != '"' or tag[-1] != '"':
+            continue
+        try:
+            versions.append(datetime.strptime(tag[1:-1], VERSION_FORMAT))
+        except ValueError:
+            continue
+    return versions
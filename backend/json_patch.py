@@ -0,0 +1,249 @@
+import copy
+
+OPERATIONS = ("add", "remove", "replace", "move", "copy", "test")
+
+
+class JsonPatchError(ValueError):
+    """Raised when a JSON Patch is malformed or cannot be applied"""
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """Raised when a 'test' operation does not match the document"""
+
+
+def parse_pointer(pointer: str):
+    """
+    Split a JSON Pointer (RFC 6901) into its reference tokens
+
+    Args:
+        pointer: Pointer such as "/pranzo/alimenti/0"
+
+    Returns:
+        List of unescaped tokens
+    """
+    if pointer == "":
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise JsonPatchError(f"Percorso non valido: {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _array_index(container: list, token: str, allow_end: bool):
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise JsonPatchError(f"Indice di array non valido: {token!r}")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise JsonPatchError(f"Indice di array fuori intervallo: {index}")
+    return index
+
+
+def _resolve_parent(document, tokens):
+    """Walk to the container holding the last token of a pointer"""
+    if not tokens:
+        raise JsonPatchError("L'operazione non può riguardare l'intero documento")
+
+    node = document
+    for token in tokens[:-1]:
+        if isinstance(node, dict):
+            if token not in node:
+                raise JsonPatchError(f"Percorso inesistente: {token!r}")
+            node = node[token]
+        elif isinstance(node, list):
+            node = node[_array_index(node, token, allow_end=False)]
+        else:
+            raise JsonPatchError(f"Percorso inesistente: {token!r}")
+    return node, tokens[-1]
+
+
+def _get(document, tokens):
+    node = document
+    for token in tokens:
+        if isinstance(node, dict):
+            if token not in node:
+                raise JsonPatchError(f"Percorso inesistente: {token!r}")
+            node = node[token]
+        elif isinstance(node, list):
+            node = node[_array_index(node, token, allow_end=False)]
+        else:
+            raise JsonPatchError(f"Percorso inesistente: {token!r}")
+    return node
+
+
+def _add(document, tokens, value):
+    parent, token = _resolve_parent(document, tokens)
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, token, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Percorso inesistente: {token!r}")
+
+
+def _remove(document, tokens):
+    parent, token = _resolve_parent(document, tokens)
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Percorso inesistente: {token!r}")
+        return parent.pop(token)
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, token, allow_end=False))
+    raise JsonPatchError(f"Percorso inesistente: {token!r}")
+
+
+def _replace(document, tokens, value):
+    parent, token = _resolve_parent(document, tokens)
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Percorso inesistente: {token!r}")
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent[_array_index(parent, token, allow_end=False)] = value
+    else:
+        raise JsonPatchError(f"Percorso inesistente: {token!r}")
+
+
+def apply_patch(document: dict, operations: list):
+    """
+    Apply a JSON Patch (RFC 6902) to a document
+
+    The document is not modified; the patch is applied to a copy and either
+    every operation succeeds or a JsonPatchError is raised.
+
+    Args:
+        document: JSON document to patch
+        operations: List of operations, each a dict with op, path and
+            value or from as required by the operation
+
+    Returns:
+        Tuple of (patched document, set of top-level keys touched by the patch)
+    """
+    if not isinstance(operations, list):
+        raise JsonPatchError("La patch deve essere una lista di operazioni")
+
+    patched = copy.deepcopy(document)
+    touched = set()
+
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise JsonPatchError("Ogni operazione deve essere un oggetto")
+
+        op = operation.get("op")
+        if op not in OPERATIONS:
+            raise JsonPatchError(f"Operazione non supportata: {op!r}")
+        if "path" not in operation:
+            raise JsonPatchError(f"Operazione '{op}' senza 'path'")
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise JsonPatchError(f"Operazione '{op}' senza 'value'")
+        if op in ("move", "copy") and "from" not in operation:
+            raise JsonPatchError(f"Operazione '{op}' senza 'from'")
+
+        tokens = parse_pointer(operation["path"])
+
+        if op == "add":
+            _add(patched, tokens, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            _remove(patched, tokens)
+        elif op == "replace":
+            _replace(patched, tokens, copy.deepcopy(operation["value"]))
+        elif op == "test":
+            if _get(patched, tokens) != operation["value"]:
+                raise JsonPatchTestFailed(f"Test non superato su {operation['path']}")
+        else:
+            from_tokens = parse_pointer(operation["from"])
+            if op == "move":
+                if tokens[:len(from_tokens)] == from_tokens and tokens != from_tokens:
+                    raise JsonPatchError("Impossibile spostare un valore dentro se stesso")
+                value = _remove(patched, from_tokens)
+            else:
+                value = copy.deepcopy(_get(patched, from_tokens))
+            _add(patched, tokens, value)
+            if from_tokens and op == "move":
+                touched.add(from_tokens[0])
+
+        if op != "test" and tokens:
+            touched.add(tokens[0])
+
+    return patched, touched
+
+
+def _escape(token):
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _same(a, b):
+    # Numbers compare by value, as in jsonb, but unlike == True is not 1
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return isinstance(a, bool) == isinstance(b, bool) and a == b
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(value, b[key]) for key, value in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _diff(source, target, path, operations):
+    if _same(source, target):
+        return
+
+    if isinstance(source, dict) and isinstance(target, dict):
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in target.items():
+            if key in source:
+                _diff(source[key], value, f"{path}/{_escape(key)}", operations)
+            else:
+                operations.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": copy.deepcopy(value)})
+        return
+
+    if isinstance(source, list) and isinstance(target, list):
+        # Only the part between the common prefix and suffix has changed
+        start = 0
+        while start < min(len(source), len(target)) and _same(source[start], target[start]):
+            start += 1
+        end = 0
+        while (end < min(len(source), len(target)) - start
+               and _same(source[len(source) - 1 - end], target[len(target) - 1 - end])):
+            end += 1
+
+        old = source[start:len(source) - end]
+        new = target[start:len(target) - end]
+        common = min(len(old), len(new))
+        for i in range(common):
+            _diff(old[i], new[i], f"{path}/{start + i}", operations)
+        for i in reversed(range(common, len(old))):
+            operations.append({"op": "remove", "path": f"{path}/{start + i}"})
+        for i in range(common, len(new)):
+            operations.append({"op": "add", "path": f"{path}/{start + i}", "value": copy.deepcopy(new[i])})
+        return
+
+    operations.append({"op": "replace", "path": path, "value": copy.deepcopy(target)})
+
+
+def make_patch(source: dict, target: dict):
+    """
+    Compute a JSON Patch (RFC 6902) that turns one document into another
+
+    Unchanged values produce no operations, and items inserted into or
+    removed from an array only produce operations for those items, so the
+    patch between two versions of a diet stays small.
+
+    Args:
+        source: Original document
+        target: Document to reach
+
+    Returns:
+        List of operations such that apply_patch(source, operations)
+        returns target
+    """
+    if not isinstance(source, dict) or not isinstance(target, dict):
+        raise JsonPatchError("Entrambi i documenti devono essere oggetti")
+
+    operations = []
+    _diff(source, target, "", operations)
+    return operations
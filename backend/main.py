@@ -1,7 +1,9 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from typing import Optional, Literal, List
 from contextlib import asynccontextmanager
 from datetime import datetime
 import uvicorn
@@ -10,26 +12,72 @@ from models import (
     Alimento, AlimentoResponse, AlimentoCreate, AlimentoCreateResponse,
     Paziente, PazienteResponse, PazienteCreate, PazienteCreateResponse,
     PazienteUpdate, PazienteUpdateResponse, PazienteDeleteResponse,
-    DietaUpdate, DietaResponse, ErrorResponse, PazientiWithDieteResponse
+    DietaUpdate, DietaResponse, ErrorResponse, PazientiWithDieteResponse,
+    DietaPatchOperation, DietaPatchResponse, AlimentiBulkResponse,
+    AlimentoCompleto, AlimentiBatchResponse, DietaNutrientiResponse,
+    AlimentiSostitutiResponse, DietaOptimizeRequest, DietaOptimizeResponse,
+    ObiettiviNutrienti, DieteRecomputeResponse, DietaVersioniResponse,
+    DietaVersioneResponse, DietaDiffResponse, PazientiSummaryResponse
 )
-from database import (
+from async_database import (
     get_alimenti_data, get_alimento_by_id, get_total_count, create_alimento,
     get_pazienti_data, get_paziente_by_id, get_pazienti_total_count,
     create_paziente, update_paziente, delete_paziente, create_pazienti_table,
-    get_dieta_by_paziente_id, update_dieta_by_paziente_id, add_alimento_to_pasto,
-    fetch_all_pazienti_with_diete
+    update_dieta_by_paziente_id, add_alimento_to_pasto,
+    patch_dieta_by_paziente_id,
+    fetch_all_pazienti_with_diete, open_db_pool, close_db_pool, get_pool_stats,
+    create_indexes, load_alimenti_catalog, get_catalog_stats, load_alimenti_columns,
+    bulk_upsert_alimenti, resolve_alimenti_columns, iter_alimenti_export,
+    get_alimenti_by_ids, get_nutrient_matrix, get_alimento_substitutes,
+    recompute_diete, create_diete_versioni_table, get_dieta_versioni,
+    get_dieta_versione, diff_dieta_versioni, copy_dieta_from_paziente
+)
+from database import (
+    encode_cursor, alimenti_cursor_keys, PAZIENTI_CURSOR_KEYS, PAZIENTI_DIETE_CURSOR_KEYS,
+    PreconditionFailedError, ALIMENTI_MACRO_COLUMNS
+)
+from document_renderer import DocumentRenderer, RendererBusyError
+from document_cache import DocumentCache, document_cache_key
+from config import (
+    DOCUMENT_RENDER_WORKERS, DOCUMENT_RENDER_QUEUE_SIZE, DOCUMENT_RENDER_EXECUTOR,
+    DOCUMENT_ENGINE, DOCUMENT_MAX_BULLET_COMBINATIONS, DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_DIR, DOCUMENT_CACHE_DISK_MAX_BYTES
 )
-from document_utils import create_diet_document
+from json_patch import JsonPatchError, JsonPatchTestFailed
+from diet_optimizer import optimize_diet
+from alimenti_import import AlimentiImport, detect_format
+from alimenti_export import encode_export, MEDIA_TYPES
+from etags import row_etag, http_date, etag_matches, versions_from_if_match
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database tables on startup"""
+    """Initialize the connection pool, database tables and alimenti caches on startup"""
     try:
-        create_pazienti_table()
+        await open_db_pool()
+        await create_pazienti_table()
+        await create_diete_versioni_table()
+        await create_indexes()
         print("Database tables initialized successfully!")
+        await load_alimenti_catalog()
+        await load_alimenti_columns()
     except Exception as e:
         print(f"Error initializing database tables: {e}")
     yield
+    await run_in_threadpool(document_renderer.shutdown)
+    await close_db_pool()
+
+# Word documents are built in worker processes (or threads), off the event loop
+document_renderer = DocumentRenderer(
+    workers=DOCUMENT_RENDER_WORKERS,
+    queue_size=DOCUMENT_RENDER_QUEUE_SIZE,
+    engine=DOCUMENT_ENGINE,
+    max_combinations=DOCUMENT_MAX_BULLET_COMBINATIONS,
+    executor=DOCUMENT_RENDER_EXECUTOR
+)
+document_cache = DocumentCache(
+    max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+    directory=DOCUMENT_CACHE_DIR,
+    disk_max_bytes=DOCUMENT_CACHE_DISK_MAX_BYTES
+)
 
 # Create FastAPI app
 app = FastAPI(
@@ -50,10 +98,53 @@ app.add_middleware(
         # Add your production frontend URL here
     ],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
 
+def format_list_message(retrieved: int, total: Optional[int], label: str):
+    """Build the message of a list response, which may come without a total"""
+    if total is None:
+        return f"Recuperati {retrieved} {label}"
+    return f"Recuperati {retrieved} {label} su {total} totali"
+
+def paziente_cache_headers(updated_at: datetime):
+    """Validator headers of a patient row, shared by the patient and its diet"""
+    return {
+        "ETag": row_etag(updated_at),
+        "Last-Modified": http_date(updated_at),
+        "Cache-Control": "private, no-cache",
+    }
+
+def require_if_match(if_match: Optional[str]):
+    """Parse the If-Match header that writes to a patient must carry"""
+    if not if_match:
+        raise HTTPException(
+            status_code=428,
+            detail="Header If-Match obbligatorio: usare l'ETag restituito dalla lettura del paziente o della dieta"
+        )
+    return versions_from_if_match(if_match)
+
+def parse_list_param(value: Optional[str]):
+    """Split a comma-separated query parameter, dropping empty items"""
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+# Maximum number of IDs of a single GET /alimenti/batch request
+MAX_BATCH_IDS = 1000
+
+def target_ranges(obiettivi: Optional[ObiettiviNutrienti]):
+    """Convert nutrient targets into nutrient -> (min, max) pairs"""
+    if obiettivi is None:
+        return {}
+    return {
+        nutriente: (intervallo.min, intervallo.max)
+        for nutriente, intervallo in obiettivi
+        if intervallo is not None
+    }
+
+PRECONDITION_FAILED_DETAIL = "Il paziente è stato modificato da un'altra richiesta: ricaricare i dati e riprovare"
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -63,10 +154,15 @@ async def root():
             "alimenti": {
                 "GET": "/alimenti",
                 "POST": "/alimenti",
-                "GET_by_id": "/alimenti/{id}"
+                "POST_bulk": "/alimenti/bulk",
+                "GET_export": "/alimenti/export",
+                "GET_batch": "/alimenti/batch?ids=1,2,3",
+                "GET_by_id": "/alimenti/{id}",
+                "GET_substitutes": "/alimenti/{id}/substitutes"
             },
             "pazienti": {
                 "GET": "/pazienti",
+                "GET_summary": "/pazienti/summary",
                 "POST": "/pazienti",
                 "GET_by_id": "/pazienti/{id}",
                 "PUT": "/pazienti/{id}",
@@ -75,9 +171,19 @@ async def root():
             "diete": {
                 "GET": "/pazienti/{id}/dieta",
                 "PUT": "/pazienti/{id}/dieta",
+                "PATCH": "/pazienti/{id}/dieta",
                 "POST": "/pazienti/{id}/dieta/{pasto}/alimenti",
-                "GET_all": "/pazienti/diete"
+                "POST_import": "/pazienti/{id}/dieta/import-from/{source_id}",
+                "GET_nutrients": "/pazienti/{id}/dieta/nutrients",
+                "POST_optimize": "/pazienti/{id}/dieta/optimize",
+                "GET_versions": "/pazienti/{id}/dieta/versioni",
+                "GET_version": "/pazienti/{id}/dieta/versioni/{versione}",
+                "GET_diff": "/pazienti/{id}/dieta/diff?from=1&to=2",
+                "GET_all": "/pazienti/diete",
+                "POST_recompute": "/pazienti/diete/recompute"
             },
+            "health": "/health",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -87,19 +193,27 @@ async def root():
 async def get_alimenti(
     limit: int = Query(default=100, ge=1, le=1000, description="Numero massimo di risultati"),
     offset: int = Query(default=0, ge=0, description="Numero di risultati da saltare"),
-    search: Optional[str] = Query(default=None, description="Termine di ricerca per il nome dell'alimento")
+    search: Optional[str] = Query(default=None, description="Termine di ricerca per il nome dell'alimento"),
+    cursor: Optional[str] = Query(default=None, description="Cursore della pagina successiva (next_cursor della risposta precedente)"),
+    count: Literal["exact", "estimated", "none"] = Query(default="exact", description="Calcolo del totale: esatto, stimato o nessuno")
 ):
     """
     Recupera la lista degli alimenti con informazioni nutrizionali.
     
     - **limit**: Numero massimo di risultati (1-1000)
     - **offset**: Numero di risultati da saltare per la paginazione
-    - **search**: Termine opzionale per cercare alimenti per nome
+    - **search**: Termine opzionale per cercare alimenti per nome. La ricerca ignora maiuscole e accenti
+      e tollera errori di battitura; i risultati sono ordinati per rilevanza (corrispondenza esatta,
+      poi per prefisso, poi per contenuto, poi per somiglianza)
+    - **cursor**: Cursore opzionale per la paginazione keyset; se presente, offset viene ignorato
+    - **count**: `exact` (default) conta tutti i risultati, `estimated` usa le statistiche del database
+      per le liste senza ricerca, `none` non calcola il totale (`total` è `null`)
     """
     try:
-        # Get data from database
-        data = get_alimenti_data(limit=limit, offset=offset, search=search)
-        total = get_total_count(search=search)
+        # Get the page and its total from the database in a single query
+        data, total = await get_alimenti_data(
+            limit=limit, offset=offset, search=search, page_cursor=cursor, count=count
+        )
         
         # Convert to Pydantic models
         alimenti = [Alimento(**item) for item in data]
@@ -108,9 +222,15 @@ async def get_alimenti(
             success=True,
             data=alimenti,
             total=total,
-            message=f"Recuperati {len(alimenti)} alimenti su {total} totali"
+            next_cursor=encode_cursor(data[-1], alimenti_cursor_keys(search)) if len(data) == limit else None,
+            message=format_list_message(len(alimenti), total, "alimenti")
         )
         
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=str(ve)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -139,14 +259,11 @@ async def create_new_alimento(alimento: AlimentoCreate):
     - etc...
     """
     try:
-        print(f"Received data: {alimento.model_dump()}")
-        
         # Convert Pydantic model to dict, excluding None values
         alimento_dict = alimento.model_dump(exclude_none=True)
-        print(f"Processed data (exclude_none=True): {alimento_dict}")
         
         # Create the alimento in database
-        created_alimento = create_alimento(alimento_dict)
+        created_alimento = await create_alimento(alimento_dict)
         
         if not created_alimento:
             raise HTTPException(
@@ -176,6 +293,158 @@ async def create_new_alimento(alimento: AlimentoCreate):
             detail=f"Errore nella creazione dell'alimento: {type(e).__name__} - {str(e)}"
         )
 
+@app.post("/alimenti/bulk", response_model=AlimentiBulkResponse)
+async def bulk_import_alimenti(
+    request: Request,
+    format: Optional[Literal["csv", "ndjson"]] = Query(default=None, description="Formato del file (altrimenti dedotto dal Content-Type)")
+):
+    """
+    Importa o aggiorna molti alimenti in una sola richiesta.
+    
+    Il corpo della richiesta è un file CSV (`Content-Type: text/csv`, con intestazione)
+    o NDJSON (`Content-Type: application/x-ndjson`, un oggetto JSON per riga) con
+    le colonne di `AlimentoCreate`. Le colonne `alimento` e `sorgente` sono obbligatorie.
+    
+    Un alimento con lo stesso nome (ignorando maiuscole e accenti) e la stessa sorgente
+    di uno esistente lo aggiorna, altrimenti viene inserito. I valori vuoti non
+    sovrascrivono quelli esistenti. Le righe non valide vengono scartate e riportate.
+    """
+    try:
+        fmt = format or detect_format(request.headers.get("content-type"))
+        if not fmt:
+            raise HTTPException(
+                status_code=415,
+                detail="Formato non riconosciuto: usare Content-Type text/csv o application/x-ndjson, oppure il parametro format"
+            )
+        
+        body = await request.body()
+        upload = AlimentiImport(body, fmt)
+        counts = await bulk_upsert_alimenti(upload.columns, upload.rows())
+        
+        return AlimentiBulkResponse(
+            success=True,
+            inserted=counts["inserted"],
+            updated=counts["updated"],
+            duplicates=counts["duplicates"],
+            rejected=upload.rejected,
+            errors=upload.errors,
+            ignored_columns=upload.ignored_columns,
+            message=(
+                f"Importazione completata: {counts['inserted']} inseriti, "
+                f"{counts['updated']} aggiornati, {upload.rejected} scartati"
+            )
+        )
+        
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Errore di validazione: {str(ve)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nell'importazione degli alimenti: {type(e).__name__} - {str(e)}"
+        )
+
+@app.get("/alimenti/export")
+async def export_alimenti(
+    format: Literal["csv", "ndjson"] = Query(default="csv", description="Formato del file esportato"),
+    fields: Optional[str] = Query(default=None, description="Colonne da esportare, separate da virgola (default: tutte)")
+):
+    """
+    Esporta l'intero catalogo degli alimenti con tutti i valori nutrizionali.
+    
+    - **format**: `csv` (con intestazione) o `ndjson` (un oggetto JSON per riga)
+    - **fields**: Elenco opzionale di colonne, ad esempio `alimento,energia_kcal`; `id` è sempre incluso
+    
+    Le righe sono ordinate per ID e inviate man mano che vengono lette dal database,
+    quindi la memoria usata non dipende dalla dimensione del catalogo. Le colonne
+    hanno i nomi del database, così il file può essere reimportato con `POST /alimenti/bulk`.
+    """
+    try:
+        columns = await resolve_alimenti_columns(parse_list_param(fields))
+        batches = iter_alimenti_export(columns)
+        
+        return StreamingResponse(
+            encode_export(columns, batches, format),
+            media_type=MEDIA_TYPES[format],
+            headers={
+                "Content-Disposition": f"attachment; filename=alimenti.{format}",
+                "Cache-Control": "no-cache"
+            },
+            # Also runs when the client disconnects mid-stream: closing the
+            # generator closes the cursor and returns the connection to the pool
+            background=BackgroundTask(batches.close)
+        )
+        
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Errore di validazione: {str(ve)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nell'esportazione degli alimenti: {str(e)}"
+        )
+
+@app.get("/alimenti/batch", response_model=AlimentiBatchResponse, response_model_exclude_unset=True)
+async def get_alimenti_batch(
+    ids: str = Query(..., description="ID degli alimenti separati da virgola (massimo 1000)"),
+    fields: str = Query(default="full", description="full, macro o elenco di colonne separate da virgola")
+):
+    """
+    Recupera più alimenti tramite ID con una sola richiesta.
+    
+    - **ids**: ID separati da virgola, ad esempio `1,2,3`; gli alimenti sono restituiti nello stesso ordine
+    - **fields**: `full` (default) restituisce tutti i valori nutrizionali, `macro` solo
+      nome, sorgente, energia e macronutrienti, altrimenti l'elenco delle colonne desiderate;
+      `id` è sempre incluso e i campi non richiesti sono omessi dalla risposta
+    
+    Gli ID inesistenti sono riportati in `missing`.
+    """
+    try:
+        try:
+            alimento_ids = list(dict.fromkeys(int(value) for value in parse_list_param(ids)))
+        except ValueError:
+            raise ValueError("Il parametro ids deve contenere numeri interi separati da virgola")
+        if not alimento_ids:
+            raise ValueError("Specificare almeno un ID")
+        if len(alimento_ids) > MAX_BATCH_IDS:
+            raise ValueError(f"Al massimo {MAX_BATCH_IDS} ID per richiesta")
+        
+        if fields == "full":
+            requested = None
+        elif fields == "macro":
+            requested = ALIMENTI_MACRO_COLUMNS
+        else:
+            requested = parse_list_param(fields)
+        columns = await resolve_alimenti_columns(requested)
+        
+        data = await get_alimenti_by_ids(alimento_ids, columns)
+        found = {row["id"] for row in data}
+        missing = [alimento_id for alimento_id in alimento_ids if alimento_id not in found]
+        
+        return AlimentiBatchResponse(
+            success=True,
+            data=[AlimentoCompleto(**row) for row in data],
+            missing=missing,
+            message=f"Recuperati {len(data)} alimenti su {len(alimento_ids)} richiesti"
+        )
+        
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Errore di validazione: {str(ve)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel recupero degli alimenti: {str(e)}"
+        )
+
 @app.get("/alimenti/{alimento_id}", response_model=Alimento)
 async def get_alimento(alimento_id: int):
     """
@@ -184,7 +453,7 @@ async def get_alimento(alimento_id: int):
     - **alimento_id**: ID dell'alimento da recuperare
     """
     try:
-        alimento_data = get_alimento_by_id(alimento_id)
+        alimento_data = await get_alimento_by_id(alimento_id)
         
         if not alimento_data:
             raise HTTPException(
@@ -202,21 +471,70 @@ async def get_alimento(alimento_id: int):
             detail=f"Errore nel recupero dell'alimento: {str(e)}"
         )
 
+@app.get("/alimenti/{alimento_id}/substitutes", response_model=AlimentiSostitutiResponse)
+async def get_alimento_sostituti(
+    alimento_id: int,
+    k: int = Query(default=10, ge=1, le=50, description="Numero di sostituti"),
+    basis: Literal["macro", "full"] = Query(default="macro", description="Nutrienti confrontati"),
+    kcal: Optional[float] = Query(default=None, gt=0, description="Calorie da fornire (default: 100 g dell'alimento)")
+):
+    """
+    Trova gli alimenti con il profilo nutrizionale più simile, da usare come equivalenti.
+    
+    - **alimento_id**: ID dell'alimento di riferimento
+    - **k**: Numero di sostituti (1-50)
+    - **basis**: `macro` confronta proteine, lipidi, carboidrati e fibre, `full` tutti i nutrienti
+    - **kcal**: Calorie che ogni sostituto deve fornire; `quantita` è la quantità in grammi
+      che le fornisce (di default le calorie di 100 g dell'alimento di riferimento)
+    
+    I profili sono confrontati per 100 kcal, quindi conta la composizione e non la densità
+    energetica; i sostituti sono ordinati per `distanza` crescente.
+    """
+    try:
+        data = await get_alimento_substitutes(alimento_id, k=k, basis=basis, kcal=kcal)
+        
+        if data is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Alimento con ID {alimento_id} non trovato"
+            )
+        
+        return AlimentiSostitutiResponse(
+            success=True,
+            data=data,
+            message=f"Trovati {len(data)} sostituti per l'alimento con ID {alimento_id}"
+        )
+        
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Errore di validazione: {str(ve)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nella ricerca dei sostituti: {str(e)}"
+        )
+
 # Pazienti endpoints
 @app.get("/pazienti/diete", response_model=PazientiWithDieteResponse)
 async def get_all_pazienti_with_diete(
     limit: int = Query(default=100, ge=1, le=1000, description="Numero massimo di risultati"),
-    offset: int = Query(default=0, ge=0, description="Numero di risultati da saltare")
+    offset: int = Query(default=0, ge=0, description="Numero di risultati da saltare"),
+    cursor: Optional[str] = Query(default=None, description="Cursore della pagina successiva (next_cursor della risposta precedente)")
 ):
     """
     Recupera tutti i pazienti con le loro diete.
     
     - **limit**: Numero massimo di risultati (1-1000)
     - **offset**: Numero di risultati da saltare per la paginazione
+    - **cursor**: Cursore opzionale per la paginazione keyset; se presente, offset viene ignorato
     """
     try:
         # Get all patients with their diets
-        pazienti_with_diete = fetch_all_pazienti_with_diete(limit=limit, offset=offset)
+        pazienti_with_diete = await fetch_all_pazienti_with_diete(limit=limit, offset=offset, page_cursor=cursor)
         
         # Convert to Pydantic models
         pazienti = [Paziente(**item) for item in pazienti_with_diete]
@@ -224,20 +542,62 @@ async def get_all_pazienti_with_diete(
         return PazientiWithDieteResponse(
             success=True,
             data=pazienti,
+            next_cursor=(
+                encode_cursor(pazienti_with_diete[-1], PAZIENTI_DIETE_CURSOR_KEYS)
+                if len(pazienti_with_diete) == limit else None
+            ),
             message=f"Recuperati {len(pazienti)} pazienti con le loro diete"
         )
         
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=str(ve)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Errore nel recupero dei pazienti con diete: {str(e)}"
         )
 
+@app.post("/pazienti/diete/recompute", response_model=DieteRecomputeResponse)
+async def recompute_all_diete(
+    dry_run: bool = Query(default=False, description="Conta solo le diete da aggiornare, senza salvarle")
+):
+    """
+    Ricalcola i valori degli alimenti e i totali di tutte le diete dal catalogo attuale.
+    
+    Da usare dopo aver corretto i valori nutrizionali di uno o più alimenti: ogni
+    alimento delle diete viene ricalcolato dai valori per 100 g e dalla quantità, poi
+    vengono ricalcolati i totali dei pasti e giornalieri. Sono salvate solo le diete
+    che cambiano; quelle modificate durante il ricalcolo sono contate come `conflicts`
+    e non vengono sovrascritte. Lo stesso ricalcolo è disponibile da riga di comando
+    con `python recompute_diete.py`.
+    """
+    try:
+        report = await recompute_diete(dry_run=dry_run)
+        
+        action = "da aggiornare" if dry_run else "aggiornate"
+        count = report["changed"] if dry_run else report["updated"]
+        return DieteRecomputeResponse(
+            success=True,
+            **report,
+            message=f"Diete esaminate: {report['scanned']}, {action}: {count}"
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel ricalcolo delle diete: {str(e)}"
+        )
+
 @app.get("/pazienti", response_model=PazienteResponse)
 async def get_pazienti(
     limit: int = Query(default=100, ge=1, le=1000, description="Numero massimo di risultati"),
     offset: int = Query(default=0, ge=0, description="Numero di risultati da saltare"),
-    search: Optional[str] = Query(default=None, description="Termine di ricerca per nome, cognome o email")
+    search: Optional[str] = Query(default=None, description="Termine di ricerca per nome, cognome o email"),
+    cursor: Optional[str] = Query(default=None, description="Cursore della pagina successiva (next_cursor della risposta precedente)"),
+    count: Literal["exact", "estimated", "none"] = Query(default="exact", description="Calcolo del totale: esatto, stimato o nessuno")
 ):
     """
     Recupera la lista dei pazienti.
@@ -245,11 +605,15 @@ async def get_pazienti(
     - **limit**: Numero massimo di risultati (1-1000)
     - **offset**: Numero di risultati da saltare per la paginazione
     - **search**: Termine opzionale per cercare pazienti per nome, cognome o email
+    - **cursor**: Cursore opzionale per la paginazione keyset; se presente, offset viene ignorato
+    - **count**: `exact` (default) conta tutti i risultati, `estimated` usa le statistiche del database
+      per le liste senza ricerca, `none` non calcola il totale (`total` è `null`)
     """
     try:
-        # Get data from database
-        data = get_pazienti_data(limit=limit, offset=offset, search=search)
-        total = get_pazienti_total_count(search=search)
+        # Get the page and its total from the database in a single query
+        data, total = await get_pazienti_data(
+            limit=limit, offset=offset, search=search, page_cursor=cursor, count=count
+        )
         
         # Convert to Pydantic models
         pazienti = [Paziente(**item) for item in data]
@@ -258,9 +622,55 @@ async def get_pazienti(
             success=True,
             data=pazienti,
             total=total,
-            message=f"Recuperati {len(pazienti)} pazienti su {total} totali"
+            next_cursor=encode_cursor(data[-1], PAZIENTI_CURSOR_KEYS) if len(data) == limit else None,
+            message=format_list_message(len(pazienti), total, "pazienti")
         )
         
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=str(ve)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel recupero dei pazienti: {str(e)}"
+        )
+
+@app.get("/pazienti/summary", response_model=PazientiSummaryResponse)
+async def get_pazienti_summary(
+    limit: int = Query(default=100, ge=1, le=1000, description="Numero massimo di risultati"),
+    offset: int = Query(default=0, ge=0, description="Numero di risultati da saltare"),
+    search: Optional[str] = Query(default=None, description="Termine di ricerca per nome, cognome o email"),
+    cursor: Optional[str] = Query(default=None, description="Cursore della pagina successiva (next_cursor della risposta precedente)"),
+    count: Literal["exact", "estimated", "none"] = Query(default="exact", description="Calcolo del totale: esatto, stimato o nessuno")
+):
+    """
+    Recupera la lista dei pazienti in forma ridotta, senza la dieta.
+    
+    Accetta gli stessi parametri di `GET /pazienti`. Per ogni paziente restituisce
+    i dati anagrafici, i totali giornalieri della dieta (`totale_giornaliero`) e
+    `has_diet`, vero se almeno un pasto contiene alimenti. I totali sono estratti
+    dal database, che non invia il resto della dieta.
+    """
+    try:
+        data, total = await get_pazienti_data(
+            limit=limit, offset=offset, search=search, page_cursor=cursor, count=count, summary=True
+        )
+        
+        return PazientiSummaryResponse(
+            success=True,
+            data=data,
+            total=total,
+            next_cursor=encode_cursor(data[-1], PAZIENTI_CURSOR_KEYS) if len(data) == limit else None,
+            message=format_list_message(len(data), total, "pazienti")
+        )
+        
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=str(ve)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -287,7 +697,7 @@ async def create_new_paziente(paziente: PazienteCreate):
         paziente_dict = paziente.model_dump()
         
         # Create the paziente in database
-        created_paziente = create_paziente(paziente_dict)
+        created_paziente = await create_paziente(paziente_dict)
         
         if not created_paziente:
             raise HTTPException(
@@ -310,14 +720,21 @@ async def create_new_paziente(paziente: PazienteCreate):
         )
 
 @app.get("/pazienti/{paziente_id}", response_model=Paziente)
-async def get_paziente(paziente_id: int):
+async def get_paziente(
+    paziente_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None)
+):
     """
     Recupera un paziente specifico tramite ID.
     
     - **paziente_id**: ID del paziente da recuperare
+    
+    La risposta contiene `ETag` e `Last-Modified`; con `If-None-Match` uguale
+    all'ETag corrente viene restituito `304 Not Modified` senza corpo.
     """
     try:
-        paziente_data = get_paziente_by_id(paziente_id)
+        paziente_data = await get_paziente_by_id(paziente_id)
         
         if not paziente_data:
             raise HTTPException(
@@ -325,6 +742,11 @@ async def get_paziente(paziente_id: int):
                 detail=f"Paziente con ID {paziente_id} non trovato"
             )
         
+        headers = paziente_cache_headers(paziente_data['updated_at'])
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        
+        response.headers.update(headers)
         return Paziente(**paziente_data)
         
     except HTTPException:
@@ -336,15 +758,24 @@ async def get_paziente(paziente_id: int):
         )
 
 @app.put("/pazienti/{paziente_id}", response_model=PazienteUpdateResponse)
-async def update_existing_paziente(paziente_id: int, paziente: PazienteUpdate):
+async def update_existing_paziente(
+    paziente_id: int,
+    paziente: PazienteUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None)
+):
     """
     Aggiorna un paziente esistente nel database.
     
     - **paziente_id**: ID del paziente da aggiornare
+    - **If-Match** (header obbligatorio): ETag ottenuto leggendo il paziente o la dieta
     
     Tutti i campi sono opzionali. Solo i campi forniti verranno aggiornati.
+    Se il paziente è stato modificato dopo la lettura viene restituito `412`.
     """
     try:
+        expected_versions = require_if_match(if_match)
+        
         # Convert Pydantic model to dict, excluding None values
         paziente_dict = paziente.model_dump(exclude_none=True)
         
@@ -355,7 +786,7 @@ async def update_existing_paziente(paziente_id: int, paziente: PazienteUpdate):
             )
         
         # Update the paziente in database
-        updated_paziente = update_paziente(paziente_id, paziente_dict)
+        updated_paziente = await update_paziente(paziente_id, paziente_dict, expected_versions)
         
         if not updated_paziente:
             raise HTTPException(
@@ -363,6 +794,7 @@ async def update_existing_paziente(paziente_id: int, paziente: PazienteUpdate):
                 detail=f"Paziente con ID {paziente_id} non trovato"
             )
         
+        response.headers.update(paziente_cache_headers(updated_paziente['updated_at']))
         return PazienteUpdateResponse(
             success=True,
             data=Paziente(**updated_paziente),
@@ -371,6 +803,8 @@ async def update_existing_paziente(paziente_id: int, paziente: PazienteUpdate):
         
     except HTTPException:
         raise
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail=PRECONDITION_FAILED_DETAIL)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -386,7 +820,7 @@ async def delete_existing_paziente(paziente_id: int):
     """
     try:
         # First check if paziente exists
-        paziente_data = get_paziente_by_id(paziente_id)
+        paziente_data = await get_paziente_by_id(paziente_id)
         
         if not paziente_data:
             raise HTTPException(
@@ -395,7 +829,7 @@ async def delete_existing_paziente(paziente_id: int):
             )
         
         # Delete the paziente
-        deleted = delete_paziente(paziente_id)
+        deleted = await delete_paziente(paziente_id)
         
         if not deleted:
             raise HTTPException(
@@ -418,15 +852,22 @@ async def delete_existing_paziente(paziente_id: int):
 
 # Diet endpoints
 @app.get("/pazienti/{paziente_id}/dieta", response_model=DietaResponse)
-async def get_paziente_dieta(paziente_id: int):
+async def get_paziente_dieta(
+    paziente_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None)
+):
     """
     Recupera la dieta di un paziente specifico.
     
     - **paziente_id**: ID del paziente
+    
+    La risposta contiene `ETag` e `Last-Modified`; con `If-None-Match` uguale
+    all'ETag corrente viene restituito `304 Not Modified` senza corpo.
     """
     try:
-        # First check if paziente exists
-        paziente_data = get_paziente_by_id(paziente_id)
+        # The patient row carries the diet and its version
+        paziente_data = await get_paziente_by_id(paziente_id)
         
         if not paziente_data:
             raise HTTPException(
@@ -434,8 +875,7 @@ async def get_paziente_dieta(paziente_id: int):
                 detail=f"Paziente con ID {paziente_id} non trovato"
             )
         
-        # Get diet data
-        dieta_data = get_dieta_by_paziente_id(paziente_id)
+        dieta_data = paziente_data['dieta']
         
         if not dieta_data:
             raise HTTPException(
@@ -443,6 +883,11 @@ async def get_paziente_dieta(paziente_id: int):
                 detail=f"Dieta non trovata per il paziente con ID {paziente_id}"
             )
         
+        headers = paziente_cache_headers(paziente_data['updated_at'])
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        
+        response.headers.update(headers)
         return DietaResponse(
             success=True,
             data=dieta_data,
@@ -457,17 +902,256 @@ async def get_paziente_dieta(paziente_id: int):
             detail=f"Errore nel recupero della dieta: {str(e)}"
         )
 
+@app.get("/pazienti/{paziente_id}/dieta/nutrients", response_model=DietaNutrientiResponse)
+async def get_paziente_dieta_nutrients(paziente_id: int):
+    """
+    Calcola tutti i valori nutrizionali della dieta di un paziente.
+    
+    - **paziente_id**: ID del paziente
+    
+    Per ogni pasto e per l'intera giornata restituisce il totale di ogni colonna
+    nutrizionale della tabella alimenti (vitamine, minerali, acidi grassi, ...),
+    calcolato dai valori per 100 g scalati per la quantità di ogni alimento.
+    Come per i totali dei pasti, un alimento principale con equivalenti conta
+    come la media del gruppo. `incompleti` elenca i nutrienti che mancano per
+    almeno un alimento della dieta, `non_trovati` gli alimenti non più presenti nel catalogo.
+    """
+    try:
+        paziente_data = await get_paziente_by_id(paziente_id)
+        
+        if not paziente_data:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Paziente con ID {paziente_id} non trovato"
+            )
+        
+        dieta_data = paziente_data['dieta']
+        
+        if not dieta_data:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Dieta non trovata per il paziente con ID {paziente_id}"
+            )
+        
+        matrix = await get_nutrient_matrix()
+        
+        return DietaNutrientiResponse(
+            success=True,
+            **matrix.diet_totals(dieta_data),
+            message=f"Valori nutrizionali calcolati per {paziente_data['nome']} {paziente_data['cognome']}"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel calcolo dei valori nutrizionali: {str(e)}"
+        )
+
+@app.get("/pazienti/{paziente_id}/dieta/versioni", response_model=DietaVersioniResponse)
+async def get_paziente_dieta_versioni(
+    paziente_id: int,
+    limit: int = Query(100, ge=1, le=1000, description="Numero massimo di versioni da restituire"),
+    offset: int = Query(0, ge=0, description="Numero di versioni da saltare")
+):
+    """
+    Elenca le versioni salvate della dieta di un paziente, dalla più recente.
+    
+    - **paziente_id**: ID del paziente
+    - **limit**: Numero massimo di versioni da restituire (default: 100, max: 1000)
+    - **offset**: Numero di versioni da saltare (default: 0)
+    
+    Ogni modifica della dieta crea una nuova versione. Le versioni sono salvate
+    come differenze (JSON Patch) dalla precedente, con una copia completa
+    (`snapshot`) ogni `DIETE_SNAPSHOT_INTERVAL` versioni.
+    """
+    try:
+        versioni = await get_dieta_versioni(paziente_id, limit, offset)
+        
+        if versioni is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Paziente con ID {paziente_id} non trovato"
+            )
+        
+        return DietaVersioniResponse(
+            success=True,
+            data=versioni["data"],
+            total=versioni["total"],
+            message=f"Recuperate {len(versioni['data'])} versioni su {versioni['total']} totali"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel recupero delle versioni della dieta: {str(e)}"
+        )
+
+@app.get("/pazienti/{paziente_id}/dieta/versioni/{versione}", response_model=DietaVersioneResponse)
+async def get_paziente_dieta_versione(paziente_id: int, versione: int):
+    """
+    Recupera una versione passata della dieta di un paziente.
+    
+    - **paziente_id**: ID del paziente
+    - **versione**: Numero della versione
+    """
+    try:
+        result = await get_dieta_versione(paziente_id, versione)
+        
+        if result is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Versione {versione} della dieta non trovata per il paziente con ID {paziente_id}"
+            )
+        
+        return DietaVersioneResponse(
+            success=True,
+            versione=result["versione"],
+            created_at=result["created_at"],
+            data=result["dieta"],
+            message=f"Versione {versione} della dieta recuperata con successo"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel recupero della versione della dieta: {str(e)}"
+        )
+
+@app.get("/pazienti/{paziente_id}/dieta/diff", response_model=DietaDiffResponse)
+async def diff_paziente_dieta_versioni(
+    paziente_id: int,
+    from_versione: int = Query(..., alias="from", description="Versione di partenza"),
+    to_versione: int = Query(..., alias="to", description="Versione di arrivo")
+):
+    """
+    Confronta due versioni della dieta di un paziente.
+    
+    - **paziente_id**: ID del paziente
+    - **from**: Versione di partenza
+    - **to**: Versione di arrivo
+    
+    Restituisce le operazioni JSON Patch che trasformano la versione `from`
+    nella versione `to`; applicate con `PATCH /pazienti/{id}/dieta` alla
+    versione `from` la riportano alla versione `to`.
+    """
+    try:
+        operations = await diff_dieta_versioni(paziente_id, from_versione, to_versione)
+        
+        if operations is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Versione della dieta non trovata per il paziente con ID {paziente_id}"
+            )
+        
+        return DietaDiffResponse(
+            success=True,
+            from_versione=from_versione,
+            to_versione=to_versione,
+            data=operations,
+            message=f"{len(operations)} modifiche tra la versione {from_versione} e la versione {to_versione}"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nel confronto delle versioni della dieta: {str(e)}"
+        )
+
+@app.post("/pazienti/{paziente_id}/dieta/optimize", response_model=DietaOptimizeResponse)
+async def optimize_paziente_dieta(paziente_id: int, richiesta: DietaOptimizeRequest):
+    """
+    Calcola le quantità degli alimenti che rispettano gli obiettivi nutrizionali.
+    
+    - **paziente_id**: ID del paziente
+    - **dieta**: Dieta da ottimizzare, ad esempio con modifiche non ancora salvate (default: quella salvata)
+    - **giornaliero**: Intervalli `min`/`max` di kcal, proteine, lipidi, carboidrati e fibre per l'intera giornata
+    - **pasti**: Intervalli per singolo pasto, ad esempio `{"pranzo": {"kcal": {"min": 600, "max": 700}}}`
+    - **quantita_min** / **quantita_max**: Limiti in grammi della quantità di ogni alimento
+    
+    Ogni alimento principale viene scalato insieme ai suoi equivalenti. Tra le soluzioni
+    che rispettano gli obiettivi viene scelta quella più vicina alle quantità attuali;
+    se non è possibile rispettarli tutti ci si avvicina il più possibile. La dieta
+    ottimizzata viene restituita con i totali ricalcolati ma non viene salvata.
+    """
+    try:
+        dieta_data = richiesta.dieta
+        if dieta_data is None:
+            paziente_data = await get_paziente_by_id(paziente_id)
+            
+            if not paziente_data:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Paziente con ID {paziente_id} non trovato"
+                )
+            
+            dieta_data = paziente_data['dieta']
+            
+            if not dieta_data:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Dieta non trovata per il paziente con ID {paziente_id}"
+                )
+        
+        # The solver is CPU bound: keep it off the event loop
+        dieta_ottimizzata, obiettivi = await run_in_threadpool(
+            optimize_diet,
+            dieta_data,
+            giornaliero=target_ranges(richiesta.giornaliero),
+            pasti={pasto: target_ranges(obiettivi) for pasto, obiettivi in richiesta.pasti.items()},
+            quantita_min=richiesta.quantita_min,
+            quantita_max=richiesta.quantita_max
+        )
+        rispettati = sum(1 for obiettivo in obiettivi if obiettivo["rispettato"])
+        
+        return DietaOptimizeResponse(
+            success=True,
+            data=dieta_ottimizzata,
+            obiettivi=obiettivi,
+            message=f"Dieta ottimizzata: {rispettati} obiettivi rispettati su {len(obiettivi)}"
+        )
+        
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Errore di validazione: {str(ve)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nell'ottimizzazione della dieta: {str(e)}"
+        )
+
 @app.put("/pazienti/{paziente_id}/dieta", response_model=DietaResponse)
-async def update_paziente_dieta(paziente_id: int, dieta_update: DietaUpdate):
+async def update_paziente_dieta(
+    paziente_id: int,
+    dieta_update: DietaUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None)
+):
     """
     Aggiorna la dieta di un paziente specifico.
     
     - **paziente_id**: ID del paziente
     - **dieta**: Dati completi della dieta in formato JSON
+    - **If-Match** (header obbligatorio): ETag ottenuto leggendo il paziente o la dieta
+    
+    Se la dieta è stata modificata dopo la lettura viene restituito `412`.
     """
     try:
+        expected_versions = require_if_match(if_match)
+        
         # First check if paziente exists
-        paziente_data = get_paziente_by_id(paziente_id)
+        paziente_data = await get_paziente_by_id(paziente_id)
         
         if not paziente_data:
             raise HTTPException(
@@ -476,33 +1160,164 @@ async def update_paziente_dieta(paziente_id: int, dieta_update: DietaUpdate):
             )
         
         # Update diet data
-        updated_dieta = update_dieta_by_paziente_id(paziente_id, dieta_update.dieta)
+        updated = await update_dieta_by_paziente_id(paziente_id, dieta_update.dieta, expected_versions)
         
-        if not updated_dieta:
+        if not updated:
             raise HTTPException(
                 status_code=500,
                 detail="Errore durante l'aggiornamento della dieta"
             )
         
+        response.headers.update(paziente_cache_headers(updated['updated_at']))
         return DietaResponse(
             success=True,
-            data=updated_dieta,
+            data=updated['dieta'],
             message=f"Dieta aggiornata con successo per {paziente_data['nome']} {paziente_data['cognome']}"
         )
         
     except HTTPException:
         raise
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail=PRECONDITION_FAILED_DETAIL)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Errore nell'aggiornamento della dieta: {str(e)}"
         )
 
+@app.patch("/pazienti/{paziente_id}/dieta", response_model=DietaPatchResponse)
+async def patch_paziente_dieta(
+    paziente_id: int,
+    operations: List[DietaPatchOperation],
+    response: Response,
+    if_match: Optional[str] = Header(default=None)
+):
+    """
+    Aggiorna parzialmente la dieta di un paziente con una JSON Patch (RFC 6902).
+    
+    - **paziente_id**: ID del paziente
+    - **operations**: Lista di operazioni `add`, `remove`, `replace`, `move`, `copy`, `test`
+      con percorsi relativi al documento della dieta
+    
+    I totali dei pasti modificati e il totale giornaliero vengono ricalcolati dal server.
+    La risposta contiene solo le sezioni modificate della dieta.
+    
+    L'header `If-Match` è facoltativo: se presente e la dieta è stata modificata
+    dopo la lettura viene restituito `412`.
+    
+    Esempio:
+    ```json
+    [
+        {"op": "add", "path": "/pranzo/alimenti/-", "value": {"id": 1, "nome": "Pasta", "quantita": 80, "unita": "g", "kcal": 280, "proteine": 10, "lipidi": 1, "carboidrati": 58, "fibre": 2}},
+        {"op": "replace", "path": "/cena/note", "value": "Preferire verdure cotte"},
+        {"op": "remove", "path": "/colazione/alimenti/0"}
+    ]
+    ```
+    """
+    try:
+        expected_versions = versions_from_if_match(if_match) if if_match else None
+        patch = [operation.model_dump(by_alias=True, exclude_unset=True) for operation in operations]
+        patched = await patch_dieta_by_paziente_id(paziente_id, patch, expected_versions)
+        
+        if patched is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Dieta non trovata per il paziente con ID {paziente_id}"
+            )
+        
+        response.headers.update(paziente_cache_headers(patched['updated_at']))
+        return DietaPatchResponse(
+            success=True,
+            data=patched['dieta'],
+            message=f"Dieta aggiornata con successo ({len(operations)} operazioni)"
+        )
+        
+    except HTTPException:
+        raise
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail=PRECONDITION_FAILED_DETAIL)
+    except JsonPatchTestFailed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except JsonPatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nell'aggiornamento della dieta: {str(e)}"
+        )
+
+@app.post("/pazienti/{paziente_id}/dieta/import-from/{source_id}", response_model=DietaResponse)
+async def import_paziente_dieta(
+    paziente_id: int,
+    source_id: int,
+    response: Response,
+    pasti: Optional[str] = Query(default=None, description="Pasti da importare separati da virgola (default: l'intera dieta)"),
+    if_match: Optional[str] = Header(default=None)
+):
+    """
+    Importa nella dieta di un paziente la dieta di un altro paziente, o alcuni suoi pasti.
+    
+    - **paziente_id**: ID del paziente che riceve la dieta
+    - **source_id**: ID del paziente da cui copiare la dieta
+    - **pasti**: Pasti da copiare, es. `pranzo,cena` (default: l'intera dieta)
+    
+    La copia avviene interamente nel database. I pasti copiati sostituiscono
+    quelli con lo stesso nome, gli altri restano invariati, e il totale
+    giornaliero viene ricalcolato. La risposta contiene la nuova dieta.
+    
+    L'header `If-Match` è facoltativo: se presente e la dieta è stata modificata
+    dopo la lettura viene restituito `412`.
+    """
+    try:
+        expected_versions = versions_from_if_match(if_match) if if_match else None
+        
+        # First check if paziente exists
+        paziente_data = await get_paziente_by_id(paziente_id)
+        
+        if not paziente_data:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Paziente con ID {paziente_id} non trovato"
+            )
+        
+        pasti_list = parse_list_param(pasti) or None
+        copied = await copy_dieta_from_paziente(paziente_id, source_id, pasti_list, expected_versions)
+        
+        if copied is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Dieta non trovata per il paziente con ID {source_id}"
+            )
+        
+        response.headers.update(paziente_cache_headers(copied['updated_at']))
+        return DietaResponse(
+            success=True,
+            data=copied['dieta'],
+            message=(
+                f"{'Pasti ' + ', '.join(pasti_list) + ' importati' if pasti_list else 'Dieta importata'} "
+                f"dal paziente con ID {source_id} per {paziente_data['nome']} {paziente_data['cognome']}"
+            )
+        )
+        
+    except HTTPException:
+        raise
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail=PRECONDITION_FAILED_DETAIL)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Errore nell'importazione della dieta: {str(e)}"
+        )
+
 @app.post("/pazienti/{paziente_id}/dieta/{pasto}/alimenti", response_model=DietaResponse)
 async def add_alimento_to_paziente_pasto(
     paziente_id: int, 
     pasto: str, 
-    alimento_data: dict
+    alimento_data: dict,
+    response: Response,
+    if_match: Optional[str] = Header(default=None)
 ):
     """
     Aggiunge un alimento a un pasto specifico della dieta di un paziente.
@@ -525,8 +1340,13 @@ async def add_alimento_to_paziente_pasto(
         "fibre": 0
     }
     ```
+    
+    L'header `If-Match` è facoltativo: se presente e la dieta è stata modificata
+    dopo la lettura viene restituito `412`.
     """
     try:
+        expected_versions = versions_from_if_match(if_match) if if_match else None
+        
         # Validate pasto name
         valid_pasti = ["colazione", "spuntino", "pranzo", "merenda", "cena"]
         if pasto not in valid_pasti:
@@ -536,7 +1356,7 @@ async def add_alimento_to_paziente_pasto(
             )
         
         # First check if paziente exists
-        paziente_data = get_paziente_by_id(paziente_id)
+        paziente_data = await get_paziente_by_id(paziente_id)
         
         if not paziente_data:
             raise HTTPException(
@@ -574,23 +1394,29 @@ async def add_alimento_to_paziente_pasto(
                     detail=f"Il campo '{field}' deve essere un numero valido"
                 )
         
+        # Foods without a type would be left out of the meal totals
+        alimento_data.setdefault("tipo", "principale")
+        
         # Add alimento to pasto
-        updated_dieta = add_alimento_to_pasto(paziente_id, pasto, alimento_data)
+        updated = await add_alimento_to_pasto(paziente_id, pasto, alimento_data, expected_versions)
         
-        if not updated_dieta:
+        if not updated:
             raise HTTPException(
                 status_code=500,
                 detail="Errore durante l'aggiunta dell'alimento al pasto"
             )
         
+        response.headers.update(paziente_cache_headers(updated['updated_at']))
         return DietaResponse(
             success=True,
-            data=updated_dieta,
+            data=updated['dieta'],
             message=f"Alimento '{alimento_data['nome']}' aggiunto con successo al {pasto} di {paziente_data['nome']} {paziente_data['cognome']}"
         )
         
     except HTTPException:
         raise
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail=PRECONDITION_FAILED_DETAIL)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -602,12 +1428,13 @@ async def health_check():
     """Health check endpoint"""
     try:
         # Test database connection
-        get_total_count()
-        get_pazienti_total_count()
+        await get_total_count()
+        await get_pazienti_total_count()
         return {
             "status": "healthy", 
             "database": "connected", 
             "tables": ["alimenti", "pazienti"],
+            "pool": get_pool_stats(),
             "timestamp": datetime.now().isoformat()
         }
     except ConnectionError as e:
@@ -621,13 +1448,43 @@ async def health_check():
             detail=f"Service unhealthy: {type(e).__name__} - {str(e)}"
         )
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Metriche di utilizzo del servizio.
+    
+    - **pool**: dimensione, connessioni in uso/inattive, saturazione e attese del pool di connessioni al database
+    - **catalog_cache**: dimensione, completezza e hit/miss della cache in memoria del catalogo alimenti
+    - **document_renderer**: esportazioni Word in corso e in coda, rifiutate e tempi di generazione
+    - **document_cache**: documenti Word in cache (memoria e disco), hit/miss ed espulsioni
+    """
+    return {
+        "pool": get_pool_stats(),
+        "catalog_cache": get_catalog_stats(),
+        "document_renderer": document_renderer.stats(),
+        "document_cache": document_cache.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 # Export diet to Word document
 
 @app.get("/pazienti/{paziente_id}/dieta/export")
-async def export_diet_to_word(paziente_id: int, t: str = None):  # t parameter to prevent caching
+async def export_diet_to_word(
+    paziente_id: int,
+    if_none_match: Optional[str] = Header(default=None)
+):
     """
     Export a patient's diet to a Word document.
     
+    The document is built in a pool of DOCUMENT_RENDER_WORKERS workers;
+    when DOCUMENT_RENDER_QUEUE_SIZE exports are already waiting, 503 is
+    returned with Retry-After.
+    
+    Documents are cached by a hash of the patient data, the diet and the
+    template version, which is also sent as ETag: exporting an unchanged
+    diet again does not rebuild it, and If-None-Match with the same ETag
+    gets 304 Not Modified.
+    
     Args:
         paziente_id: ID of the patient
         
@@ -635,8 +1492,7 @@ async def export_diet_to_word(paziente_id: int, t: str = None):  # t parameter t
         Word document as a downloadable file
     """
     try:
-        # First check if paziente exists
-        paziente_data = get_paziente_by_id(paziente_id)
+        paziente_data = await get_paziente_by_id(paziente_id)
         
         if not paziente_data:
             raise HTTPException(
@@ -644,35 +1500,43 @@ async def export_diet_to_word(paziente_id: int, t: str = None):  # t parameter t
                 detail=f"Paziente con ID {paziente_id} non trovato"
             )
         
-        # Get diet data
-        dieta_data = get_dieta_by_paziente_id(paziente_id)
+        dieta_data = paziente_data['dieta']
         
         if not dieta_data:
             raise HTTPException(
                 status_code=404,
                 detail=f"Dieta non trovata per il paziente con ID {paziente_id}"
             )
-            
         
-        # Generate Word document
-        doc_stream = create_diet_document(paziente_data, dieta_data)
+        key = document_cache_key(paziente_data, dieta_data, document_renderer.max_combinations)
+        headers = {
+            "ETag": f'"{key}"',
+            # Browsers may keep the file but must check it is still current
+            "Cache-Control": "private, no-cache"
+        }
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        
+        document = await run_in_threadpool(document_cache.get, key)
+        if document is None:
+            # Generate Word document in a worker process
+            document = await document_renderer.render(paziente_data, dieta_data)
+            await run_in_threadpool(document_cache.put, key, document)
         
         # Return document as downloadable file
         filename = f"Piano_Nutrizionale_{paziente_data['nome']}_{paziente_data['cognome']}.docx"
+        headers["Content-Disposition"] = f"attachment; filename={filename}"
         
-        return StreamingResponse(
-            doc_stream,
+        return Response(
+            document,
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
+            headers=headers
         )
         
     except HTTPException:
         raise
+    except RendererBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(
             status_code=500,
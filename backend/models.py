@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 
 class Alimento(BaseModel):
@@ -110,6 +110,12 @@ class AlimentoCreate(BaseModel):
     maltosio_g: Optional[float] = None
     lattosio_g: Optional[float] = None
 
+class AlimentoCompleto(AlimentoCreate):
+    """Full nutrient profile of a stored food item; fields outside the requested projection are omitted"""
+    id: int
+    alimento: Optional[str] = Field(None, description="Nome dell'alimento")
+    created_at: Optional[datetime] = None
+
 # Diet models
 class AlimentoDieta(BaseModel):
     """Food item in diet with quantity and nutritional info"""
@@ -190,11 +196,19 @@ class DietaUpdate(BaseModel):
     """Model for updating diet data"""
     dieta: Dict[str, Any]
 
+class DietaPatchOperation(BaseModel):
+    """JSON Patch (RFC 6902) operation on a diet document"""
+    op: Literal["add", "remove", "replace", "move", "copy", "test"]
+    path: str
+    value: Optional[Any] = None
+    from_: Optional[str] = Field(default=None, alias="from")
+
 class AlimentoResponse(BaseModel):
     """Response model for food items"""
     success: bool
     data: list[Alimento]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
     message: Optional[str] = None
 
 class AlimentoCreateResponse(BaseModel):
@@ -203,11 +217,67 @@ class AlimentoCreateResponse(BaseModel):
     data: Alimento
     message: str
 
+class AlimentiBatchResponse(BaseModel):
+    """Response model for batch food lookups"""
+    success: bool
+    data: List[AlimentoCompleto]
+    missing: List[int]
+    message: str
+
+class AlimentoSostituto(Alimento):
+    """Substitute food with its distance from the reference and iso-caloric quantity in grams"""
+    distanza: float
+    quantita: float
+
+class AlimentiSostitutiResponse(BaseModel):
+    """Response model for substitute food lookups"""
+    success: bool
+    data: List[AlimentoSostituto]
+    message: str
+
+class BulkImportError(BaseModel):
+    """Rejected row of a bulk import"""
+    row: int
+    error: str
+
+class AlimentiBulkResponse(BaseModel):
+    """Response model for bulk food imports"""
+    success: bool
+    inserted: int
+    updated: int
+    duplicates: int
+    rejected: int
+    errors: List[BulkImportError]
+    ignored_columns: List[str]
+    message: str
+
 class PazienteResponse(BaseModel):
     """Response model for patient items"""
     success: bool
     data: list[Paziente]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+    message: Optional[str] = None
+
+class PazienteSummary(BaseModel):
+    """Patient list entry without the diet document"""
+    id: int
+    nome: str
+    cognome: str
+    eta: Optional[int] = None
+    email: Optional[str] = None
+    telefono: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    has_diet: bool
+    totale_giornaliero: Optional[Dict[str, Optional[float]]] = None
+
+class PazientiSummaryResponse(BaseModel):
+    """Response model for the patient summary list"""
+    success: bool
+    data: list[PazienteSummary]
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
     message: Optional[str] = None
 
 class PazienteCreateResponse(BaseModel):
@@ -233,10 +303,104 @@ class DietaResponse(BaseModel):
     data: Dict[str, Any]
     message: str
 
+class DietaPatchResponse(BaseModel):
+    """Response model for partial diet updates, with only the changed sections"""
+    success: bool
+    data: Dict[str, Any]
+    message: str
+
+class IntervalloNutriente(BaseModel):
+    """Range a nutrient total must fall in; either bound may be omitted"""
+    min: Optional[float] = Field(None, ge=0)
+    max: Optional[float] = Field(None, ge=0)
+
+class ObiettiviNutrienti(BaseModel):
+    """Nutrient targets of a meal or of the whole day"""
+    kcal: Optional[IntervalloNutriente] = None
+    proteine: Optional[IntervalloNutriente] = None
+    lipidi: Optional[IntervalloNutriente] = None
+    carboidrati: Optional[IntervalloNutriente] = None
+    fibre: Optional[IntervalloNutriente] = None
+
+class DietaOptimizeRequest(BaseModel):
+    """Model for optimizing the quantities of a diet"""
+    dieta: Optional[Dict[str, Any]] = Field(None, description="Dieta da ottimizzare (default: quella salvata)")
+    giornaliero: Optional[ObiettiviNutrienti] = None
+    pasti: Dict[str, ObiettiviNutrienti] = {}
+    quantita_min: float = Field(5, ge=0, description="Quantità minima di ogni alimento in grammi")
+    quantita_max: float = Field(500, gt=0, description="Quantità massima di ogni alimento in grammi")
+
+class RisultatoObiettivo(BaseModel):
+    """Final value of an optimization target"""
+    pasto: str
+    nutriente: str
+    valore: float
+    min: Optional[float] = None
+    max: Optional[float] = None
+    rispettato: bool
+
+class DietaOptimizeResponse(BaseModel):
+    """Response model for diet optimization"""
+    success: bool
+    data: Dict[str, Any]
+    obiettivi: List[RisultatoObiettivo]
+    message: str
+
+class DietaNutrientiResponse(BaseModel):
+    """Response model for the full nutrient profile of a diet"""
+    success: bool
+    nutrienti: List[str]
+    pasti: Dict[str, Dict[str, float]]
+    totale_giornaliero: Dict[str, float]
+    incompleti: List[str]
+    non_trovati: List[int]
+    message: str
+
+class DieteRecomputeResponse(BaseModel):
+    """Response model for recomputing stored diets from the catalog"""
+    success: bool
+    scanned: int
+    changed: int
+    updated: int
+    conflicts: int
+    missing_foods: int
+    message: str
+
+class DietaVersione(BaseModel):
+    """Entry of the diet history"""
+    versione: int
+    tipo: Literal["snapshot", "delta"]
+    created_at: datetime
+    dimensione: int = Field(..., description="Spazio occupato in byte")
+
+class DietaVersioniResponse(BaseModel):
+    """Response model for the diet history"""
+    success: bool
+    data: List[DietaVersione]
+    total: int
+    message: str
+
+class DietaVersioneResponse(BaseModel):
+    """Response model for a past version of a diet"""
+    success: bool
+    versione: int
+    created_at: datetime
+    data: Dict[str, Any]
+    message: str
+
+class DietaDiffResponse(BaseModel):
+    """Response model for the changes between two diet versions"""
+    success: bool
+    from_versione: int
+    to_versione: int
+    data: List[Dict[str, Any]] = Field(..., description="Operazioni JSON Patch (RFC 6902)")
+    message: str
+
 class PazientiWithDieteResponse(BaseModel):
     """Response model for patients with their diets"""
     success: bool
     data: list[Paziente]
+    next_cursor: Optional[str] = None
     message: str
 
 class ErrorResponse(BaseModel):
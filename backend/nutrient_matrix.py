@@ -0,0 +1,272 @@
+import threading
+import time
+
+import numpy as np
+
+from diet_utils import PASTI, meal_weights
+
+ENERGY_COLUMN = "energia_kcal"
+
+# Columns compared by the macro basis of substitutes(); the full basis uses
+# every nutrient except the energy columns
+MACRO_BASIS = ("proteine_totali_g", "lipidi_totali_g", "carboidrati_disponibili_g", "fibra_alimentare_totale_g")
+ENERGY_COLUMNS = (ENERGY_COLUMN, "energia_kj")
+
+
+class MissingNutrientColumnError(Exception):
+    """Raised when the alimenti table lacks a nutrient column the matrix needs"""
+
+
+class NutrientMatrix:
+    """
+    Nutrient values of every food as a dense matrix indexed by food ID.
+
+    Row i holds the values per 100 g of the food with the i-th smallest ID,
+    one column per nutrient. Unknown values are stored as 0 in values and
+    flagged in missing, so totals can be computed with a single matrix
+    product and still report which nutrients are incomplete. The matrix is
+    rebuilt from the database after ttl seconds or when invalidated.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._values = np.empty((0, 0))
+        self._missing = np.empty((0, 0), dtype=bool)
+        self._columns = []
+        self._features = {}
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        with self._lock:
+            return self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.ttl
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def load(self, columns, rows):
+        """
+        Replace the matrix contents
+
+        Args:
+            columns: Nutrient column names
+            rows: Sequence of (id, value, value, ...) tuples; None values are unknown
+        """
+        data = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns) + 1)
+        order = np.argsort(data[:, 0], kind="stable")
+        data = data[order]
+
+        values = data[:, 1:]
+        missing = np.isnan(values)
+
+        with self._lock:
+            self._ids = data[:, 0].astype(np.int64)
+            self._values = np.where(missing, 0.0, values)
+            self._missing = missing
+            self._columns = list(columns)
+            self._features = {}
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Mark the matrix as stale; the next access rebuilds it"""
+        with self._lock:
+            self._loaded_at = None
+
+    def rows(self, alimento_ids):
+        """
+        Find the matrix rows of some foods
+
+        Args:
+            alimento_ids: Array of food IDs
+
+        Returns:
+            Tuple of (row indices, boolean mask of the IDs that exist)
+        """
+        alimento_ids = np.asarray(alimento_ids, dtype=np.int64)
+        if not len(self._ids):
+            return np.zeros(len(alimento_ids), dtype=np.int64), np.zeros(len(alimento_ids), dtype=bool)
+        positions = np.searchsorted(self._ids, alimento_ids)
+        positions = np.minimum(positions, len(self._ids) - 1)
+        return positions, self._ids[positions] == alimento_ids
+
+    def values_per_100g(self, alimento_ids, fields):
+        """
+        Look up some nutrients of many foods
+
+        Args:
+            alimento_ids: Food IDs
+            fields: Pairs of (output key, nutrient column)
+
+        Returns:
+            Dictionary of food ID -> {output key: value per 100 g}, where
+            unknown values are 0; IDs missing from the catalog are left out
+        """
+        alimento_ids = list(alimento_ids)
+        with self._lock:
+            columns = [self._column_index(column) for _, column in fields]
+            positions, found = self.rows(alimento_ids)
+            values = self._values[np.ix_(positions[found], columns)]
+
+        keys = [key for key, _ in fields]
+        found_ids = [alimento_id for alimento_id, ok in zip(alimento_ids, found) if ok]
+        return {
+            alimento_id: dict(zip(keys, row))
+            for alimento_id, row in zip(found_ids, values.tolist())
+        }
+
+    def diet_totals(self, dieta: dict):
+        """
+        Compute every nutrient for each meal of a diet and for the whole day
+
+        Each food contributes its values per 100 g scaled by quantita (in
+        grams) and by its weight in the meal totals (see meal_weights).
+
+        Args:
+            dieta: Diet document
+
+        Returns:
+            Dictionary with the nutrient names (nutrienti), per-meal
+            totals (pasti), daily totals (totale_giornaliero), nutrients
+            with unknown values for some food of the day (incompleti) and
+            the IDs missing from the catalog (non_trovati)
+        """
+        ids, factors, meals = [], [], []
+        for meal_index, pasto in enumerate(PASTI):
+            meal = dieta.get(pasto)
+            if not isinstance(meal, dict):
+                continue
+            for alimento, weight in meal_weights(meal.get("alimenti") or []):
+                quantita = alimento.get("quantita")
+                if not isinstance(alimento.get("id"), int) or not isinstance(quantita, (int, float)):
+                    continue
+                ids.append(alimento["id"])
+                factors.append(quantita / 100 * weight)
+                meals.append(meal_index)
+
+        with self._lock:
+            columns = self._columns
+            positions, found = self.rows(ids)
+            positions = positions[found]
+            values = self._values[positions]
+            missing = self._missing[positions]
+
+        factors = np.asarray(factors, dtype=np.float64)[found]
+        meals = np.asarray(meals, dtype=np.int64)[found]
+
+        # weights[m, i] is how much of food i counts in meal m
+        weights = np.zeros((len(PASTI), len(factors)))
+        weights[meals, np.arange(len(factors))] = factors
+        meal_totals = weights @ values
+        daily_totals = meal_totals.sum(axis=0)
+        incomplete = (missing & (factors > 0)[:, None]).any(axis=0)
+
+        return {
+            "nutrienti": list(columns),
+            "pasti": {
+                pasto: dict(zip(columns, np.round(meal_totals[i], 2).tolist()))
+                for i, pasto in enumerate(PASTI)
+            },
+            "totale_giornaliero": dict(zip(columns, np.round(daily_totals, 2).tolist())),
+            "incompleti": [column for column, flag in zip(columns, incomplete) if flag],
+            "non_trovati": sorted({alimento_id for alimento_id, ok in zip(ids, found) if not ok}),
+        }
+
+    def substitutes(self, alimento_id: int, k: int = 10, basis: str = "macro", kcal: float = None):
+        """
+        Find the foods with the most similar nutrient profile
+
+        Profiles are compared per 100 kcal, so that foods are matched on
+        their composition rather than their energy density, after scaling
+        every nutrient to unit variance across the catalog. Unknown values
+        count as the catalog mean.
+
+        Args:
+            alimento_id: ID of the reference food
+            k: Number of substitutes to return
+            basis: 'macro' to compare macronutrients only, 'full' for every nutrient
+            kcal: Calories the substitutes must provide; defaults to 100 g of the reference
+
+        Returns:
+            List of dictionaries with id, distance and the iso-caloric
+            quantita in grams, closest first; None when the reference food
+            does not exist
+        """
+        with self._lock:
+            positions, found = self.rows([alimento_id])
+            if not found[0]:
+                return None
+            reference = positions[0]
+            ids = self._ids
+            energy = self._values[:, self._column_index(ENERGY_COLUMN)]
+            rows, features, norms = self._feature_index(basis)
+
+        if energy[reference] <= 0:
+            raise ValueError(f"L'alimento con ID {alimento_id} non ha un valore energetico")
+        if kcal is None:
+            kcal = float(energy[reference])
+
+        query = features[np.searchsorted(rows, reference)]
+        distances = norms - 2 * (features @ query) + query @ query
+        # The reference itself is at distance 0 and is never its own substitute
+        distances[rows == reference] = np.inf
+
+        k = min(k, len(rows) - 1)
+        if k <= 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+
+        return [
+            {
+                "id": int(ids[rows[i]]),
+                "distance": round(float(np.sqrt(max(distances[i], 0.0))), 4),
+                "quantita": round(kcal / float(energy[rows[i]]) * 100, 1),
+            }
+            for i in nearest
+        ]
+
+    def _column_index(self, column: str):
+        """Position of a nutrient column in the matrix (lock held)"""
+        try:
+            return self._columns.index(column)
+        except ValueError:
+            raise MissingNutrientColumnError(
+                f"La colonna {column} non è presente nella tabella alimenti: "
+                "verificare lo schema del database"
+            ) from None
+
+    def _feature_index(self, basis: str):
+        """
+        Standardized per-100-kcal profiles of the foods with known energy (lock held)
+
+        Returns:
+            Tuple of (matrix rows, float32 feature matrix, squared norms)
+        """
+        if basis not in self._features:
+            if basis == "macro":
+                columns = [self._columns.index(column) for column in MACRO_BASIS if column in self._columns]
+            elif basis == "full":
+                columns = [i for i, column in enumerate(self._columns) if column not in ENERGY_COLUMNS]
+            else:
+                raise ValueError(f"Base di confronto non valida: {basis}")
+
+            energy_index = self._column_index(ENERGY_COLUMN)
+            energy = self._values[:, energy_index]
+            rows = np.flatnonzero((energy > 0) & ~self._missing[:, energy_index])
+
+            values = self._values[np.ix_(rows, columns)] / energy[rows, None] * 100
+            known = ~self._missing[np.ix_(rows, columns)]
+            count = np.maximum(known.sum(axis=0), 1)
+            mean = np.where(known, values, 0.0).sum(axis=0) / count
+            deviations = np.where(known, values - mean, 0.0)
+            std = np.sqrt((deviations ** 2).sum(axis=0) / count)
+            std[std == 0] = 1.0
+
+            # Unknown values sit at the mean, i.e. 0 once standardized
+            features = (deviations / std).astype(np.float32)
+            self._features[basis] = (rows, features, np.einsum("ij,ij->i", features, features))
+        return self._features[basis]
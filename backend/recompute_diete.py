@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Recompute the stored diets from the current alimenti catalog
+
+Each diet item stores kcal and macros computed when it was added. After
+foods are corrected in the catalog, run this command to recompute every
+item and the meal and daily totals of all diets; only the diets that
+actually change are written back.
+
+Usage:
+    python recompute_diete.py --dry-run
+    python recompute_diete.py --batch-size 1000
+"""
+
+import argparse
+import time
+
+from config import DIETE_RECOMPUTE_BATCH_SIZE
+from database import open_db_pool, close_db_pool, recompute_diete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute stored diets from the alimenti catalog")
+    parser.add_argument("--batch-size", type=int, default=DIETE_RECOMPUTE_BATCH_SIZE,
+                        help="Diets read and written per batch")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the diets that would change")
+    args = parser.parse_args()
+
+    open_db_pool()
+    try:
+        started = time.perf_counter()
+        report = recompute_diete(batch_size=args.batch_size, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - started
+    finally:
+        close_db_pool()
+
+    print(f"Diete esaminate:   {report['scanned']}")
+    print(f"Diete da aggiornare: {report['changed']}")
+    if not args.dry_run:
+        print(f"Diete aggiornate:  {report['updated']}")
+        print(f"Conflitti:         {report['conflicts']} (modificate durante il ricalcolo, da rieseguire)")
+    print(f"Alimenti non trovati nel catalogo: {report['missing_foods']}")
+    print(f"Tempo: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ Test script for the NutriApp API
 
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_cache import AlimentiCatalog
 
 BASE_URL = "http://localhost:8000"
 
@@ -50,6 +53,47 @@ def test_search_alimenti():
             print(f"  - {item['alimento']} - {item['kcal']} kcal")
     print()
 
+def test_fuzzy_search_alimenti():
+    """Test accent-insensitive and typo-tolerant search"""
+    print("Testing fuzzy search alimenti...")
+    for term in ["caffe", "caffè", "mozarella"]:
+        response = requests.get(f"{BASE_URL}/alimenti", params={"search": term, "limit": 3})
+        print(f"Search '{term}' - Status: {response.status_code}")
+        if response.status_code == 200:
+            for item in response.json()['data']:
+                print(f"  - {item['alimento']}")
+    print()
+
+def test_catalog_search_distance():
+    """Test that cached searches rank with the distance the database computes"""
+    print("Testing catalog search distance...")
+    catalog = AlimentiCatalog()
+    catalog.load([{"id": 1, "alimento": "Pane integrale"}])
+    rows, total = catalog.search("ne", 10)
+    # SELECT 1 - (1::real / 3::real): a float4 similarity of 1/3, subtracted in float8
+    assert total == 1
+    assert rows[0]["distance"] == 0.6666666567325592
+    print()
+
+def test_alimenti_cursor_pagination():
+    """Test that keyset pagination returns the same rows as offset pagination"""
+    print("Testing alimenti cursor pagination...")
+    first_page = requests.get(f"{BASE_URL}/alimenti?limit=5").json()
+    next_cursor = first_page.get('next_cursor')
+    print(f"next_cursor: {next_cursor}")
+    if next_cursor:
+        cursor_page = requests.get(f"{BASE_URL}/alimenti", params={"limit": 5, "cursor": next_cursor}).json()
+        offset_page = requests.get(f"{BASE_URL}/alimenti?limit=5&offset=5").json()
+        cursor_ids = [item['id'] for item in cursor_page['data']]
+        offset_ids = [item['id'] for item in offset_page['data']]
+        print(f"Cursor page IDs: {cursor_ids}")
+        print(f"Offset page IDs: {offset_ids}")
+        print(f"Pages match: {cursor_ids == offset_ids}")
+    
+    response = requests.get(f"{BASE_URL}/alimenti", params={"cursor": "not-a-cursor"})
+    print(f"Invalid cursor status (expected 400): {response.status_code}")
+    print()
+
 def test_get_alimento_by_id():
     """Test getting a specific alimento by ID"""
     print("Testing get alimento by ID...")
@@ -151,6 +195,87 @@ def test_create_alimento_partial():
     print()
 
 # Pazienti tests
+def test_bulk_import_alimenti():
+    """Test importing foods in bulk from CSV"""
+    print("Testing bulk import alimenti...")
+    csv_data = (
+        "alimento,sorgente,energia_kcal,proteine_totali_g,lipidi_totali_g,carboidrati_disponibili_g,fibra_alimentare_totale_g\n"
+        "Test Bulk Mela,Test Bulk,52,0.3,0.2,14,2.4\n"
+        "Test Bulk Pera,Test Bulk,57,0.4,0.1,15,3.1\n"
+        "Test Bulk Errore,Test Bulk,non-un-numero,0,0,0,0\n"
+    )
+    
+    response = requests.post(
+        f"{BASE_URL}/alimenti/bulk",
+        data=csv_data.encode("utf-8"),
+        headers={"Content-Type": "text/csv"}
+    )
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        result = response.json()
+        print(f"Message: {result['message']}")
+        print(f"Rejected rows: {result['errors']}")
+        
+        # Importing the same file again updates instead of duplicating
+        response = requests.post(
+            f"{BASE_URL}/alimenti/bulk",
+            data=csv_data.encode("utf-8"),
+            headers={"Content-Type": "text/csv"}
+        )
+        result = response.json()
+        print(f"Second import: {result['inserted']} inseriti, {result['updated']} aggiornati")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
+def test_get_alimenti_batch():
+    """Test getting several foods by ID with a projection"""
+    print("Testing get alimenti batch...")
+    response = requests.get(f"{BASE_URL}/alimenti/batch?ids=1,2,3,999999&fields=macro")
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        data = response.json()
+        print(f"Message: {data['message']}")
+        print(f"Missing: {data['missing']}")
+        for item in data['data']:
+            print(f"  - {item['alimento']}: {item['energia_kcal']} kcal")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
+def test_get_alimento_substitutes():
+    """Test finding substitutes with a similar nutrient profile"""
+    print("Testing get alimento substitutes...")
+    response = requests.get(f"{BASE_URL}/alimenti/1/substitutes?k=5&basis=macro&kcal=100")
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        data = response.json()
+        print(f"Message: {data['message']}")
+        for item in data['data']:
+            print(f"  - {item['alimento']}: {item['quantita']} g (distanza {item['distanza']})")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
+def test_export_alimenti():
+    """Test streaming the food catalog as NDJSON"""
+    print("Testing export alimenti...")
+    response = requests.get(
+        f"{BASE_URL}/alimenti/export?format=ndjson&fields=alimento,energia_kcal",
+        stream=True
+    )
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        rows = 0
+        for line in response.iter_lines():
+            if rows < 3:
+                print(f"  {json.loads(line)}")
+            rows += 1
+        print(f"Exported rows: {rows}")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
 def test_get_pazienti():
     """Test getting pazienti list"""
     print("Testing get pazienti...")
@@ -177,6 +302,20 @@ def test_search_pazienti():
             print(f"  - {item['nome']} {item['cognome']} - {item['email']}")
     print()
 
+def test_get_pazienti_summary():
+    """Test the patient list without diets"""
+    print("Testing get pazienti summary...")
+    response = requests.get(f"{BASE_URL}/pazienti/summary?limit=3")
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        data = response.json()
+        print(f"Total: {data['total']}")
+        for item in data['data']:
+            totale = (item['totale_giornaliero'] or {}).get('totale_kcal')
+            print(f"  - {item['nome']} {item['cognome']} - dieta: {item['has_diet']} ({totale} kcal)")
+            assert 'dieta' not in item
+    print()
+
 def test_create_paziente_complete():
     """Test creating a paziente with complete data"""
     print("Testing create paziente (complete data)...")
@@ -258,7 +397,12 @@ def test_update_paziente(paziente_id):
         "note": "Paziente per dieta dimagrante - aggiornato"
     }
     
-    response = requests.put(f"{BASE_URL}/pazienti/{paziente_id}", json=update_data)
+    etag = requests.get(f"{BASE_URL}/pazienti/{paziente_id}").headers.get("ETag")
+    response = requests.put(
+        f"{BASE_URL}/pazienti/{paziente_id}",
+        json=update_data,
+        headers={"If-Match": etag}
+    )
     print(f"Status: {response.status_code}")
     if response.status_code == 200:
         result = response.json()
@@ -271,6 +415,30 @@ def test_update_paziente(paziente_id):
         print(f"Error: {response.text}")
     print()
 
+def test_paziente_conditional_requests(paziente_id):
+    """Test ETag revalidation and optimistic concurrency on a paziente"""
+    print(f"Testing conditional requests ({paziente_id})...")
+    response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta")
+    etag = response.headers.get("ETag")
+    print(f"ETag: {etag}")
+    print(f"Last-Modified: {response.headers.get('Last-Modified')}")
+    
+    response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta", headers={"If-None-Match": etag})
+    print(f"Unchanged dieta status: {response.status_code} (atteso 304)")
+    
+    response = requests.put(f"{BASE_URL}/pazienti/{paziente_id}", json={"eta": 40})
+    print(f"Update without If-Match status: {response.status_code} (atteso 428)")
+    
+    # Two tabs read the same version: the first write wins, the second conflicts
+    first = requests.put(f"{BASE_URL}/pazienti/{paziente_id}", json={"eta": 41}, headers={"If-Match": etag})
+    second = requests.put(f"{BASE_URL}/pazienti/{paziente_id}", json={"eta": 42}, headers={"If-Match": etag})
+    print(f"First write status: {first.status_code} (atteso 200)")
+    print(f"Stale write status: {second.status_code} (atteso 412)")
+    
+    response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}", headers={"If-None-Match": etag})
+    print(f"Changed paziente status: {response.status_code} (atteso 200)")
+    print()
+
 def test_delete_paziente(paziente_id):
     """Test deleting a paziente"""
     print(f"Testing delete paziente ({paziente_id})...")
@@ -319,6 +487,65 @@ def test_get_paziente_dieta():
         print(f"Error: {response.text}")
     print()
 
+def test_get_paziente_dieta_nutrients():
+    """Test computing the full nutrient profile of a diet"""
+    print("Testing get paziente dieta nutrients...")
+    paziente_id = 1
+    
+    response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta/nutrients")
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        result = response.json()
+        print(f"Message: {result['message']}")
+        totale = result['totale_giornaliero']
+        for nutriente in ("energia_kcal", "ferro_mg", "calcio_mg", "vitamina_d_ug"):
+            if nutriente in totale:
+                print(f"   {nutriente}: {totale[nutriente]}")
+        print(f"   Nutrienti incompleti: {len(result['incompleti'])}")
+        print(f"   Alimenti non trovati: {result['non_trovati']}")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
+def test_optimize_paziente_dieta():
+    """Test optimizing the quantities of a diet to meet macro targets"""
+    print("Testing optimize paziente dieta...")
+    paziente_id = 1
+    richiesta = {
+        "giornaliero": {
+            "kcal": {"min": 1800, "max": 2000},
+            "proteine": {"min": 80, "max": 120}
+        },
+        "pasti": {
+            "pranzo": {"kcal": {"min": 600, "max": 750}}
+        }
+    }
+    
+    response = requests.post(f"{BASE_URL}/pazienti/{paziente_id}/dieta/optimize", json=richiesta)
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        result = response.json()
+        print(f"Message: {result['message']}")
+        for obiettivo in result['obiettivi']:
+            stato = "✓" if obiettivo['rispettato'] else "✗"
+            print(f"   {stato} {obiettivo['pasto']} {obiettivo['nutriente']}: {obiettivo['valore']}")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
+def test_recompute_diete():
+    """Test recomputing stored diets from the catalog without saving"""
+    print("Testing recompute diete (dry run)...")
+    response = requests.post(f"{BASE_URL}/pazienti/diete/recompute?dry_run=true")
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        result = response.json()
+        print(f"Message: {result['message']}")
+        print(f"Alimenti non trovati: {result['missing_foods']}")
+    else:
+        print(f"Error: {response.text}")
+    print()
+
 def test_add_alimento_to_pasto():
     """Test adding a food item to a meal"""
     print("Testing add alimento to pasto...")
@@ -353,8 +580,199 @@ def test_add_alimento_to_pasto():
         print(f"\n🥜 Mandorle aggiunte allo spuntino!")
         print(f"   Nuovo totale spuntino: {spuntino['totale_kcal']} kcal")
         print(f"   Nuovo totale giornaliero: {dieta['totale_giornaliero']['totale_kcal']} kcal")
+        # Untyped foods are added as main foods, so they count in the totals
+        assert spuntino['alimenti'][-1]['tipo'] == "principale"
+        # The new version is returned for the next conditional write
+        assert 'ETag' in response.headers
+    else:
+        print(f"Error: {response.text}")
+    print()
+
+def test_concurrent_add_alimento_to_pasto():
+    """Test that concurrent additions to the same meal are all kept"""
+    print("Testing concurrent add alimento to pasto...")
+    response = requests.post(f"{BASE_URL}/pazienti", json={"nome": "Test", "cognome": "Concorrenza"})
+    if response.status_code != 200:
+        print(f"Error: {response.text}")
+        print()
+        return
+    paziente_id = response.json()['data']['id']
+    pasto = "pranzo"
+    additions = 20
+    
+    def add(i):
+        alimento = {
+            "id": i,
+            "nome": f"Alimento {i}",
+            "quantita": 100,
+            "unita": "g",
+            "kcal": 10,
+            "proteine": 1,
+            "lipidi": 1,
+            "carboidrati": 1,
+            "fibre": 1
+        }
+        return requests.post(f"{BASE_URL}/pazienti/{paziente_id}/dieta/{pasto}/alimenti", json=alimento).status_code
+    
+    try:
+        with ThreadPoolExecutor(max_workers=additions) as executor:
+            statuses = list(executor.map(add, range(additions)))
+        print(f"Statuses: {sorted(set(statuses))}")
+        
+        dieta = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta").json()['data']
+        count = len(dieta[pasto]['alimenti'])
+        print(f"Alimenti nel {pasto}: {count} (attesi {additions})")
+        print(f"Totale {pasto}: {dieta[pasto]['totale_kcal']} kcal (attese {additions * 10})")
+        print(f"Totale giornaliero: {dieta['totale_giornaliero']['totale_kcal']} kcal")
+        assert count == additions, "Lost update: some concurrent additions are missing"
+        assert dieta[pasto]['totale_kcal'] == additions * 10
+        print("✅ No lost updates")
+    finally:
+        requests.delete(f"{BASE_URL}/pazienti/{paziente_id}")
+    print()
+
+def test_patch_paziente_dieta():
+    """Test partial diet updates with JSON Patch"""
+    print("Testing patch paziente dieta...")
+    response = requests.post(f"{BASE_URL}/pazienti", json={"nome": "Test", "cognome": "Patch"})
+    if response.status_code != 200:
+        print(f"Error: {response.text}")
+        print()
+        return
+    paziente_id = response.json()['data']['id']
+    
+    patch = [
+        {"op": "add", "path": "/pranzo/alimenti/-", "value": {
+            "id": 1, "nome": "Pasta", "quantita": 80, "unita": "g", "tipo": "principale",
+            "kcal": 280, "proteine": 10, "lipidi": 1, "carboidrati": 58, "fibre": 2
+        }},
+        {"op": "replace", "path": "/cena/note", "value": "Preferire verdure cotte"}
+    ]
+    
+    try:
+        response = requests.patch(f"{BASE_URL}/pazienti/{paziente_id}/dieta", json=patch)
+        print(f"Status: {response.status_code}")
+        if response.status_code == 200:
+            data = response.json()['data']
+            print(f"Sezioni restituite: {sorted(data.keys())}")
+            print(f"Totale pranzo: {data['pranzo']['totale_kcal']} kcal")
+            print(f"Totale giornaliero: {data['totale_giornaliero']['totale_kcal']} kcal")
+            assert sorted(data.keys()) == ["cena", "pranzo", "totale_giornaliero"]
+            assert data['pranzo']['totale_kcal'] == 280
+        else:
+            print(f"Error: {response.text}")
+        
+        # A failing test operation leaves the diet unchanged
+        response = requests.patch(
+            f"{BASE_URL}/pazienti/{paziente_id}/dieta",
+            json=[{"op": "test", "path": "/cena/note", "value": "altro"}]
+        )
+        print(f"Failed test operation status: {response.status_code}")
+    finally:
+        requests.delete(f"{BASE_URL}/pazienti/{paziente_id}")
+    print()
+
+def test_import_paziente_dieta():
+    """Test copying meals from the diet of another patient"""
+    print("Testing import paziente dieta...")
+    response = requests.post(f"{BASE_URL}/pazienti", json={"nome": "Test", "cognome": "Import"})
+    if response.status_code != 200:
+        print(f"Error: {response.text}")
+        print()
+        return
+    paziente_id = response.json()['data']['id']
+    
+    try:
+        source = requests.get(f"{BASE_URL}/pazienti/1/dieta").json()['data']
+        response = requests.post(
+            f"{BASE_URL}/pazienti/{paziente_id}/dieta/import-from/1",
+            params={"pasti": "pranzo,cena"}
+        )
+        print(f"Status: {response.status_code}")
+        if response.status_code == 200:
+            dieta = response.json()['data']
+            print(f"Message: {response.json()['message']}")
+            print(f"Totale giornaliero: {dieta['totale_giornaliero']['totale_kcal']} kcal")
+            assert dieta['pranzo'] == source['pranzo']
+            assert dieta['colazione']['alimenti'] == []
+        else:
+            print(f"Error: {response.text}")
+        
+        response = requests.post(f"{BASE_URL}/pazienti/{paziente_id}/dieta/import-from/999999")
+        print(f"Missing source status: {response.status_code}")
+    finally:
+        requests.delete(f"{BASE_URL}/pazienti/{paziente_id}")
+    print()
+
+def test_export_dieta_word():
+    """Test the Word export of a diet, its ETag and the renderer metrics"""
+    print("Testing export dieta to Word...")
+    response = requests.get(f"{BASE_URL}/pazienti/1/dieta/export")
+    print(f"Status: {response.status_code}")
+    if response.status_code == 200:
+        print(f"Content-Type: {response.headers['content-type']}")
+        print(f"Size: {len(response.content)} bytes")
+        # A .docx file is a zip archive
+        assert response.content[:2] == b"PK"
+        
+        etag = response.headers['etag']
+        again = requests.get(f"{BASE_URL}/pazienti/1/dieta/export")
+        print(f"Same ETag on repeat: {again.headers.get('etag') == etag}")
+        cached = requests.get(f"{BASE_URL}/pazienti/1/dieta/export", headers={"If-None-Match": etag})
+        print(f"If-None-Match status: {cached.status_code}")
+        assert cached.status_code == 304
+    elif response.status_code == 503:
+        print(f"Renderer busy, Retry-After: {response.headers.get('retry-after')}")
     else:
         print(f"Error: {response.text}")
+    
+    metrics = requests.get(f"{BASE_URL}/metrics").json()
+    renderer = metrics['document_renderer']
+    print(f"Rendered: {renderer['rendered']}, queued: {renderer['queued']}, avg render: {renderer['avg_render_ms']} ms")
+    cache = metrics['document_cache']
+    print(f"Cache hits: {cache['hits']}, misses: {cache['misses']}, items: {cache['items']}")
+    print()
+
+def test_dieta_versioni():
+    """Test the diet history: list, rebuild and diff versions"""
+    print("Testing dieta versioni...")
+    response = requests.post(f"{BASE_URL}/pazienti", json={"nome": "Test", "cognome": "Versioni"})
+    if response.status_code != 200:
+        print(f"Error: {response.text}")
+        print()
+        return
+    paziente_id = response.json()['data']['id']
+    
+    try:
+        original = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta").json()['data']
+        for note in ("Prima nota", "Seconda nota"):
+            requests.patch(
+                f"{BASE_URL}/pazienti/{paziente_id}/dieta",
+                json=[{"op": "replace", "path": "/cena/note", "value": note}]
+            )
+        
+        response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta/versioni")
+        print(f"Status: {response.status_code}")
+        if response.status_code == 200:
+            versioni = response.json()['data']
+            print(f"Versioni: {[(v['versione'], v['tipo']) for v in versioni]}")
+            assert [v['versione'] for v in versioni] == [3, 2, 1]
+        else:
+            print(f"Error: {response.text}")
+        
+        response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta/versioni/1")
+        print(f"Version 1 status: {response.status_code}")
+        if response.status_code == 200:
+            assert response.json()['data'] == original
+        
+        response = requests.get(f"{BASE_URL}/pazienti/{paziente_id}/dieta/diff", params={"from": 1, "to": 3})
+        print(f"Diff status: {response.status_code}")
+        if response.status_code == 200:
+            operations = response.json()['data']
+            print(f"Operazioni: {operations}")
+            assert operations == [{"op": "replace", "path": "/cena/note", "value": "Seconda nota"}]
+    finally:
+        requests.delete(f"{BASE_URL}/pazienti/{paziente_id}")
     print()
 
 if __name__ == "__main__":
@@ -367,16 +785,24 @@ if __name__ == "__main__":
         print("=== Testing ALIMENTI endpoints ===\n")
         test_get_alimenti()
         test_search_alimenti()
+        test_fuzzy_search_alimenti()
+        test_catalog_search_distance()
+        test_alimenti_cursor_pagination()
         test_get_alimento_by_id()
+        test_get_alimenti_batch()
+        test_get_alimento_substitutes()
         
         print("=== Testing CREATE ALIMENTI endpoints ===\n")
         test_create_alimento_minimal()
         test_create_alimento_complete()
         test_create_alimento_partial()
+        test_bulk_import_alimenti()
+        test_export_alimenti()
         
         print("=== Testing PAZIENTI endpoints ===\n")
         test_get_pazienti()
         test_search_pazienti()
+        test_get_pazienti_summary()
         test_create_paziente_minimal()
         
         # Test complete CRUD operations
@@ -384,13 +810,22 @@ if __name__ == "__main__":
         if paziente_id:
             test_get_paziente_by_id(paziente_id)
             test_update_paziente(paziente_id)
+            test_paziente_conditional_requests(paziente_id)
             test_delete_paziente(paziente_id)
         
         test_get_nonexistent_paziente()
         
         print("=== Testing DIETA endpoints ===\n")
         test_get_paziente_dieta()
+        test_get_paziente_dieta_nutrients()
+        test_optimize_paziente_dieta()
+        test_recompute_diete()
         test_add_alimento_to_pasto()
+        test_concurrent_add_alimento_to_pasto()
+        test_patch_paziente_dieta()
+        test_import_paziente_dieta()
+        test_dieta_versioni()
+        test_export_dieta_word()
         
         print("🎉 All tests completed!")
         
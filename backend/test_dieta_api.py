@@ -6,19 +6,20 @@ import sys
 BASE_URL = "http://localhost:8000"
 
 def get_patient_diet(patient_id):
-    """Get a patient's diet"""
+    """Get a patient's diet and its ETag"""
     response = requests.get(f"{BASE_URL}/pazienti/{patient_id}/dieta")
     if response.status_code == 200:
-        return response.json()
+        return response.json(), response.headers.get("ETag")
     else:
         print(f"Error getting diet: {response.status_code} - {response.text}")
-        return None
+        return None, None
 
-def update_patient_diet(patient_id, diet_data):
-    """Update a patient's diet"""
+def update_patient_diet(patient_id, diet_data, etag):
+    """Update a patient's diet, provided it has not changed since it was read"""
     response = requests.put(
         f"{BASE_URL}/pazienti/{patient_id}/dieta", 
-        json={"dieta": diet_data}
+        json={"dieta": diet_data},
+        headers={"If-Match": etag}
     )
     if response.status_code == 200:
         return response.json()
@@ -38,7 +39,7 @@ def main():
         return
     
     # Get current diet
-    diet_response = get_patient_diet(patient_id)
+    diet_response, etag = get_patient_diet(patient_id)
     if not diet_response or not diet_response.get("success"):
         print("Failed to get diet data")
         return
@@ -53,7 +54,7 @@ def main():
     diet_data["cena"]["note"] = "Preferire proteine magre e verdure cotte."
     
     # Update diet with notes
-    update_response = update_patient_diet(patient_id, diet_data)
+    update_response = update_patient_diet(patient_id, diet_data, etag)
     
     if update_response and update_response.get("success"):
         print("Diet updated successfully with notes!")
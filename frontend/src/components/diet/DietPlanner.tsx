@@ -138,29 +138,30 @@ const DietPlanner: React.FC = () => {
     setDiet(updatedDiet);
   };
   
-  const handleImportFullDiet = (data: { pazienteId: number, mealName?: string, diet: Dieta | Pasto }) => {
+  const handleImportFullDiet = (data: { pazienteId: number, mealName?: string, pasti?: string[], diet: Dieta | Pasto }) => {
     if (!diet || !data.diet) return;
     
     // If we're importing a full diet
     if ('colazione' in data.diet) {
-      // Create a new diet with imported data, ensuring correct structure
-      const importedDiet: Dieta = {
-        colazione: ensureValidMeal(data.diet.colazione),
-        spuntino: ensureValidMeal(data.diet.spuntino),
-        pranzo: ensureValidMeal(data.diet.pranzo),
-        merenda: ensureValidMeal(data.diet.merenda),
-        cena: ensureValidMeal(data.diet.cena),
-        totale_giornaliero: {
-          totale_kcal: typeof data.diet.totale_giornaliero?.totale_kcal === 'number' ? data.diet.totale_giornaliero.totale_kcal : 0,
-          totale_proteine: typeof data.diet.totale_giornaliero?.totale_proteine === 'number' ? data.diet.totale_giornaliero.totale_proteine : 0,
-          totale_lipidi: typeof data.diet.totale_giornaliero?.totale_lipidi === 'number' ? data.diet.totale_giornaliero.totale_lipidi : 0,
-          totale_carboidrati: typeof data.diet.totale_giornaliero?.totale_carboidrati === 'number' ? data.diet.totale_giornaliero.totale_carboidrati : 0,
-          totale_fibre: typeof data.diet.totale_giornaliero?.totale_fibre === 'number' ? data.diet.totale_giornaliero.totale_fibre : 0
-        },
-        note: notes || data.diet.note
-      };
+      const importedDiet = data.diet;
+      const meals = ['colazione', 'spuntino', 'pranzo', 'merenda', 'cena'] as const;
+      // Without a selection every meal was imported
+      const importedMeals = data.pasti && data.pasti.length > 0
+        ? meals.filter(meal => data.pasti!.includes(meal))
+        : meals;
+      
+      // Only the imported meals are replaced, so that unsaved changes to
+      // the other meals are kept, like handleImportMeal does
+      const updatedDiet: Dieta = { ...diet };
+      importedMeals.forEach(meal => {
+        updatedDiet[meal] = ensureValidMeal(importedDiet[meal]);
+      });
+      if (importedMeals.length === meals.length) {
+        updatedDiet.note = notes || importedDiet.note;
+      }
+      updatedDiet.totale_giornaliero = calculateDailyTotals(updatedDiet);
       
-      setDiet(importedDiet);
+      setDiet(updatedDiet);
     }
     
     setImportDialogOpen(false);
@@ -5,15 +5,15 @@ import {
   FormControl, InputLabel, Select, MenuItem, FormHelperText,
   Divider, List, ListItem, ListItemText, ListItemIcon, Checkbox
 } from '@mui/material';
-import { Paziente, Dieta, Pasto } from '../../types';
-import { pazientiApi } from '../../services/api';
+import { PazienteSummary, Dieta, Pasto } from '../../types';
+import { pazientiApi, dietaApi } from '../../services/api';
 
 interface ImportDietDialogProps {
   open: boolean;
   onClose: () => void;
   currentPazienteId: number;
   mealName?: string;
-  onImport: (data: { pazienteId: number, mealName?: string, diet: Dieta | Pasto }) => void;
+  onImport: (data: { pazienteId: number, mealName?: string, pasti?: string[], diet: Dieta | Pasto }) => void;
 }
 
 const ImportDietDialog: React.FC<ImportDietDialogProps> = ({ 
@@ -24,7 +24,8 @@ const ImportDietDialog: React.FC<ImportDietDialogProps> = ({
   onImport 
 }) => {
   const [loading, setLoading] = useState(false);
-  const [pazienti, setPazienti] = useState<Paziente[]>([]);
+  const [importing, setImporting] = useState(false);
+  const [pazienti, setPazienti] = useState<PazienteSummary[]>([]);
   const [selectedPazienteId, setSelectedPazienteId] = useState<number | ''>('');
   const [selectedMeals, setSelectedMeals] = useState<string[]>([]);
   
@@ -40,9 +41,9 @@ const ImportDietDialog: React.FC<ImportDietDialogProps> = ({
   const fetchPazientiWithDiete = async () => {
     setLoading(true);
     try {
-      const response = await pazientiApi.getPazientiWithDiete();
-      // Filter out the current patient
-      const filteredPazienti = response.data.filter(p => p.id !== currentPazienteId);
+      const response = await pazientiApi.getPazientiSummary(1000);
+      // Only other patients with a diet to import
+      const filteredPazienti = response.data.filter(p => p.has_diet && p.id !== currentPazienteId);
       setPazienti(filteredPazienti);
     } catch (error) {
       console.error('Error fetching patients with diets:', error);
@@ -69,98 +70,35 @@ const ImportDietDialog: React.FC<ImportDietDialogProps> = ({
     setSelectedMeals(newSelectedMeals);
   };
 
-  const handleImport = () => {
+  const handleImport = async () => {
     if (selectedPazienteId === '') return;
 
-    const selectedPaziente = pazienti.find(p => p.id === selectedPazienteId);
-    if (!selectedPaziente || !selectedPaziente.dieta) return;
+    // The copy is made and saved by the server, which returns the new diet
+    const pasti = isSingleMealMode && mealName ? [mealName] : selectedMeals;
+    setImporting(true);
+    try {
+      const dieta = await dietaApi.importDieta(currentPazienteId, selectedPazienteId as number, pasti);
 
-    if (isSingleMealMode && mealName) {
-      // Import a single meal
-      const mealToImport = selectedPaziente.dieta[mealName as keyof Dieta];
-      
-      // Ensure the meal has the correct structure
-      if (mealToImport && typeof mealToImport === 'object' && mealToImport !== null && 'alimenti' in mealToImport) {
+      if (isSingleMealMode && mealName) {
         onImport({
           pazienteId: selectedPazienteId as number,
           mealName,
-          diet: {
-            ...mealToImport,
-            // Ensure alimenti is an array
-            alimenti: Array.isArray(mealToImport.alimenti) ? mealToImport.alimenti : []
-          } as Pasto
+          diet: dieta[mealName as keyof Dieta] as Pasto
         });
       } else {
-        console.error('Invalid meal structure:', mealToImport);
-        alert('Errore: struttura del pasto non valida');
-      }
-    } else {
-      // Import multiple meals or entire diet
-      const dietToImport = { ...selectedPaziente.dieta } as Dieta;
-      
-      // Ensure all meals have the correct structure
-      const mealKeys = ['colazione', 'spuntino', 'pranzo', 'merenda', 'cena'] as const;
-      mealKeys.forEach(key => {
-        if (dietToImport[key]) {
-          dietToImport[key] = {
-            ...dietToImport[key],
-            alimenti: Array.isArray(dietToImport[key].alimenti) ? dietToImport[key].alimenti : []
-          };
-        } else {
-          // Create empty meal if it doesn't exist
-          dietToImport[key] = {
-            alimenti: [],
-            totale_kcal: 0,
-            totale_proteine: 0,
-            totale_lipidi: 0,
-            totale_carboidrati: 0,
-            totale_fibre: 0
-          };
-        }
-      });
-      
-      // If specific meals are selected, only include those
-      if (selectedMeals.length > 0) {
-        const filteredDiet = {} as Dieta;
-        
-        // Initialize all meals as empty
-        mealKeys.forEach(key => {
-          filteredDiet[key] = {
-            alimenti: [],
-            totale_kcal: 0,
-            totale_proteine: 0,
-            totale_lipidi: 0,
-            totale_carboidrati: 0,
-            totale_fibre: 0
-          };
-        });
-        
-        // Copy only selected meals
-        selectedMeals.forEach(meal => {
-          const mealKey = meal as keyof Dieta;
-          if (dietToImport[mealKey]) {
-            // Type assertion to ensure TypeScript understands we're assigning compatible types
-            filteredDiet[mealKey] = dietToImport[mealKey] as any;
-          }
-        });
-        
-        // Copy totals
-        filteredDiet.totale_giornaliero = dietToImport.totale_giornaliero;
-        
         onImport({
           pazienteId: selectedPazienteId as number,
-          diet: filteredDiet
-        });
-      } else {
-        // Import entire diet
-        onImport({
-          pazienteId: selectedPazienteId as number,
-          diet: dietToImport
+          pasti,
+          diet: dieta
         });
       }
+      onClose();
+    } catch (error) {
+      console.error('Error importing diet:', error);
+      alert("Errore durante l'importazione della dieta");
+    } finally {
+      setImporting(false);
     }
-    
-    onClose();
   };
 
   const getMealLabel = (mealName: string): string => {
@@ -221,7 +159,7 @@ const ImportDietDialog: React.FC<ImportDietDialogProps> = ({
                   Seleziona i pasti da importare:
                 </Typography>
                 <Typography variant="body2" color="text.secondary" sx={{ mb: 2 }}>
-                  Se non selezioni nessun pasto, verrà importata l'intera dieta.
+                  Se non selezioni nessun pasto, verrà importata l'intera dieta; i pasti non selezionati restano invariati.
                 </Typography>
                 <List>
                   {['colazione', 'spuntino', 'pranzo', 'merenda', 'cena'].map((meal) => (
@@ -253,7 +191,7 @@ const ImportDietDialog: React.FC<ImportDietDialogProps> = ({
         <Button 
           onClick={handleImport}
           variant="contained" 
-          disabled={loading || selectedPazienteId === ''}
+          disabled={loading || importing || selectedPazienteId === ''}
         >
           Importa
         </Button>
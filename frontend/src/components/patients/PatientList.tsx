@@ -13,10 +13,10 @@ import {
 } from '@mui/icons-material';
 import { useNavigate } from 'react-router-dom';
 import { pazientiApi } from '../../services/api';
-import { Paziente } from '../../types';
+import { PazienteSummary } from '../../types';
 
 const PatientList: React.FC = () => {
-  const [patients, setPatients] = useState<Paziente[]>([]);
+  const [patients, setPatients] = useState<PazienteSummary[]>([]);
   const [total, setTotal] = useState(0);
   const [page, setPage] = useState(0);
   const [rowsPerPage, setRowsPerPage] = useState(10);
@@ -27,7 +27,7 @@ const PatientList: React.FC = () => {
   const fetchPatients = async () => {
     setLoading(true);
     try {
-      const response = await pazientiApi.getPazienti(
+      const response = await pazientiApi.getPazientiSummary(
         rowsPerPage, 
         page * rowsPerPage, 
         search
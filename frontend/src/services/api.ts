@@ -1,8 +1,9 @@
 import axios from 'axios';
 import { 
-  Alimento, AlimentoResponse, AlimentoCreate,
-  Paziente, PazienteResponse, PazienteCreate, PazienteUpdate,
-  Dieta, DietaResponse, AlimentoDieta
+  Alimento, AlimentoResponse, AlimentoCreate, AlimentoCompleto, AlimentoSostituto,
+  Paziente, PazienteResponse, PazienteCreate, PazienteUpdate, PazientiSummaryResponse,
+  Dieta, DietaResponse, AlimentoDieta, DietaPatchOperation, DietaNutrienti,
+  DietaOptimizeRequest, RisultatoObiettivo, DietaVersione
 } from '../types';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
@@ -15,6 +16,28 @@ const api = axios.create({
   },
 });
 
+// ETags of patient rows (shared by a patient and its diet), sent back as
+// If-Match on writes so that saving over a newer version fails with 412
+const pazienteEtags = new Map<number, string>();
+
+const rememberEtag = (pazienteId: number, headers: any) => {
+  const etag = headers?.etag;
+  if (etag) {
+    pazienteEtags.set(pazienteId, etag);
+  }
+};
+
+// Writes without a previously read version read the patient first, so that
+// they stay conditional instead of overwriting whatever version is stored
+const ifMatch = async (pazienteId: number) => {
+  if (!pazienteEtags.has(pazienteId)) {
+    const response = await api.get(`/pazienti/${pazienteId}`);
+    rememberEtag(pazienteId, response.headers);
+  }
+  const etag = pazienteEtags.get(pazienteId);
+  return etag ? { 'If-Match': etag } : {};
+};
+
 // Alimenti API
 export const alimentiApi = {
   getAlimenti: async (limit = 100, offset = 0, search?: string): Promise<AlimentoResponse> => {
@@ -28,6 +51,25 @@ export const alimentiApi = {
     return response.data;
   },
 
+  // fields: 'full', 'macro' or a list of columns
+  getAlimentiBatch: async (ids: number[], fields: string | string[] = 'full'): Promise<AlimentoCompleto[]> => {
+    const params = { ids: ids.join(','), fields: Array.isArray(fields) ? fields.join(',') : fields };
+    const response = await api.get('/alimenti/batch', { params });
+    return response.data.data;
+  },
+
+  // Foods with the closest nutrient profile, with the grams that provide kcal
+  getSubstitutes: async (
+    id: number,
+    k = 10,
+    basis: 'macro' | 'full' = 'macro',
+    kcal?: number
+  ): Promise<AlimentoSostituto[]> => {
+    const params = { k, basis, ...(kcal && { kcal }) };
+    const response = await api.get(`/alimenti/${id}/substitutes`, { params });
+    return response.data.data;
+  },
+
   createAlimento: async (alimento: AlimentoCreate): Promise<Alimento> => {
     const response = await api.post('/alimenti', alimento);
     return response.data.data;
@@ -42,8 +84,16 @@ export const pazientiApi = {
     return response.data;
   },
 
+  // Same listing as getPazienti without the diets, for lists and pickers
+  getPazientiSummary: async (limit = 100, offset = 0, search?: string): Promise<PazientiSummaryResponse> => {
+    const params = { limit, offset, ...(search && { search }) };
+    const response = await api.get('/pazienti/summary', { params });
+    return response.data;
+  },
+
   getPazienteById: async (id: number): Promise<Paziente> => {
     const response = await api.get(`/pazienti/${id}`);
+    rememberEtag(id, response.headers);
     return response.data;
   },
 
@@ -59,7 +109,8 @@ export const pazientiApi = {
   },
 
   updatePaziente: async (id: number, paziente: PazienteUpdate): Promise<Paziente> => {
-    const response = await api.put(`/pazienti/${id}`, paziente);
+    const response = await api.put(`/pazienti/${id}`, paziente, { headers: await ifMatch(id) });
+    rememberEtag(id, response.headers);
     return response.data.data;
   },
 
@@ -72,11 +123,62 @@ export const pazientiApi = {
 export const dietaApi = {
   getDieta: async (pazienteId: number): Promise<Dieta> => {
     const response = await api.get(`/pazienti/${pazienteId}/dieta`);
+    rememberEtag(pazienteId, response.headers);
     return response.data.data;
   },
 
   updateDieta: async (pazienteId: number, dieta: Dieta): Promise<Dieta> => {
-    const response = await api.put(`/pazienti/${pazienteId}/dieta`, { dieta });
+    const response = await api.put(`/pazienti/${pazienteId}/dieta`, { dieta }, { headers: await ifMatch(pazienteId) });
+    rememberEtag(pazienteId, response.headers);
+    return response.data.data;
+  },
+
+  // Returns only the changed meals and the daily totals
+  patchDieta: async (pazienteId: number, operations: DietaPatchOperation[]): Promise<Partial<Dieta>> => {
+    const response = await api.patch(`/pazienti/${pazienteId}/dieta`, operations, { headers: await ifMatch(pazienteId) });
+    rememberEtag(pazienteId, response.headers);
+    return response.data.data;
+  },
+
+  getDietaNutrients: async (pazienteId: number): Promise<DietaNutrienti> => {
+    const response = await api.get(`/pazienti/${pazienteId}/dieta/nutrients`);
+    return response.data;
+  },
+
+  // The optimised diet is not saved: call updateDieta to keep it
+  optimizeDieta: async (
+    pazienteId: number,
+    richiesta: DietaOptimizeRequest
+  ): Promise<{ dieta: Dieta; obiettivi: RisultatoObiettivo[] }> => {
+    const response = await api.post(`/pazienti/${pazienteId}/dieta/optimize`, richiesta);
+    return { dieta: response.data.data, obiettivi: response.data.obiettivi };
+  },
+
+  getDietaVersioni: async (pazienteId: number, limit = 100, offset = 0): Promise<{ data: DietaVersione[]; total: number }> => {
+    const response = await api.get(`/pazienti/${pazienteId}/dieta/versioni`, { params: { limit, offset } });
+    return { data: response.data.data, total: response.data.total };
+  },
+
+  getDietaVersione: async (pazienteId: number, versione: number): Promise<Dieta> => {
+    const response = await api.get(`/pazienti/${pazienteId}/dieta/versioni/${versione}`);
+    return response.data.data;
+  },
+
+  // JSON Patch turning version `from` into version `to`
+  diffDietaVersioni: async (pazienteId: number, from: number, to: number): Promise<DietaPatchOperation[]> => {
+    const response = await api.get(`/pazienti/${pazienteId}/dieta/diff`, { params: { from, to } });
+    return response.data.data;
+  },
+
+  // Copies the diet of another patient (or only some meals) on the server and saves it
+  importDieta: async (pazienteId: number, sourceId: number, pasti?: string[]): Promise<Dieta> => {
+    const params = pasti && pasti.length > 0 ? { pasti: pasti.join(',') } : {};
+    const response = await api.post(
+      `/pazienti/${pazienteId}/dieta/import-from/${sourceId}`,
+      null,
+      { params, headers: await ifMatch(pazienteId) }
+    );
+    rememberEtag(pazienteId, response.headers);
     return response.data.data;
   },
 
@@ -87,15 +189,16 @@ export const dietaApi = {
   ): Promise<Dieta> => {
     const response = await api.post(
       `/pazienti/${pazienteId}/dieta/${pasto}/alimenti`, 
-      alimento
+      alimento,
+      { headers: await ifMatch(pazienteId) }
     );
+    rememberEtag(pazienteId, response.headers);
     return response.data.data;
   },
   
   exportDietaToWord: (pazienteId: number): string => {
-    // Add timestamp to prevent caching
-    const timestamp = new Date().getTime();
-    return `${API_URL}/pazienti/${pazienteId}/dieta/export?t=${timestamp}`;
+    // The server revalidates with ETag, so an unchanged diet is not rebuilt
+    return `${API_URL}/pazienti/${pazienteId}/dieta/export`;
   },
 };
 
@@ -10,10 +10,16 @@ export interface Alimento {
   sorgente: string | null;
 }
 
+export interface AlimentoSostituto extends Alimento {
+  distanza: number;
+  quantita: number;
+}
+
 export interface AlimentoResponse {
   success: boolean;
   data: Alimento[];
   total: number;
+  next_cursor?: string | null;
   message?: string;
 }
 
@@ -27,6 +33,13 @@ export interface AlimentoCreate {
   fibra_alimentare_totale_g?: number;
 }
 
+// Full nutrient profile from /alimenti/batch: only the requested columns are present
+export interface AlimentoCompleto extends Partial<AlimentoCreate> {
+  id: number;
+  created_at?: string;
+  [campo: string]: string | number | null | undefined;
+}
+
 // Diet types
 export interface AlimentoDieta {
   id: number;
@@ -78,6 +91,56 @@ export interface DietaResponse {
   message: string;
 }
 
+// JSON Patch (RFC 6902) operation on a diet document
+export interface DietaPatchOperation {
+  op: 'add' | 'remove' | 'replace' | 'move' | 'copy' | 'test';
+  path: string;
+  value?: any;
+  from?: string;
+}
+
+// Entry of the diet history; tipo tells whether the full diet or a patch is stored
+export interface DietaVersione {
+  versione: number;
+  tipo: 'snapshot' | 'delta';
+  created_at: string;
+  dimensione: number;
+}
+
+// Every nutrient column of alimenti, per meal and for the whole day
+export interface DietaNutrienti {
+  nutrienti: string[];
+  pasti: Record<string, Record<string, number>>;
+  totale_giornaliero: Record<string, number>;
+  incompleti: string[];
+  non_trovati: number[];
+}
+
+// Range a nutrient total must fall in; either bound may be omitted
+export interface IntervalloNutriente {
+  min?: number;
+  max?: number;
+}
+
+export type ObiettiviNutrienti = Partial<Record<'kcal' | 'proteine' | 'lipidi' | 'carboidrati' | 'fibre', IntervalloNutriente>>;
+
+export interface DietaOptimizeRequest {
+  dieta?: Dieta;
+  giornaliero?: ObiettiviNutrienti;
+  pasti?: Partial<Record<'colazione' | 'spuntino' | 'pranzo' | 'merenda' | 'cena', ObiettiviNutrienti>>;
+  quantita_min?: number;
+  quantita_max?: number;
+}
+
+export interface RisultatoObiettivo {
+  pasto: string;
+  nutriente: string;
+  valore: number;
+  min: number | null;
+  max: number | null;
+  rispettato: boolean;
+}
+
 // Patient types
 export interface Paziente {
   id: number;
@@ -92,10 +155,33 @@ export interface Paziente {
   updated_at: string;
 }
 
+// Patient list entry without the diet; has_diet is true when any meal has foods
+export interface PazienteSummary {
+  id: number;
+  nome: string;
+  cognome: string;
+  eta?: number | null;
+  email?: string | null;
+  telefono?: string | null;
+  created_at: string;
+  updated_at: string;
+  has_diet: boolean;
+  totale_giornaliero?: Partial<TotaleGiornaliero> | null;
+}
+
+export interface PazientiSummaryResponse {
+  success: boolean;
+  data: PazienteSummary[];
+  total: number;
+  next_cursor?: string | null;
+  message?: string;
+}
+
 export interface PazienteResponse {
   success: boolean;
   data: Paziente[];
   total: number;
+  next_cursor?: string | null;
   message?: string;
 }
 